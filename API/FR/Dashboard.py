@@ -5,17 +5,21 @@ from typing import List, Optional
 import aiohttp
 
 from API.FR.FR_API import fetch_all_ranges
-from DATABASE.FR.FR import LivePositions
-from Utils import AsyncSessionLocal, BASE_URL, get_today_range_utc, get_earliest_time, MAX_REG_PER_BATCH, HEADERS, \
-    write_csv, parse_dt, ensure_naive_utc
+from Positions import PositionWriter, save_live_positions
+from Utils import AsyncSessionLocal, fr24_get, get_today_range_utc, get_earliest_time, MAX_REG_PER_BATCH, \
+    parse_dt, ensure_naive_utc, get_rate_limiter
+from Sinks import CsvSink, ParquetSink, LIVE_POSITION_FIELDS, FILE_STORAGE_MODES
+from DATABASE import LivePositions
 
 _last_flights: Optional[List[dict]] = None
 
 
 async def dashboard_loop(regs: List[str], http: aiohttp.ClientSession, first_run: bool, storage_mode: str,
-        csv_path: Optional[str] = None):
+        sink: Optional[CsvSink | ParquetSink] = None, positions: Optional[PositionWriter] = None):
     global _last_flights
 
+    positions = positions or PositionWriter()
+
     if first_run:
         start_date, end_date = get_today_range_utc()
     else:
@@ -49,8 +53,9 @@ async def dashboard_loop(regs: List[str], http: aiohttp.ClientSession, first_run
             "flights": ",".join(flight_batch),
             "limit": 20000
         }
+        await get_rate_limiter().acquire()
         async with AsyncSessionLocal() as session:
-            async with http.get(f"{BASE_URL}/live/flight-positions/full", headers=HEADERS, params=params) as resp:
+            async with fr24_get(http, "/live/flight-positions/full", params) as resp:
                 try:
                     if resp.status != 200:
                         print(f"❌ Error {resp.status}: {await resp.text()}")
@@ -66,7 +71,7 @@ async def dashboard_loop(regs: List[str], http: aiohttp.ClientSession, first_run
                         break
 
                     flights = []
-                    csv_rows = []
+                    file_rows = []
 
                     for flight in flights_data:
                         row_data = {
@@ -80,7 +85,7 @@ async def dashboard_loop(regs: List[str], http: aiohttp.ClientSession, first_run
                             "gspeed": flight.get("gspeed"),
                             "vspeed": flight.get("vspeed"),
                             "squawk": flight.get("squawk"),
-                            "timestamp": ensure_naive_utc(parse_dt(flight.get("datetime_landed"))),
+                            "timestamp": ensure_naive_utc(parse_dt(flight.get("timestamp"))),
                             "source": flight.get("source"),
                             "hex": flight.get("hex"),
                             "type": flight.get("type"),
@@ -91,41 +96,60 @@ async def dashboard_loop(regs: List[str], http: aiohttp.ClientSession, first_run
                             "orig_icao": flight.get("orig_icao"),
                             "dest_iata": flight.get("dest_iata"),
                             "dest_icao": flight.get("dest_icao"),
-                            "eta": ensure_naive_utc(parse_dt(flight.get("datetime_landed")))
+                            "eta": ensure_naive_utc(parse_dt(flight.get("eta")))
                         }
 
                         if storage_mode in ("db", "both"):
-                            flights.append(LivePositions(**row_data))
-                        if storage_mode in ("csv", "both"):
-                            csv_rows.append(row_data)
+                            flights.append(row_data)
+                        if storage_mode in FILE_STORAGE_MODES:
+                            file_rows.append(row_data)
 
                 except Exception as e:
                     print(f"⚠️ Record processing error: {e}")
 
                 if flights and storage_mode in ("db", "both"):
-                    session.add_all(flights)
-                    await session.commit()
-                    print(f"💾 Saved {len(flights)} new records to DB.")
+                    saved = await save_live_positions(session, flights)
+                    await positions.add(flights)
+                    print(f"💾 Saved latest positions of {saved} flights to DB.")
+
+                if file_rows and storage_mode in FILE_STORAGE_MODES and sink:
+                    sink.write(file_rows)
+                    print(f"📄 Queued {len(file_rows)} records for {storage_mode} output.")
 
-                if csv_rows and storage_mode in ("csv", "both") and csv_path:
-                    write_csv(csv_rows, csv_path)
-                    print(f"📄 Appended {len(csv_rows)} records to CSV.")
+    # Points of this poll are not kept in memory until the next one
+    await positions.flush()
+    if sink:
+        sink.flush()
 
 
 async def main_loop(regs: List[str], hours: int = 2, storage_mode: str = "db",
-                    csv_path: Optional[str] = f"output/live_{datetime.strftime(datetime.now(), '%Y%m%d_%H%M')}.csv"):
+                    csv_path: Optional[str] = f"output/live_{datetime.strftime(datetime.now(), '%Y%m%d_%H%M')}.csv",
+                    parquet_dir: Optional[str] = "output/live_parquet"):
     last_run_date: datetime | None = None
 
-    while True:
-        now = datetime.now(timezone.utc)
-
-        first_run = (last_run_date != now)
-        last_run_date = now
-
-        async with aiohttp.ClientSession() as http:
-            await dashboard_loop(first_run=first_run, regs=regs, http=http, storage_mode=storage_mode, csv_path=csv_path)
-
-        await asyncio.sleep(hours * 3600)
+    sink = None
+    if storage_mode == "parquet" and parquet_dir:
+        sink = ParquetSink(parquet_dir, LivePositions, LIVE_POSITION_FIELDS, date_field="timestamp")
+    elif storage_mode in ("csv", "both") and csv_path:
+        # One file per day of polling
+        sink = CsvSink(csv_path, LIVE_POSITION_FIELDS, rotate_interval=24 * 3600)
+    positions = PositionWriter()
+
+    try:
+        while True:
+            now = datetime.now(timezone.utc)
+
+            first_run = (last_run_date != now)
+            last_run_date = now
+
+            async with aiohttp.ClientSession() as http:
+                await dashboard_loop(first_run=first_run, regs=regs, http=http, storage_mode=storage_mode,
+                                     sink=sink, positions=positions)
+
+            await asyncio.sleep(hours * 3600)
+    finally:
+        if sink:
+            sink.close()
 
 
 
@@ -2,11 +2,37 @@ import asyncio
 from datetime import datetime, timedelta
 from typing import List, Optional
 import aiohttp
-from sqlalchemy import select
-
-from Utils import SECONDS_BETWEEN_REQUESTS, HEADERS, parse_dt, ensure_naive_utc, RANGE_DAYS, MAX_REG_PER_BATCH, \
-    AsyncSessionLocal, BASE_URL, parse_date_or_datetime, write_csv
-from DATABASE import FlightSummary
+from sqlalchemy.dialects.postgresql import insert
+
+from Utils import parse_dt, ensure_naive_utc, RANGE_DAYS, MAX_REG_PER_BATCH, MAX_CONCURRENT_RANGES, \
+    AsyncSessionLocal, engine, fr24_get, parse_date_or_datetime, get_rate_limiter, rate_limit_backoff, \
+    RateLimitedError
+from Sinks import CsvSink, ParquetSink, FLIGHT_SUMMARY_FIELDS, FILE_STORAGE_MODES
+from DATABASE import FlightSummary, ensure_month_partitions
+
+
+async def save_flights(session, rows: List[dict]) -> set[str]:
+    """
+    Inserts flights, rows with (fr24_id, datetime_takeoff) already in DataBase are skipped by the unique constraint.
+    Partitions for the rows' months must exist, see ensure_month_partitions
+
+    :param session: FR DataBase session
+    :param rows: flight summary rows with datetime_takeoff, unique by fr24_id
+    :return: fr24_id of inserted rows
+    """
+    max_params_per_chunk = 30000
+    safe_chunk_size = max_params_per_chunk // len(rows[0])
+
+    inserted_ids = set()
+    for i in range(0, len(rows), safe_chunk_size):
+        stmt = insert(FlightSummary).values(rows[i:i + safe_chunk_size])
+        stmt = stmt.on_conflict_do_nothing(
+            index_elements=[FlightSummary.fr24_id, FlightSummary.datetime_takeoff]
+        ).returning(FlightSummary.fr24_id)
+        result = await session.execute(stmt)
+        inserted_ids.update(result.scalars().all())
+    await session.commit()
+    return inserted_ids
 
 
 async def fetch_date_range(
@@ -16,13 +42,14 @@ async def fetch_date_range(
         range_to: datetime,
         http: aiohttp.ClientSession,
         storage_mode: str = "db",
-        csv_path: Optional[str] = None
+        sink: Optional[CsvSink | ParquetSink] = None
 ) -> List[dict] | None:
     async with AsyncSessionLocal() as session:
         print(f"📆 Range Processing: {range_from} - {range_to} | ICAO={icao} | REGS={regs}")
         next_from = range_from
 
         processing_flights: List[dict] = []
+        rate_limited = 0
         while True:
             params = {
                 "flight_datetime_from": next_from.strftime("%Y-%m-%d %H:%M:%S"),
@@ -34,111 +61,118 @@ async def fetch_date_range(
             if regs:
                 params["registrations"] = ",".join(regs)
 
-            await asyncio.sleep(SECONDS_BETWEEN_REQUESTS)
-
-            async with http.get(f"{BASE_URL}/flight-summary/full", headers=HEADERS, params=params) as resp:
-                if resp.status != 200:
-                    print(f"❌ Error {resp.status}: {await resp.text()}")
-                    break
-
-                flights = await resp.json()
-                if not flights or not flights.get("data"):
-                    print("✅ No data for the current interval.")
-                    break
-
-                flights_data = flights["data"]
-                if not flights_data:
-                    break
-
-                existing_ids = set()
-                if storage_mode in ("db", "both"):
-                    stmt = select(
-                        FlightSummary.fr24_id,
-                        FlightSummary.flight,
-                        FlightSummary.reg,
-                        FlightSummary.callsign
-                    ).where(
-                        FlightSummary.fr24_id.in_([f.get("fr24_id") for f in flights_data if f.get("fr24_id")])
-                    )
-
-                    existing_rows = (await session.execute(stmt)).all()
-                    existing_ids = {
-                        (row[0], row[1], row[2], row[3])
-                        for row in existing_rows
+            await get_rate_limiter().acquire()
+
+            # The connection is released before a rate limit sleep and the page processing
+            async with fr24_get(http, "/flight-summary/full", params) as resp:
+                status = resp.status
+                if status == 429:
+                    rate_limited += 1
+                    try:
+                        delay = rate_limit_backoff(resp.headers, rate_limited)
+                    except RateLimitedError as e:
+                        print(f"❌ {e}, giving up range {range_from} - {range_to} | ICAO={icao} | REGS={regs}")
+                        raise
+                elif status != 200:
+                    error = await resp.text()
+                else:
+                    flights = await resp.json()
+
+            if status == 429:
+                print(f"⏳ Rate limited, retry {rate_limited} in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                continue
+            rate_limited = 0
+
+            if status != 200:
+                print(f"❌ Error {status}: {error}")
+                break
+
+            if not flights or not flights.get("data"):
+                print("✅ No data for the current interval.")
+                break
+
+            flights_data = flights["data"]
+            if not flights_data:
+                break
+
+            new_flights = []
+            file_rows = []
+            page_ids = set()
+            max_takeoff = next_from
+
+            for flight in flights_data:
+                try:
+                    fr24_id = flight.get("fr24_id")
+                    flight_num = flight.get("flight")
+                    reg = flight.get("reg")
+                    callsign = flight.get("callsign")
+
+                    if not fr24_id or fr24_id in page_ids:
+                        print(f"🔁 Skipping duplicate: {flight_num} ({reg}/{callsign})")
+                        continue
+                    page_ids.add(fr24_id)
+
+                    takeoff = parse_dt(flight.get("datetime_takeoff"))
+                    max_takeoff = max(max_takeoff, takeoff) if takeoff else max_takeoff
+
+                    row_data = {
+                        "fr24_id": fr24_id,
+                        "flight": flight_num,
+                        "callsign": callsign,
+                        "operating_as": flight.get("operating_as"),
+                        "painted_as": flight.get("painted_as"),
+                        "type": flight.get("type"),
+                        "reg": reg,
+                        "orig_icao": flight.get("orig_icao"),
+                        "orig_iata": flight.get("orig_iata"),
+                        "datetime_takeoff": ensure_naive_utc(takeoff),
+                        "runway_takeoff": flight.get("runway_takeoff"),
+                        "dest_icao": flight.get("dest_icao"),
+                        "dest_iata": flight.get("dest_iata"),
+                        "dest_icao_actual": flight.get("dest_icao_actual"),
+                        "dest_iata_actual": flight.get("dest_iata_actual"),
+                        "datetime_landed": ensure_naive_utc(parse_dt(flight.get("datetime_landed"))),
+                        "runway_landed": flight.get("runway_landed"),
+                        "flight_time": flight.get("flight_time"),
+                        "actual_distance": flight.get("actual_distance"),
+                        "circle_distance": flight.get("circle_distance"),
+                        "category": flight.get("category"),
+                        "hex": flight.get("hex"),
+                        "first_seen": ensure_naive_utc(parse_dt(flight.get("first_seen"))),
+                        "last_seen": ensure_naive_utc(parse_dt(flight.get("last_seen"))),
+                        "flight_ended": flight.get("flight_ended"),
                     }
 
-                new_flights = []
-                csv_rows = []
-                max_takeoff = next_from
+                    if row_data["flight_ended"] is False:
+                        processing_flights.append(row_data)
 
-                for flight in flights_data:
-                    try:
-                        fr24_id = flight.get("fr24_id")
-                        flight_num = flight.get("flight")
-                        reg = flight.get("reg")
-                        callsign = flight.get("callsign")
-
-                        if not fr24_id or ((fr24_id, flight_num, reg, callsign) in existing_ids and storage_mode in (
-                                "db", "both")):
-                            print(f"🔁 Skipping duplicate: {flight_num} ({reg}/{callsign})")
-                            continue
-
-                        takeoff = parse_dt(flight.get("datetime_takeoff"))
-                        max_takeoff = max(max_takeoff, takeoff) if takeoff else max_takeoff
-
-                        row_data = {
-                            "fr24_id": fr24_id,
-                            "flight": flight_num,
-                            "callsign": callsign,
-                            "operating_as": flight.get("operating_as"),
-                            "painted_as": flight.get("painted_as"),
-                            "type": flight.get("type"),
-                            "reg": reg,
-                            "orig_icao": flight.get("orig_icao"),
-                            "orig_iata": flight.get("orig_iata"),
-                            "datetime_takeoff": ensure_naive_utc(takeoff),
-                            "runway_takeoff": flight.get("runway_takeoff"),
-                            "dest_icao": flight.get("dest_icao"),
-                            "dest_iata": flight.get("dest_iata"),
-                            "dest_icao_actual": flight.get("dest_icao_actual"),
-                            "dest_iata_actual": flight.get("dest_iata_actual"),
-                            "datetime_landed": ensure_naive_utc(parse_dt(flight.get("datetime_landed"))),
-                            "runway_landed": flight.get("runway_landed"),
-                            "flight_time": flight.get("flight_time"),
-                            "actual_distance": flight.get("actual_distance"),
-                            "circle_distance": flight.get("circle_distance"),
-                            "category": flight.get("category"),
-                            "hex": flight.get("hex"),
-                            "first_seen": ensure_naive_utc(parse_dt(flight.get("first_seen"))),
-                            "last_seen": ensure_naive_utc(parse_dt(flight.get("last_seen"))),
-                            "flight_ended": flight.get("flight_ended"),
-                        }
-
-                        if row_data["flight_ended"] is False:
-                            processing_flights.append(row_data)
-
-                        if row_data["flight_ended"] is True:
-                            if storage_mode in ("db", "both"):
-                                new_flights.append(FlightSummary(**row_data))
-                            if storage_mode in ("csv", "both"):
-                                csv_rows.append(row_data)
-
-                    except Exception as e:
-                        print(f"⚠️ Record processing error: {e}")
-
-                if new_flights and storage_mode in ("db", "both"):
-                    session.add_all(new_flights)
-                    await session.commit()
-                    print(f"💾 Saved {len(new_flights)} new records to DB.")
-
-                if csv_rows and storage_mode in ("csv", "both") and csv_path:
-                    write_csv(csv_rows, csv_path)
-                    print(f"📄 Appended {len(csv_rows)} records to CSV.")
-
-                if max_takeoff == next_from or max_takeoff >= range_to:
-                    break
-
-                next_from = max_takeoff + timedelta(seconds=1)
+                    if row_data["flight_ended"] is True:
+                        # datetime_takeoff is the partition key
+                        if storage_mode in ("db", "both") and row_data["datetime_takeoff"] is not None:
+                            new_flights.append(row_data)
+                        if storage_mode in FILE_STORAGE_MODES:
+                            file_rows.append(row_data)
+
+                except Exception as e:
+                    print(f"⚠️ Record processing error: {e}")
+
+            if new_flights and storage_mode in ("db", "both"):
+                inserted_ids = await save_flights(session, new_flights)
+                print(f"💾 Saved {len(inserted_ids)} new records to DB, "
+                      f"{len(new_flights) - len(inserted_ids)} already stored.")
+                if storage_mode == "both":
+                    file_rows = [row for row in file_rows
+                                 if row["datetime_takeoff"] is None or row["fr24_id"] in inserted_ids]
+
+            if file_rows and storage_mode in FILE_STORAGE_MODES and sink:
+                sink.write(file_rows)
+                print(f"📄 Queued {len(file_rows)} records for {storage_mode} output.")
+
+            if max_takeoff == next_from or max_takeoff >= range_to:
+                break
+
+            next_from = max_takeoff + timedelta(seconds=1)
 
         if len(processing_flights) < 1:
             return None
@@ -151,42 +185,82 @@ async def fetch_all_ranges(
         icao: Optional[str] = None,
         registrations: Optional[List[str]] = None,
         storage_mode: str = "both",
-        csv_path: Optional[str] = f"output/flights_{datetime.strftime(datetime.now(), '%Y%m%d_%H%M')}.csv"
+        csv_path: Optional[str] = f"output/flights_{datetime.strftime(datetime.now(), '%Y%m%d_%H%M')}.csv",
+        parquet_dir: Optional[str] = "output/flights_parquet",
+        sink: Optional[CsvSink | ParquetSink] = None
 ):
+    """
+    Fetches flight summaries of all date ranges and registration batches
+
+    :param storage_mode: "db", "csv", "both" (db and csv) or "parquet"
+    :param csv_path: CSV output, used when no sink is given
+    :param parquet_dir: Parquet dataset root, used when no sink is given
+    :param sink: file sink shared with other fetches, stays open
+    """
     start_dt = parse_date_or_datetime(start_date)
     end_dt = parse_date_or_datetime(end_date)
 
     date_ranges = []
     current = start_dt
 
-    flights = []
-
     while current <= end_dt:
         range_end = min(current + timedelta(days=RANGE_DAYS) - timedelta(seconds=1), end_dt)
         date_ranges.append((current, range_end))
         current = range_end + timedelta(seconds=1)
 
+    if storage_mode in ("db", "both"):
+        # A day of margin for flights taking off around the range bounds
+        await ensure_month_partitions(
+            engine,
+            ensure_naive_utc(start_dt - timedelta(days=1)),
+            ensure_naive_utc(end_dt + timedelta(days=1))
+        )
+
     registration_batches = (
         [registrations[i:i + MAX_REG_PER_BATCH] for i in range(0, len(registrations), MAX_REG_PER_BATCH)]
         if registrations else [None]
     )
 
-    async with aiohttp.ClientSession() as http:
-        for batch_index, reg_batch in enumerate(registration_batches):
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_RANGES)
+
+    async def fetch_range(batch_index: int, reg_batch: Optional[List[str]], i: int, range_start: datetime,
+                          range_end: datetime) -> List[dict] | None:
+        async with semaphore:
             if reg_batch:
                 print(f"\n📦 Processing a batch of registrations {batch_index + 1} out of {len(registration_batches)}")
-            for i, (range_start, range_end) in enumerate(date_ranges):
-                print(f"🚀 Range {i + 1} out of {len(date_ranges)}")
-                flights.append(await fetch_date_range(
-                    icao=icao,
-                    regs=reg_batch,
-                    range_from=range_start,
-                    range_to=range_end,
-                    http=http,
-                    storage_mode=storage_mode,
-                    csv_path=csv_path
-                ))
-        return flights
+            print(f"🚀 Range {i + 1} out of {len(date_ranges)}")
+            return await fetch_date_range(
+                icao=icao,
+                regs=reg_batch,
+                range_from=range_start,
+                range_to=range_end,
+                http=http,
+                storage_mode=storage_mode,
+                sink=sink
+            )
+
+    own_sink = False
+    if sink is None and storage_mode == "parquet" and parquet_dir:
+        sink = ParquetSink(parquet_dir, FlightSummary, FLIGHT_SUMMARY_FIELDS, date_field="datetime_takeoff")
+        own_sink = True
+    elif sink is None and storage_mode in ("csv", "both") and csv_path:
+        sink = CsvSink(csv_path, FLIGHT_SUMMARY_FIELDS)
+        own_sink = True
+
+    try:
+        async with aiohttp.ClientSession() as http:
+            # Pagination inside a range is sequential, ranges and batches share the rate limiter
+            flights = await asyncio.gather(*[
+                fetch_range(batch_index, reg_batch, i, range_start, range_end)
+                for batch_index, reg_batch in enumerate(registration_batches)
+                for i, (range_start, range_end) in enumerate(date_ranges)
+            ])
+            return list(flights)
+    finally:
+        if own_sink:
+            sink.close()
+        elif sink is not None:
+            sink.flush()
 
 
 if __name__ == "__main__":
@@ -197,7 +271,7 @@ if __name__ == "__main__":
     START_DATE = "2025-08-27"
     END_DATE = "2025-08-28"
 
-    storage_mode = "csv"  # "db", "csv", or "both"
+    storage_mode = "csv"  # "db", "csv", "both" or "parquet"
 
     csv_path = "output/flights4.csv"
 
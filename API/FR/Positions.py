@@ -0,0 +1,150 @@
+import asyncio
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import select, text, table, column
+from sqlalchemy.dialects.postgresql import insert
+
+from Utils import engine, AsyncSessionLocal
+from DATABASE import LivePositions, PositionHistory, ensure_day_partitions
+from DATABASE.FR.FR import LATEST_POSITIONS_VIEW
+
+POSITION_FIELDS = [c.name for c in PositionHistory.__table__.columns]
+# COPY encodes values by column type, the API sends ints for float columns
+POSITION_TYPES = {c.name: c.type.python_type for c in PositionHistory.__table__.columns}
+POSITION_KEY = ["fr24_id", "timestamp"]
+POSITIONS_STAGING_TABLE = "position_history_staging"
+POSITIONS_BATCH_SIZE = 50000
+
+
+class PositionWriter:
+    def __init__(self, batch_size: int = POSITIONS_BATCH_SIZE):
+        """
+        Buffers track points and appends them to position_history with COPY.
+        Points polled twice are skipped by the (fr24_id, timestamp) key.
+
+        :param batch_size: points buffered before a flush
+        """
+        self.batch_size = batch_size
+        self.buffer: list[tuple] = []
+        self.written = 0
+        self._lock = asyncio.Lock()
+
+    async def add(self, rows: List[dict]):
+        """Buffers live position rows, flushes when the batch is full"""
+        self.buffer.extend(
+            tuple(self._copy_value(name, row.get(name)) for name in POSITION_FIELDS)
+            for row in rows
+            if row.get("fr24_id") and row.get("timestamp")
+        )
+        if len(self.buffer) >= self.batch_size:
+            await self.flush()
+
+    @staticmethod
+    def _copy_value(name: str, value):
+        if value is None or isinstance(value, POSITION_TYPES[name]):
+            return value
+        return POSITION_TYPES[name](value)
+
+    async def flush(self) -> int:
+        """Writes buffered points, returns the number of new points"""
+        async with self._lock:
+            if not self.buffer:
+                return 0
+            records, self.buffer = self.buffer, []
+
+            timestamps = [record[POSITION_FIELDS.index("timestamp")] for record in records]
+            await ensure_day_partitions(engine, min(timestamps), max(timestamps))
+
+            staging = table(POSITIONS_STAGING_TABLE, *[column(name) for name in POSITION_FIELDS])
+            stmt = insert(PositionHistory).from_select(
+                POSITION_FIELDS,
+                select(*staging.c)
+                .distinct(*[staging.c[name] for name in POSITION_KEY])
+                .order_by(*[staging.c[name] for name in POSITION_KEY])
+            ).on_conflict_do_nothing(index_elements=POSITION_KEY)
+
+            async with engine.begin() as conn:
+                await conn.execute(text(
+                    f"CREATE TEMP TABLE {POSITIONS_STAGING_TABLE} ON COMMIT DROP AS "
+                    f"SELECT {', '.join(POSITION_FIELDS)} FROM {PositionHistory.__tablename__} WITH NO DATA"
+                ))
+                raw_connection = await conn.get_raw_connection()
+                await raw_connection.driver_connection.copy_records_to_table(
+                    POSITIONS_STAGING_TABLE,
+                    records=records,
+                    columns=POSITION_FIELDS
+                )
+                result = await conn.execute(stmt)
+
+            self.written += result.rowcount
+            print(f"🛰️ Appended {result.rowcount} of {len(records)} track points to history.")
+            return result.rowcount
+
+
+async def save_live_positions(session, rows: List[dict]) -> int:
+    """
+    Upserts the latest state of every flight into live_positions
+
+    :param session: FR DataBase session
+    :param rows: live position rows
+    :return: number of flights
+    """
+    latest: dict[str, dict] = {}
+    for row in rows:
+        fr24_id = row.get("fr24_id")
+        if not fr24_id:
+            continue
+        current = latest.get(fr24_id)
+        if current is None or (row["timestamp"] or datetime.min) >= (current["timestamp"] or datetime.min):
+            latest[fr24_id] = row
+
+    if not latest:
+        return 0
+
+    rows = list(latest.values())
+    max_params_per_chunk = 30000
+    safe_chunk_size = max_params_per_chunk // len(rows[0])
+
+    for i in range(0, len(rows), safe_chunk_size):
+        stmt = insert(LivePositions).values(rows[i:i + safe_chunk_size])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[LivePositions.fr24_id],
+            set_={name: stmt.excluded[name] for name in rows[0] if name != "fr24_id"}
+        )
+        await session.execute(stmt)
+    await session.commit()
+    return len(rows)
+
+
+async def read_track(fr24_id: str, start: datetime, end: datetime) -> List[dict]:
+    """
+    Track replay: points of a flight in [start, end], only partitions of the range are scanned
+
+    :param fr24_id: flight id
+    :param start: first naive UTC datetime
+    :param end: last naive UTC datetime
+    """
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(*PositionHistory.__table__.c)
+            .where(
+                PositionHistory.fr24_id == fr24_id,
+                PositionHistory.timestamp >= start,
+                PositionHistory.timestamp <= end
+            )
+            .order_by(PositionHistory.timestamp)
+        )
+        return [dict(row._mapping) for row in result.all()]
+
+
+async def latest_positions(fr24_ids: Optional[List[str]] = None) -> List[dict]:
+    """Latest point of every flight from the live_positions_latest view"""
+    latest = table(LATEST_POSITIONS_VIEW, *[column(name) for name in POSITION_FIELDS])
+    stmt = select(*latest.c)
+    if fr24_ids:
+        stmt = stmt.where(latest.c.fr24_id.in_(fr24_ids))
+
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(stmt)
+        return [dict(row._mapping) for row in result.all()]
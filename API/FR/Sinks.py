@@ -0,0 +1,260 @@
+import csv
+import gzip
+import io
+import os
+import re
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+from sqlalchemy import Boolean, DateTime, Float, Integer
+
+from DATABASE import FlightSummary, LivePositions
+
+FLIGHT_SUMMARY_FIELDS = [c.name for c in FlightSummary.__table__.columns if c.name != "id"]
+LIVE_POSITION_FIELDS = [c.name for c in LivePositions.__table__.columns]
+
+# Storage modes written through a sink
+FILE_STORAGE_MODES = ("csv", "both", "parquet")
+
+
+class CsvSink:
+    def __init__(self, path: str, fieldnames: List[str], compress: bool = False, flush_rows: int = 10000,
+                 flush_interval: float = 30.0, max_bytes: Optional[int] = None,
+                 rotate_interval: Optional[float] = None, buffer_size: int = 1024 * 1024):
+        """
+        Long-lived CSV writer with a fixed header.
+
+        Rows are buffered and written every `flush_rows` rows or `flush_interval` seconds.
+        With rotation enabled, parts are named <stem>_0001.csv, <stem>_0002.csv, ...
+
+        :param path: output file, ".gz" is appended when compressed
+        :param fieldnames: fixed column order, missing fields are written empty and extra fields ignored
+        :param compress: gzip output
+        :param flush_rows: buffered rows before a write
+        :param flush_interval: max seconds rows stay buffered
+        :param max_bytes: rotate after the file reaches this size on disk
+        :param rotate_interval: rotate after the file was open this many seconds
+        :param buffer_size: file buffer in bytes
+        """
+        self.path = Path(path)
+        self.fieldnames = list(fieldnames)
+        self.compress = compress
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.buffer_size = buffer_size
+
+        self.rows_written = 0
+        self.files: List[Path] = []
+        self._rows: List[dict] = []
+        self._part = 0
+        self._raw = None
+        self._stream = None
+        self._writer = None
+        self._opened_at = 0.0
+        self._flushed_at = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def rotating(self) -> bool:
+        return bool(self.max_bytes or self.rotate_interval)
+
+    def _next_path(self) -> Path:
+        suffix = self.path.suffix + (".gz" if self.compress else "")
+        if not self.rotating:
+            return self.path.with_name(self.path.stem + suffix)
+
+        while True:
+            self._part += 1
+            candidate = self.path.with_name(f"{self.path.stem}_{self._part:04d}{suffix}")
+            if not candidate.exists():
+                return candidate
+
+    def _open(self):
+        path = self._next_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        new_file = not path.exists() or path.stat().st_size == 0
+
+        self._raw = open(path, "ab", buffering=self.buffer_size)
+        binary = gzip.GzipFile(fileobj=self._raw, mode="ab") if self.compress else self._raw
+        self._stream = io.TextIOWrapper(binary, encoding="utf-8", newline="")
+        self._writer = csv.DictWriter(self._stream, fieldnames=self.fieldnames, extrasaction="ignore")
+        if new_file:
+            self._writer.writeheader()
+
+        self._opened_at = time.monotonic()
+        self.files.append(path)
+
+    def _close_file(self):
+        if self._stream is None:
+            return
+        # Closing the text wrapper closes the gzip member, the raw file is closed separately
+        self._stream.close()
+        if not self._raw.closed:
+            self._raw.close()
+        self._raw = self._stream = self._writer = None
+
+    def _should_rotate(self) -> bool:
+        if self.max_bytes and os.fstat(self._raw.fileno()).st_size >= self.max_bytes:
+            return True
+        return bool(self.rotate_interval) and time.monotonic() - self._opened_at >= self.rotate_interval
+
+    def write(self, rows: List[dict]):
+        """Buffers rows, writes them when the buffer is full or old enough"""
+        self._rows.extend(rows)
+        if len(self._rows) >= self.flush_rows or time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Writes buffered rows to disk"""
+        self._flushed_at = time.monotonic()
+        if not self._rows:
+            return
+
+        rows, self._rows = self._rows, []
+        if self._writer is None:
+            self._open()
+
+        self._writer.writerows(rows)
+        self._stream.flush()
+        self._raw.flush()
+        self.rows_written += len(rows)
+
+        if self.rotating and self._should_rotate():
+            self._close_file()
+
+    def close(self):
+        self.flush()
+        self._close_file()
+
+
+def arrow_schema(model, fieldnames: List[str]):
+    """Arrow schema of model columns, datetimes are naive UTC and stored as UTC timestamps"""
+    import pyarrow as pa
+
+    columns = model.__table__.columns
+    fields = []
+    for name in fieldnames:
+        column_type = columns[name].type
+        if isinstance(column_type, DateTime):
+            arrow_type = pa.timestamp("us", tz="UTC")
+        elif isinstance(column_type, Boolean):
+            arrow_type = pa.bool_()
+        elif isinstance(column_type, Integer):
+            arrow_type = pa.int64()
+        elif isinstance(column_type, Float):
+            arrow_type = pa.float64()
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields)
+
+
+class ParquetSink:
+    def __init__(self, directory: str, model, fieldnames: List[str], date_field: str,
+                 operator_fields: tuple = ("operating_as", "painted_as"), flush_rows: int = 50000,
+                 flush_interval: float = 60.0, compression: str = "zstd"):
+        """
+        Typed Parquet dataset partitioned as <directory>/date=YYYY-MM-DD/operator=XXX/.
+
+        Every flush writes one complete file per partition, under a hidden temporary name renamed
+        into place once its footer is written, so every part on disk is readable even after a crash.
+        Needs pyarrow.
+
+        :param directory: dataset root
+        :param model: DataBase model the column types are taken from
+        :param fieldnames: columns to write
+        :param date_field: datetime column for the date partition
+        :param operator_fields: columns for the operator partition, first non-empty wins
+        :param flush_rows: buffered rows before a write
+        :param flush_interval: max seconds rows stay buffered
+        :param compression: parquet codec
+        """
+        import pyarrow.parquet as pq
+
+        self._pq = pq
+        self.directory = Path(directory)
+        self.fieldnames = list(fieldnames)
+        self.schema = arrow_schema(model, self.fieldnames)
+        self.date_field = date_field
+        self.operator_fields = operator_fields
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.compression = compression
+
+        self.rows_written = 0
+        self.files: List[Path] = []
+        self._rows: List[dict] = []
+        self._run = uuid.uuid4().hex[:8]
+        self._parts: dict[tuple[str, str], int] = defaultdict(int)
+        self._flushed_at = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _partition(self, row: dict) -> tuple[str, str]:
+        value = row.get(self.date_field)
+        date = value.strftime("%Y-%m-%d") if isinstance(value, datetime) else "unknown"
+        operator = next((row[name] for name in self.operator_fields if row.get(name)), None) or "unknown"
+        return date, re.sub(r"[^A-Za-z0-9_-]", "_", str(operator))
+
+    def _write_part(self, partition: tuple[str, str], table) -> Path:
+        date, operator = partition
+        self._parts[partition] += 1
+        path = self.directory / f"date={date}" / f"operator={operator}" / \
+            f"part-{self._run}-{self._parts[partition]:04d}.parquet"
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Dataset readers skip hidden files, the part appears only once complete
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        try:
+            self._pq.write_table(table, tmp_path, compression=self.compression)
+            os.replace(tmp_path, path)
+        except Exception:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        self.files.append(path)
+        return path
+
+    def write(self, rows: List[dict]):
+        """Buffers rows, writes them when the buffer is full or old enough"""
+        self._rows.extend(rows)
+        if len(self._rows) >= self.flush_rows or time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Writes buffered rows, one finished file per partition"""
+        import pyarrow as pa
+
+        self._flushed_at = time.monotonic()
+        if not self._rows:
+            return
+
+        rows, self._rows = self._rows, []
+        partitions: dict[tuple[str, str], List[dict]] = defaultdict(list)
+        for row in rows:
+            partitions[self._partition(row)].append(row)
+
+        for partition, partition_rows in partitions.items():
+            table = pa.Table.from_pylist(
+                [{name: row.get(name) for name in self.fieldnames} for row in partition_rows],
+                schema=self.schema
+            )
+            self._write_part(partition, table)
+        self.rows_written += len(rows)
+
+    def close(self):
+        self.flush()
@@ -1,17 +1,28 @@
-import csv
+import asyncio
 import os
+import time
+import weakref
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
-from pathlib import Path
 from typing import List, Optional
 
+import aiohttp
 from dotenv import load_dotenv
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 
+from Utills import TokenBucket
+from Utills import Metrics as metrics
+
 load_dotenv()
 
-SECONDS_BETWEEN_REQUESTS = 60 / 90
+REQUESTS_PER_MINUTE = 90
+SECONDS_BETWEEN_REQUESTS = 60 / REQUESTS_PER_MINUTE
 RANGE_DAYS = 14
 MAX_REG_PER_BATCH = 15
+MAX_CONCURRENT_RANGES = 8
+# 429 responses in a row before a request gives up, backoff doubles up to MAX_BACKOFF_SECONDS
+MAX_RATE_LIMIT_RETRIES = 6
+MAX_BACKOFF_SECONDS = 300
 
 HEADERS = {
     "Authorization": f"Bearer {os.getenv('FR_API_KEY')}",
@@ -23,15 +34,59 @@ BASE_URL = "https://fr24api.flightradar24.com/api"
 
 engine = create_async_engine(os.getenv("DATABASE_URL_FR"), echo=False)
 AsyncSessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+metrics.track_pool("fr", engine)
+
+
+_rate_limiters: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, TokenBucket]" = weakref.WeakKeyDictionary()
+
+
+def get_rate_limiter() -> TokenBucket:
+    """FR24 request budget shared by all requests of the running event loop"""
+    loop = asyncio.get_running_loop()
+    if loop not in _rate_limiters:
+        _rate_limiters[loop] = TokenBucket.per_minute(REQUESTS_PER_MINUTE, capacity=1)
+    return _rate_limiters[loop]
+
+
+class RateLimitedError(Exception):
+    """FR24 kept answering 429 after MAX_RATE_LIMIT_RETRIES retries"""
 
 
-def write_csv(rows: List[dict], path: str):
-    file_exists = Path(path).exists()
-    with open(path, "a", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=rows[0].keys())
-        if not file_exists:
-            writer.writeheader()
-        writer.writerows(rows)
+def retry_after(headers, default: float = SECONDS_BETWEEN_REQUESTS * 10) -> float:
+    value = headers.get("Retry-After")
+    return float(value) if value and value.isdigit() else default
+
+
+def rate_limit_backoff(headers, attempt: int) -> float:
+    """
+    Seconds to wait after the attempt-th 429 in a row: Retry-After, or the default doubled every attempt
+
+    :raises RateLimitedError: after MAX_RATE_LIMIT_RETRIES attempts
+    """
+    if attempt > MAX_RATE_LIMIT_RETRIES:
+        raise RateLimitedError(f"Rate limited {attempt} times in a row")
+    return min(retry_after(headers, SECONDS_BETWEEN_REQUESTS * 10 * 2 ** (attempt - 1)), MAX_BACKOFF_SECONDS)
+
+
+@asynccontextmanager
+async def fr24_get(http: aiohttp.ClientSession, endpoint: str, params: dict):
+    """
+    GET request to the FR24 API, latency up to the response headers is recorded as asg_http_fetch_seconds
+
+    :param endpoint: path under BASE_URL, e.g. "/flight-summary/full"
+    """
+    status = "error"
+    start = time.perf_counter()
+    try:
+        async with http.get(f"{BASE_URL}{endpoint}", headers=HEADERS, params=params) as resp:
+            status = str(resp.status)
+            metrics.HTTP_FETCH_SECONDS.labels("fr24", endpoint, status).observe(time.perf_counter() - start)
+            yield resp
+    except Exception:
+        # Failed before a response, timeouts and connection errors
+        if status == "error":
+            metrics.HTTP_FETCH_SECONDS.labels("fr24", endpoint, status).observe(time.perf_counter() - start)
+        raise
 
 
 def parse_dt(value: str | None) -> datetime | None:
@@ -1,9 +1,14 @@
+from datetime import datetime
+
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
 from DATABASE.ICAO import *
+from cache import ResponseCache
+from checkpoint import CrawlCheckpoint
 from client import ApiClient
-from enums import ICAOEndpoints, DatabaseUniqueColumns, manufacturer_list
+from enums import ICAOEndpoints, DatabaseUniqueColumns, manufacturer_list, ENDPOINT_CACHE_TTL
+from scheduler import CrawlJob, CrawlScheduler
 
 engine = create_async_engine(os.getenv("DATABASE_URL_API"), echo=False)
 
@@ -20,6 +25,14 @@ HEADERS = {"Accept": "application/json"}
 API_KEY = os.getenv("ICAO_API_KEY")
 BASE_URL = "https://applications.icao.int/dataservices/api"
 
+# Crawl limits
+CONCURRENCY = 8
+REQUESTS_PER_SECOND = 2  # per endpoint
+GLOBAL_REQUESTS_PER_SECOND = 10
+RETRIES = 5
+
+response_cache = ResponseCache()
+
 
 async def db_session(_async_session: async_session, **kwargs):
     async with async_session() as session:
@@ -38,269 +51,388 @@ async def countries_codes(code: str = None):
     return codes
 
 
-async def manufacturer():
-    for manufacture in manufacturer_list:
-        client = await db_session(_async_session=async_session, headers=HEADERS, api_key=API_KEY, base_url=BASE_URL)
-        await client.fetch_and_store(
+def create_scheduler(crawl_id: str = None) -> CrawlScheduler:
+    return CrawlScheduler(
+        client_factory=lambda http: ApiClient(
+            async_session(), headers=HEADERS, api_key=API_KEY, base_url=BASE_URL, http=http,
+            cache=response_cache, cache_ttls=ENDPOINT_CACHE_TTL
+        ),
+        concurrency=CONCURRENCY,
+        rate=REQUESTS_PER_SECOND,
+        global_rate=GLOBAL_REQUESTS_PER_SECOND,
+        retries=RETRIES,
+        checkpoint=CrawlCheckpoint(async_session, crawl_id) if crawl_id else None,
+    )
+
+
+async def crawl(jobs: list[CrawlJob], scheduler: CrawlScheduler = None):
+    """Adds jobs to the scheduler, or runs them right away without one"""
+    if scheduler is not None:
+        scheduler.submit(jobs)
+        return
+
+    scheduler = create_scheduler()
+    scheduler.submit(jobs)
+    await scheduler.run()
+
+
+async def manufacturer(scheduler: CrawlScheduler = None):
+    jobs = [
+        CrawlJob(
             endpoint=ICAOEndpoints.MANUFACTURER_LIST,
             model=Manufacturer,
             conflict_enums=DatabaseUniqueColumns.MANUFACTURER_CODE,
-            manufacturer=manufacture
+            params={"manufacturer": manufacture},
         )
+        for manufacture in manufacturer_list
+    ]
+    await crawl(jobs, scheduler)
 
 
-async def type_designators():
-    client = await db_session(_async_session=async_session, headers=HEADERS, api_key=API_KEY, base_url=BASE_URL)
-    for manufacture in manufacturer_list:
-        await client.fetch_and_store(
+async def type_designators(scheduler: CrawlScheduler = None):
+    jobs = [
+        CrawlJob(
             endpoint=ICAOEndpoints.AIRCRAFT_TYPE_DESIGNATORS,
             model=AircraftType,
             conflict_enums=DatabaseUniqueColumns.AIRCRAFT_TYPE_DESIGNATORS,
-            manufacturer=manufacture
+            params={"manufacturer": manufacture},
         )
+        for manufacture in manufacturer_list
+    ]
+    await crawl(jobs, scheduler)
 
 
-async def operators(code: str = None):
-    client = await db_session(_async_session=async_session, headers=HEADERS, api_key=API_KEY, base_url=BASE_URL)
-    for _code in await countries_codes(code):
-        await client.fetch_and_store(
+async def operators(code: str = None, scheduler: CrawlScheduler = None):
+    jobs = [
+        CrawlJob(
             endpoint=ICAOEndpoints.OPERATOR_3_LETTER_CODES,
             model=Operator,
             conflict_enums=DatabaseUniqueColumns.OPERATOR_3_LETTERS,
-            states=_code,
+            params={"states": _code},
         )
+        for _code in await countries_codes(code)
+    ]
+    await crawl(jobs, scheduler)
 
 
-async def risk_profile(code: str = None):
-    client = await db_session(_async_session=async_session, headers=HEADERS, api_key=API_KEY, base_url=BASE_URL)
-    for _code in await countries_codes(code):
-        await client.fetch_and_store(
+async def risk_profile(code: str = None, scheduler: CrawlScheduler = None):
+    jobs = [
+        CrawlJob(
             endpoint=ICAOEndpoints.OPERATOR_RISK_PROFILE,
             model=OperatorRiskProfile,
             conflict_enums=DatabaseUniqueColumns.OPERATOR_RISK_PROFILE,
-            states=_code,
+            params={"states": _code},
         )
+        for _code in await countries_codes(code)
+    ]
+    await crawl(jobs, scheduler)
 
 
-async def aerodrome_location(code: str = None):
-    client = await db_session(_async_session=async_session, headers=HEADERS, api_key=API_KEY, base_url=BASE_URL)
-    for _code in await countries_codes(code):
-        await client.fetch_and_store(
+async def aerodrome_location(code: str = None, scheduler: CrawlScheduler = None):
+    jobs = [
+        CrawlJob(
             endpoint=ICAOEndpoints.AERODROME_LOCATION_INDICATORS,
             model=AerodromeLocation,
             conflict_enums=DatabaseUniqueColumns.AERODROME_LOCATION_INDICATORS,
-            state=_code,
+            params={"state": _code},
         )
+        for _code in await countries_codes(code)
+    ]
+    await crawl(jobs, scheduler)
 
 
-async def international_aerodromes(code: str = None):
-    client = await db_session(_async_session=async_session, headers=HEADERS, api_key=API_KEY, base_url=BASE_URL)
-    for _code in await countries_codes(code):
-        await client.fetch_and_store(
+async def international_aerodromes(code: str = None, scheduler: CrawlScheduler = None):
+    jobs = [
+        CrawlJob(
             endpoint=ICAOEndpoints.INTERNATIONAL_AERODROMES,
             model=InternationalAerodrome,
             conflict_enums=DatabaseUniqueColumns.INTERNATIONAL_AERODROMES,
-            states=_code,
+            params={"states": _code},
         )
+        for _code in await countries_codes(code)
+    ]
+    await crawl(jobs, scheduler)
 
 
-async def operational_aerodrome_info(code: str = None):
-    client = await db_session(_async_session=async_session, headers=HEADERS, api_key=API_KEY, base_url=BASE_URL)
-    for _code in await countries_codes(code):
-        await client.fetch_and_store(
+async def operational_aerodrome_info(code: str = None, scheduler: CrawlScheduler = None):
+    jobs = [
+        CrawlJob(
             endpoint=ICAOEndpoints.OPERATIONAL_AERODROME_INFORMATION,
             model=OperationalAerodromeInfo,
             conflict_enums=DatabaseUniqueColumns.OPERATIONAL_AERODROME_INFORMATION,
-            states=_code,
+            params={"states": _code},
         )
+        for _code in await countries_codes(code)
+    ]
+    await crawl(jobs, scheduler)
 
 
-async def airport_pbn_impl(code: str = None):
-    client = await db_session(_async_session=async_session, headers=HEADERS, api_key=API_KEY, base_url=BASE_URL)
-    for _code in await countries_codes(code):
-        await client.fetch_and_store(
+async def airport_pbn_impl(code: str = None, scheduler: CrawlScheduler = None):
+    jobs = [
+        CrawlJob(
             endpoint=ICAOEndpoints.AIRPORT_PBN_IMPLEMENTATION,
             model=AirportPBNImplementation,
             conflict_enums=DatabaseUniqueColumns.AIRPORT_PBN_IMPLEMENTATION,
-            states=_code,
+            params={"states": _code},
         )
+        for _code in await countries_codes(code)
+    ]
+    await crawl(jobs, scheduler)
 
 
-async def international_airport_safety(code: str = None):
-    client = await db_session(_async_session=async_session, headers=HEADERS, api_key=API_KEY, base_url=BASE_URL)
-    for _code in await countries_codes(code):
-        await client.fetch_and_store(
+async def international_airport_safety(code: str = None, scheduler: CrawlScheduler = None):
+    jobs = [
+        CrawlJob(
             endpoint=ICAOEndpoints.INTERNATIONAL_AIRPORT_SAFETY_CHARACTERISTICS,
             model=InternationalAirportSafety,
             conflict_enums=DatabaseUniqueColumns.INTERNATIONAL_AIRPORT_SAFETY_CHARACTERISTICS,
-            states=_code,
+            params={"states": _code},
         )
+        for _code in await countries_codes(code)
+    ]
+    await crawl(jobs, scheduler)
 
 
-async def metar_provider(code: str = None):
-    client = await db_session(_async_session=async_session, headers=HEADERS, api_key=API_KEY, base_url=BASE_URL)
-    for _code in await countries_codes(code):
-        await client.fetch_and_store(
+async def metar_provider(code: str = None, scheduler: CrawlScheduler = None):
+    jobs = [
+        CrawlJob(
             endpoint=ICAOEndpoints.METAR_PROVIDER_LOCATIONS,
             model=METARProviderLocation,
             conflict_enums=DatabaseUniqueColumns.INTERNATIONAL_AIRPORT_SAFETY_CHARACTERISTICS,
-            states=_code,
+            params={"states": _code},
+        )
+        for _code in await countries_codes(code)
+    ]
+    await crawl(jobs, scheduler)
+
+
+async def accident(code: str = None, scheduler: CrawlScheduler = None):
+    jobs = [
+        CrawlJob(
+            endpoint=ICAOEndpoints.ACCIDENTS,
+            model=Accident,
+            conflict_enums=DatabaseUniqueColumns.ACCIDENTS,
+            params={"StateOfOccurrence": _code, "Year": year},
         )
+        for _code in await countries_codes(code)
+        for year in year_list
+    ]
+    await crawl(jobs, scheduler)
+
+
+async def safety_related_occurrence(code: str = None, scheduler: CrawlScheduler = None):
+    jobs = [
+        CrawlJob(
+            endpoint=ICAOEndpoints.SAFETY_RELATED_OCCURRENCES,
+            model=SafetyRelatedOccurrence,
+            conflict_enums=DatabaseUniqueColumns.SAFETY_RELATED_OCCURRENCES,
+            params={"StateOfOccurrence": _code, "Year": year},
+        )
+        for _code in await countries_codes(code)
+        for year in year_list
+    ]
+    await crawl(jobs, scheduler)
+
+
+async def incident(code: str = None, scheduler: CrawlScheduler = None):
+    jobs = [
+        CrawlJob(
+            endpoint=ICAOEndpoints.INCIDENTS,
+            model=Incident,
+            conflict_enums=DatabaseUniqueColumns.INCIDENTS,
+            params={"StateOfOccurrence": _code, "Year": year},
+        )
+        for _code in await countries_codes(code)
+        for year in year_list
+    ]
+    await crawl(jobs, scheduler)
 
 
-async def accident(code: str = None):
-    client = await db_session(_async_session=async_session, headers=HEADERS, api_key=API_KEY, base_url=BASE_URL)
-    for _code in await countries_codes(code):
-        for year in year_list:
-            await client.fetch_and_store(
-                endpoint=ICAOEndpoints.ACCIDENTS,
-                model=Accident,
-                conflict_enums=DatabaseUniqueColumns.ACCIDENTS,
-                StateOfOccurrence=_code,
-                Year=year
-            )
-
-
-async def safety_related_occurrence(code: str = None):
-    client = await db_session(_async_session=async_session, headers=HEADERS, api_key=API_KEY, base_url=BASE_URL)
-    for _code in await countries_codes(code):
-        for year in year_list:
-            await client.fetch_and_store(
-                endpoint=ICAOEndpoints.SAFETY_RELATED_OCCURRENCES,
-                model=SafetyRelatedOccurrence,
-                conflict_enums=DatabaseUniqueColumns.SAFETY_RELATED_OCCURRENCES,
-                StateOfOccurrence=_code,
-                Year=year
-            )
-
-
-async def incident(code: str = None):
-    client = await db_session(_async_session=async_session, headers=HEADERS, api_key=API_KEY, base_url=BASE_URL)
-    for _code in await countries_codes(code):
-        for year in year_list:
-            await client.fetch_and_store(
-                endpoint=ICAOEndpoints.INCIDENTS,
-                model=Incident,
-                conflict_enums=DatabaseUniqueColumns.INCIDENTS,
-                StateOfOccurrence=_code,
-                Year=year
-            )
-
-
-async def member_state():
-    client = await db_session(_async_session=async_session, headers=HEADERS, api_key=API_KEY, base_url=BASE_URL)
-    for ro in RO:
-        await client.fetch_and_store(
+async def member_state(scheduler: CrawlScheduler = None):
+    jobs = [
+        CrawlJob(
             endpoint=ICAOEndpoints.ICAO_MEMBER_STATE,
             model=ICAOMemberState,
             conflict_enums=DatabaseUniqueColumns.ICAO_MEMBER_STATE,
-            RO=ro
+            params={"RO": ro},
         )
+        for ro in RO
+    ]
+    await crawl(jobs, scheduler)
 
 
-async def state_of_registry():
-    client = await db_session(_async_session=async_session, headers=HEADERS, api_key=API_KEY, base_url=BASE_URL)
-    for ro in RO:
-        await client.fetch_and_store(
+async def state_of_registry(scheduler: CrawlScheduler = None):
+    jobs = [
+        CrawlJob(
             endpoint=ICAOEndpoints.STATE_OF_REGISTRY,
             model=StateOfRegistry,
             conflict_enums=DatabaseUniqueColumns.STATE_OF_REGISTRY,
-            RO=ro
+            params={"RO": ro},
         )
+        for ro in RO
+    ]
+    await crawl(jobs, scheduler)
 
 
-async def asiap():
-    client = await db_session(_async_session=async_session, headers=HEADERS, api_key=API_KEY, base_url=BASE_URL)
-    for ro in RO:
-        await client.fetch_and_store(
+async def asiap(scheduler: CrawlScheduler = None):
+    jobs = [
+        CrawlJob(
             endpoint=ICAOEndpoints.ASIAPPRIORITIZATION,
             model=ASIAPPrioritization,
             conflict_enums=DatabaseUniqueColumns.ASIAPPRIORITIZATION,
-            region=ro
+            params={"region": ro},
         )
+        for ro in RO
+    ]
+    await crawl(jobs, scheduler)
 
 
-async def safety_margin_stats(code: str = None):
-    client = await db_session(_async_session=async_session, headers=HEADERS, api_key=API_KEY, base_url=BASE_URL)
-    for _code in await countries_codes(code):
-        await client.fetch_and_store(
+async def safety_margin_stats(code: str = None, scheduler: CrawlScheduler = None):
+    jobs = [
+        CrawlJob(
             endpoint=ICAOEndpoints.STATE_SAFETY_MARGINS,
             model=StateSafetyMargin,
             conflict_enums=DatabaseUniqueColumns.STATE_SAFETY_MARGINS,
-            states=_code,
+            params={"states": _code},
         )
+        for _code in await countries_codes(code)
+    ]
+    await crawl(jobs, scheduler)
 
 
-async def ssp_foundation(code: str = None):
-    client = await db_session(_async_session=async_session, headers=HEADERS, api_key=API_KEY, base_url=BASE_URL)
-    for _code in await countries_codes(code):
-        await client.fetch_and_store(
+async def ssp_foundation(code: str = None, scheduler: CrawlScheduler = None):
+    jobs = [
+        CrawlJob(
             endpoint=ICAOEndpoints.SSP_FOUNDATION_STATISTICS,
             model=SSPFoundation,
             conflict_enums=DatabaseUniqueColumns.SSP_FOUNDATION_STATISTICS,
-            States=_code,
+            params={"States": _code},
         )
-
-
-async def aerodrome_stats(code: str = None):
-    client = await db_session(_async_session=async_session, headers=HEADERS, api_key=API_KEY, base_url=BASE_URL)
-    for _code in await countries_codes(code):
-        for year in year_list:
-            await client.fetch_and_store(
-                endpoint=ICAOEndpoints.AERODROME_STATISTICS,
-                model=AerodromeStatistic,
-                conflict_enums=DatabaseUniqueColumns.AERODROME_STATISTICS,
-                states=_code,
-                Year=year
-            )
-
-
-async def operator_stats(code: str = None):
-    client = await db_session(_async_session=async_session, headers=HEADERS, api_key=API_KEY, base_url=BASE_URL)
-    for _code in await countries_codes(code):
-        for year in year_list:
-            await client.fetch_and_store(
-                endpoint=ICAOEndpoints.OPERATOR_STATISTICS,
-                model=OperatorStatistic,
-                conflict_enums=DatabaseUniqueColumns.OPERATOR_STATISTICS,
-                states=_code,
-                Year=year
-            )
-
-
-async def connections(code: str = None):
-    client = await db_session(_async_session=async_session, headers=HEADERS, api_key=API_KEY, base_url=BASE_URL)
-    for _code in await countries_codes(code):
-        for year in year_list:
-            await client.fetch_and_store(
-                endpoint=ICAOEndpoints.CONNECTIONS,
-                model=Connection,
-                conflict_enums=DatabaseUniqueColumns.CONNECTIONS,
-                states=_code,
-                Year=year
-            )
-
-
-async def state_traffic_stats(code: str = None):
-    client = await db_session(_async_session=async_session, headers=HEADERS, api_key=API_KEY, base_url=BASE_URL)
-    for _code in await countries_codes(code):
-        for year in year_list:
-            await client.fetch_and_store(
-                endpoint=ICAOEndpoints.STATE_TRAFFIC_STATISTICS,
-                model=StateTrafficStatistic,
-                conflict_enums=DatabaseUniqueColumns.STATE_TRAFFIC_STATISTICS,
-                states=_code,
-                Year=year
-            )
-
-
-async def caahr():
-    client = await db_session(_async_session=async_session, headers=HEADERS, api_key=API_KEY, base_url=BASE_URL)
-    await client.fetch_and_store(
-        endpoint=ICAOEndpoints.CAAHR,
-        model=CAAHR,
-        conflict_enums=DatabaseUniqueColumns.CAAHR,
-    )
+        for _code in await countries_codes(code)
+    ]
+    await crawl(jobs, scheduler)
+
+
+async def aerodrome_stats(code: str = None, scheduler: CrawlScheduler = None):
+    jobs = [
+        CrawlJob(
+            endpoint=ICAOEndpoints.AERODROME_STATISTICS,
+            model=AerodromeStatistic,
+            conflict_enums=DatabaseUniqueColumns.AERODROME_STATISTICS,
+            params={"states": _code, "Year": year},
+        )
+        for _code in await countries_codes(code)
+        for year in year_list
+    ]
+    await crawl(jobs, scheduler)
+
+
+async def operator_stats(code: str = None, scheduler: CrawlScheduler = None):
+    jobs = [
+        CrawlJob(
+            endpoint=ICAOEndpoints.OPERATOR_STATISTICS,
+            model=OperatorStatistic,
+            conflict_enums=DatabaseUniqueColumns.OPERATOR_STATISTICS,
+            params={"states": _code, "Year": year},
+        )
+        for _code in await countries_codes(code)
+        for year in year_list
+    ]
+    await crawl(jobs, scheduler)
+
+
+async def connections(code: str = None, scheduler: CrawlScheduler = None):
+    jobs = [
+        CrawlJob(
+            endpoint=ICAOEndpoints.CONNECTIONS,
+            model=Connection,
+            conflict_enums=DatabaseUniqueColumns.CONNECTIONS,
+            params={"states": _code, "Year": year},
+        )
+        for _code in await countries_codes(code)
+        for year in year_list
+    ]
+    await crawl(jobs, scheduler)
+
+
+async def state_traffic_stats(code: str = None, scheduler: CrawlScheduler = None):
+    jobs = [
+        CrawlJob(
+            endpoint=ICAOEndpoints.STATE_TRAFFIC_STATISTICS,
+            model=StateTrafficStatistic,
+            conflict_enums=DatabaseUniqueColumns.STATE_TRAFFIC_STATISTICS,
+            params={"states": _code, "Year": year},
+        )
+        for _code in await countries_codes(code)
+        for year in year_list
+    ]
+    await crawl(jobs, scheduler)
+
+
+async def caahr(scheduler: CrawlScheduler = None):
+    jobs = [
+        CrawlJob(
+            endpoint=ICAOEndpoints.CAAHR,
+            model=CAAHR,
+            conflict_enums=DatabaseUniqueColumns.CAAHR,
+        )
+    ]
+    await crawl(jobs, scheduler)
+
+
+GLOBAL_LOADERS = [
+    manufacturer,
+    type_designators,
+    member_state,
+    state_of_registry,
+    asiap,
+    caahr,
+]
+COUNTRY_LOADERS = [
+    operators,
+    risk_profile,
+    aerodrome_location,
+    international_aerodromes,
+    operational_aerodrome_info,
+    airport_pbn_impl,
+    international_airport_safety,
+    metar_provider,
+    accident,
+    safety_related_occurrence,
+    incident,
+    safety_margin_stats,
+    ssp_foundation,
+    aerodrome_stats,
+    operator_stats,
+    connections,
+    state_traffic_stats,
+]
+
+
+async def crawl_all(code: str = None, crawl_id: str = None):
+    """
+    Runs every loader in one pass through one scheduler.
+
+    Completed (endpoint, params) units are stored in crawl_state, running again with the same
+    crawl_id fetches only the units that are not done yet.
+
+    :param code: alpha-3 code to start country loaders from
+    :param crawl_id: crawl to resume, by default one crawl per day
+    """
+
+    await check_and_create_table_api()
+
+    crawl_id = crawl_id or datetime.now().strftime("full-%Y-%m-%d")
+    logger.info(f"Crawl {crawl_id} (pass crawl_id='{crawl_id}' to resume it)")
+
+    scheduler = create_scheduler(crawl_id)
+    for loader in GLOBAL_LOADERS:
+        await loader(scheduler=scheduler)
+    for loader in COUNTRY_LOADERS:
+        await loader(code=code, scheduler=scheduler)
+
+    await scheduler.run()
+    return scheduler
 
 
 if __name__ == "__main__":
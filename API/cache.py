@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+from Utills.Logger.Logger import get_project_root
+
+CACHE_DIR = get_project_root() / 'Cache' / 'ICAO'
+
+
+class ResponseCache:
+    def __init__(self, directory: Path = CACHE_DIR):
+        """
+        On-disk API response cache keyed by endpoint and request params.
+
+        Every entry has a data file with the payload and a meta file with fetch time,
+        ETag / Last-Modified validators, payload digest and the digest last saved to DataBase.
+        """
+        self.directory = Path(directory)
+
+    @staticmethod
+    def digest(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _paths(self, endpoint: str, params: dict) -> tuple[Path, Path]:
+        key = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        folder = self.directory / endpoint
+        return folder / f"{key}.json", folder / f"{key}.meta.json"
+
+    @staticmethod
+    def _write(path: Path, text: str):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        tmp_path.write_text(text, encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    def meta(self, endpoint: str, params: dict) -> dict | None:
+        _, meta_path = self._paths(endpoint, params)
+        try:
+            return json.loads(meta_path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def is_fresh(self, meta: dict | None, ttl: float) -> bool:
+        return bool(meta) and ttl > 0 and time.time() - meta["fetched_at"] < ttl
+
+    def data(self, endpoint: str, params: dict) -> str | None:
+        data_path, _ = self._paths(endpoint, params)
+        try:
+            return data_path.read_text(encoding="utf-8")
+        except FileNotFoundError:
+            return None
+
+    def put(self, endpoint: str, params: dict, text: str, etag: str | None = None,
+            last_modified: str | None = None) -> str:
+        """Saves a payload, returns its digest"""
+        data_path, meta_path = self._paths(endpoint, params)
+        meta = self.meta(endpoint, params) or {}
+        meta.update({
+            "endpoint": endpoint,
+            "params": params,
+            "fetched_at": time.time(),
+            "etag": etag,
+            "last_modified": last_modified,
+            "digest": self.digest(text),
+        })
+        self._write(data_path, text)
+        self._write(meta_path, json.dumps(meta))
+        return meta["digest"]
+
+    def touch(self, endpoint: str, params: dict):
+        """Payload revalidated by the server (304), restart its TTL"""
+        _, meta_path = self._paths(endpoint, params)
+        meta = self.meta(endpoint, params)
+        if meta:
+            meta["fetched_at"] = time.time()
+            self._write(meta_path, json.dumps(meta))
+
+    def drop_validators(self, endpoint: str, params: dict):
+        """Payload is lost, the next request is unconditional so the server sends it again"""
+        _, meta_path = self._paths(endpoint, params)
+        meta = self.meta(endpoint, params)
+        if meta:
+            meta.update({"etag": None, "last_modified": None, "fetched_at": 0})
+            self._write(meta_path, json.dumps(meta))
+
+    def mark_stored(self, endpoint: str, params: dict, digest: str):
+        """Payload with this digest was saved to DataBase"""
+        _, meta_path = self._paths(endpoint, params)
+        meta = self.meta(endpoint, params)
+        if meta:
+            meta["stored_digest"] = digest
+            self._write(meta_path, json.dumps(meta))
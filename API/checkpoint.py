@@ -0,0 +1,68 @@
+import json
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from DATABASE.ICAO import CrawlState
+from Utills.Logger import logger
+
+DONE = "done"
+FAILED = "failed"
+
+
+class CrawlCheckpoint:
+    def __init__(self, async_session: async_sessionmaker, crawl_id: str):
+        """
+        Persists completed crawl units, so a crawl with the same crawl_id resumes where it stopped
+
+        :param async_session: API DataBase session maker
+        :param crawl_id: crawl identifier
+        """
+        self.async_session = async_session
+        self.crawl_id = crawl_id
+
+    @staticmethod
+    def key(job) -> tuple[str, str]:
+        return job.endpoint.value, json.dumps(job.params, sort_keys=True, ensure_ascii=False, default=str)
+
+    async def completed(self) -> set[tuple[str, str]]:
+        """(endpoint, params) units already done in this crawl"""
+        async with self.async_session() as session:
+            result = await session.execute(
+                select(CrawlState.endpoint, CrawlState.params).where(
+                    CrawlState.crawl_id == self.crawl_id,
+                    CrawlState.status == DONE
+                )
+            )
+            return {(row.endpoint, row.params) for row in result.all()}
+
+    async def mark(self, job, status: str, attempts: int, error: str | None = None):
+        endpoint, params = self.key(job)
+        stmt = insert(CrawlState).values(
+            crawl_id=self.crawl_id,
+            endpoint=endpoint,
+            params=params,
+            status=status,
+            attempts=attempts,
+            error=error,
+            updated_at=datetime.now()
+        )
+        stmt = stmt.on_conflict_do_update(
+            constraint="uq_crawl_state_unique",
+            set_={
+                "status": stmt.excluded.status,
+                "attempts": CrawlState.attempts + stmt.excluded.attempts,
+                "error": stmt.excluded.error,
+                "updated_at": stmt.excluded.updated_at,
+            }
+        )
+
+        try:
+            async with self.async_session() as session:
+                await session.execute(stmt)
+                await session.commit()
+        except Exception as e:
+            # The data is already stored, the unit is only fetched again on resume
+            logger.warning(f"⚠️ Failed to save crawl state for {endpoint}{params}: {e}")
@@ -1,6 +1,7 @@
 import json
 import os
 import ssl
+import time
 from enum import Enum
 from typing import Type, Any
 
@@ -9,7 +10,9 @@ from dotenv import load_dotenv
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from Utills import Metrics as metrics
 from Utills.Logger import logger
+from cache import ResponseCache
 from enums import ICAOEndpoints
 
 ssl_context = ssl.create_default_context()
@@ -19,36 +22,155 @@ ssl_context.verify_mode = ssl.CERT_NONE
 load_dotenv()
 
 
+def create_http_session(limit: int = 100, limit_per_host: int = 10, ttl_dns_cache: int = 300,
+                        keepalive_timeout: float = 30, timeout: float = 120) -> aiohttp.ClientSession:
+    """
+    Creates a pooled aiohttp session with keep-alive connections and DNS cache
+
+    :param limit: max open connections in total
+    :param limit_per_host: max open connections per host
+    :param ttl_dns_cache: DNS cache TTL in seconds
+    :param keepalive_timeout: seconds an idle connection is kept open
+    :param timeout: total request timeout in seconds
+    :return: aiohttp.ClientSession
+    """
+
+    connector = aiohttp.TCPConnector(
+        ssl=ssl_context,
+        limit=limit,
+        limit_per_host=limit_per_host,
+        use_dns_cache=True,
+        ttl_dns_cache=ttl_dns_cache,
+        keepalive_timeout=keepalive_timeout,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout))
+
+
 class ApiClient:
-    def __init__(self, session: AsyncSession, headers: dict, base_url: str, api_key: str = None):
+    def __init__(self, session: AsyncSession, headers: dict, base_url: str, api_key: str = None,
+                 http: aiohttp.ClientSession = None, cache: ResponseCache = None, cache_ttls: dict = None,
+                 **pool_options):
+        """
+        :param session: DataBase session
+        :param headers: request headers
+        :param base_url: API base url
+        :param api_key: API key
+        :param http: shared aiohttp session, the client does not close it
+        :param cache: response cache, also used to skip saving payloads identical to the last saved one
+        :param cache_ttls: seconds a cached response is served without a request, by endpoint
+        :param pool_options: create_http_session options when the client owns its session
+        """
         self.session = session
         self.headers = headers
         self.API_KEY = api_key
         self.BASE_URL = base_url
+        self.pool_options = pool_options
+        self._http = http
+        self._owns_http = http is None
+        self.cache = cache
+        self.cache_ttls = cache_ttls or {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def _get_http(self) -> aiohttp.ClientSession:
+        if self._http is None or self._http.closed:
+            self._http = create_http_session(**self.pool_options)
+            self._owns_http = True
+        return self._http
+
+    async def close(self):
+        if self._owns_http and self._http is not None and not self._http.closed:
+            await self._http.close()
+        self._http = None
+
+    def _cached_json(self, endpoint: str, params: dict) -> list[dict] | None:
+        """Cached payload, None if its data file is missing or truncated"""
+        text = self.cache.data(endpoint, params)
+        if not text:
+            return None
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            return None
+
+    async def _fetch(self, endpoint: str, params: dict) -> tuple[list[dict], str | None]:
+        """
+        :return: records and digest of the payload, None without a cache. The digest is returned
+            rather than kept on the client, crawl units share the client concurrently
+        """
+        cache_params = dict(params)
+        meta = self.cache.meta(endpoint, cache_params) if self.cache is not None else None
+
+        if self.cache is not None and self.cache.is_fresh(meta, self.cache_ttls.get(endpoint, 0)):
+            json_data = self._cached_json(endpoint, cache_params)
+            if json_data is not None:
+                metrics.API_CACHE_RESULTS.labels(endpoint, "fresh").inc()
+                logger.info(f"✅ Cached response for {endpoint}: {len(json_data)} records")
+                return json_data, meta["digest"]
 
-    async def _fetch(self, endpoint: str, params: dict) -> list[dict]:
         if self.API_KEY is not None:
             params["api_key"] = self.API_KEY
             params["format"] = "json"
             params.pop("callback", None)
 
         url = f"{self.BASE_URL}/{endpoint}"
-        logger.info(f"Sending request to: {url} with params: {params}")
+        for conditional in (True, False):
+            headers = dict(self.headers)
+            if meta and conditional:
+                if meta.get("etag"):
+                    headers["If-None-Match"] = meta["etag"]
+                if meta.get("last_modified"):
+                    headers["If-Modified-Since"] = meta["last_modified"]
+
+            logger.info(f"Sending request to: {url} with params: {params}")
+
+            status = "error"
+            start = time.perf_counter()
+            try:
+                async with self._get_http().get(url, params=params, headers=headers) as response:
+                    status = str(response.status)
+                    if response.status == 304 and meta and conditional:
+                        json_data = self._cached_json(endpoint, cache_params)
+                        if json_data is not None:
+                            self.cache.touch(endpoint, cache_params)
+                            metrics.API_CACHE_RESULTS.labels(endpoint, "not_modified").inc()
+                            logger.info(f"✅ Not modified {endpoint}: {len(json_data)} cached records")
+                            return json_data, meta["digest"]
+
+                        # Validators survived their payload (partial write, pruning), a 304 has nothing to serve
+                        logger.warning(f"⚠️ Cached payload of {endpoint} is missing, fetching it without validators")
+                        self.cache.drop_validators(endpoint, cache_params)
+                        continue
 
-        try:
-            async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=ssl_context)) as client:
-                async with client.get(url, params=params, headers=self.headers) as response:
                     response.raise_for_status()
                     text = await response.text()
                     json_data = json.loads(text)
                     logger.info(f"✅ Received response from {endpoint}: {len(json_data)} records")
-                    return json_data
-        except aiohttp.ClientResponseError as e:
-            logger.error(f"❌ HTTP error [{e.status}] for {url}: {e.message}")
-            raise
-        except Exception as e:
-            logger.exception(f"❌ Unexpected error while fetching data from {url}: {e}")
-            raise
+
+                    digest = None
+                    if self.cache is not None:
+                        metrics.API_CACHE_RESULTS.labels(endpoint, "miss").inc()
+                        digest = self.cache.put(
+                            endpoint,
+                            cache_params,
+                            text,
+                            etag=response.headers.get("ETag"),
+                            last_modified=response.headers.get("Last-Modified")
+                        )
+                    return json_data, digest
+            except aiohttp.ClientResponseError as e:
+                logger.error(f"❌ HTTP error [{e.status}] for {url}: {e.message}")
+                raise
+            except Exception as e:
+                logger.exception(f"❌ Unexpected error while fetching data from {url}: {e}")
+                raise
+            finally:
+                # Body read and parsing included, they are part of the request as seen by the caller
+                metrics.HTTP_FETCH_SECONDS.labels("icao", endpoint, status).observe(time.perf_counter() - start)
 
     def _chunked(self, iterable, size):
         for i in range(0, len(iterable), size):
@@ -123,5 +245,15 @@ class ApiClient:
 
     async def fetch_and_store(self, endpoint: Enum, model: Type[Any], conflict_enums: Enum, **kwargs):
         logger.debug(f"Fetching and storing data for endpoint: {endpoint}")
-        data = await self._fetch(endpoint.value, kwargs)
+        data, digest = await self._fetch(endpoint.value, dict(kwargs))
+
+        if self.cache is not None and digest is not None:
+            meta = self.cache.meta(endpoint.value, kwargs)
+            if meta and meta.get("stored_digest") == digest:
+                logger.info(f"⏭️ {endpoint.value} payload unchanged since last save, skipping DataBase write")
+                return
+
         await self._save_to_db(data, model, conflict_enums)
+
+        if self.cache is not None and digest is not None:
+            self.cache.mark_stored(endpoint.value, kwargs, digest)
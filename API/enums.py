@@ -1044,3 +1044,15 @@ class DatabaseUniqueColumns(Enum):
     STATE_TRAFFIC_STATISTICS = ["State", "Year"]
     CAAHR = ["UN_state_name"]
     STATE_SAFETY_MARGINS = ["State"]
+
+
+DAY = 24 * 60 * 60
+
+# Seconds a cached response is used without a request, endpoints not listed are always requested
+ENDPOINT_CACHE_TTL = {
+    ICAOEndpoints.MANUFACTURER_LIST: 7 * DAY,
+    ICAOEndpoints.AIRCRAFT_TYPE_DESIGNATORS: 7 * DAY,
+    ICAOEndpoints.ICAO_MEMBER_STATE: 30 * DAY,
+    ICAOEndpoints.STATE_OF_REGISTRY: 30 * DAY,
+    ICAOEndpoints.CAAHR: 7 * DAY,
+}
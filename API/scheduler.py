@@ -0,0 +1,156 @@
+import asyncio
+import random
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Callable, Type
+
+import aiohttp
+
+from Utills import TokenBucket
+from Utills.Logger import logger
+from checkpoint import CrawlCheckpoint, DONE, FAILED
+from client import ApiClient, create_http_session
+
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+@dataclass
+class CrawlJob:
+    endpoint: Enum
+    model: Type[Any]
+    conflict_enums: Enum
+    params: dict = field(default_factory=dict)
+
+    def __str__(self):
+        return f"{self.endpoint.value}{self.params}"
+
+
+class CrawlScheduler:
+    def __init__(self, client_factory: Callable[[aiohttp.ClientSession], ApiClient], concurrency: int = 8,
+                 rate: float = 2.0, rate_limits: dict | None = None, global_rate: float | None = None,
+                 retries: int = 5, backoff: float = 1.0, max_backoff: float = 60.0,
+                 checkpoint: CrawlCheckpoint | None = None):
+        """
+        Runs (endpoint, params) crawl jobs with bounded concurrency.
+
+        :param client_factory: creates an ApiClient with its own DataBase session on the shared http session
+        :param concurrency: number of workers
+        :param rate: requests per second per endpoint
+        :param rate_limits: requests per second for specific endpoints
+        :param global_rate: requests per second over all endpoints
+        :param retries: attempts per job
+        :param backoff: first retry delay in seconds, doubled on every attempt
+        :param max_backoff: max retry delay in seconds
+        :param checkpoint: skips units completed by a previous run and records new ones
+        """
+        self.client_factory = client_factory
+        self.concurrency = concurrency
+        self.rate = rate
+        self.rate_limits = rate_limits or {}
+        self.global_bucket = TokenBucket(global_rate) if global_rate else None
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.checkpoint = checkpoint
+
+        self.jobs: list[CrawlJob] = []
+        self.done: list[CrawlJob] = []
+        self.failed: list[tuple[CrawlJob, str]] = []
+        self._buckets: dict[Enum, TokenBucket] = {}
+
+    def submit(self, jobs: list[CrawlJob]):
+        self.jobs.extend(jobs)
+
+    async def run(self):
+        """Runs all submitted jobs"""
+        jobs, self.jobs = self.jobs, []
+
+        if self.checkpoint is not None:
+            completed = await self.checkpoint.completed()
+            pending = [job for job in jobs if self.checkpoint.key(job) not in completed]
+            if len(pending) < len(jobs):
+                logger.info(
+                    f"Crawl {self.checkpoint.crawl_id}: resuming, "
+                    f"{len(jobs) - len(pending)} of {len(jobs)} jobs already done"
+                )
+            jobs = pending
+
+        queue: asyncio.Queue[CrawlJob] = asyncio.Queue()
+        for job in jobs:
+            queue.put_nowait(job)
+        total = len(jobs)
+
+        logger.info(f"Crawl started: {total} jobs, {self.concurrency} workers")
+
+        async with create_http_session(limit=self.concurrency * 2, limit_per_host=self.concurrency) as http:
+            workers = [asyncio.create_task(self._worker(queue, http)) for _ in range(self.concurrency)]
+            try:
+                await queue.join()
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+
+        logger.info(f"Crawl completed: {len(self.done)} done, {len(self.failed)} failed of {total} jobs")
+
+    async def _worker(self, queue: asyncio.Queue, http: aiohttp.ClientSession):
+        client = self.client_factory(http)
+        try:
+            while True:
+                job = await queue.get()
+                try:
+                    await self._run_job(client, job)
+                finally:
+                    queue.task_done()
+        finally:
+            await client.close()
+            await client.session.close()
+
+    def _bucket(self, endpoint: Enum) -> TokenBucket:
+        if endpoint not in self._buckets:
+            self._buckets[endpoint] = TokenBucket(self.rate_limits.get(endpoint, self.rate))
+        return self._buckets[endpoint]
+
+    async def _run_job(self, client: ApiClient, job: CrawlJob):
+        for attempt in range(1, self.retries + 1):
+            await self._bucket(job.endpoint).acquire()
+            if self.global_bucket is not None:
+                await self.global_bucket.acquire()
+
+            try:
+                await client.fetch_and_store(
+                    endpoint=job.endpoint,
+                    model=job.model,
+                    conflict_enums=job.conflict_enums,
+                    **job.params
+                )
+                self.done.append(job)
+                if self.checkpoint is not None:
+                    await self.checkpoint.mark(job, DONE, attempt)
+                return
+
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None or attempt == self.retries:
+                    logger.error(f"❌ Crawl job {job} failed after {attempt} attempts: {e}")
+                    self.failed.append((job, str(e)))
+                    if self.checkpoint is not None:
+                        await self.checkpoint.mark(job, FAILED, attempt, str(e))
+                    return
+
+                logger.warning(f"⚠️ Crawl job {job} attempt {attempt} failed: {e}. Retry in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    def _retry_delay(self, error: Exception, attempt: int) -> float | None:
+        """Seconds to wait before the next attempt, None if the error is not retryable"""
+        if isinstance(error, aiohttp.ClientResponseError):
+            if error.status not in RETRY_STATUSES:
+                return None
+            retry_after = (error.headers or {}).get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                return min(self.max_backoff, float(retry_after))
+        elif not isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError)):
+            return None
+
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return delay * (0.5 + random.random() / 2)
@@ -0,0 +1,120 @@
+import argparse
+import asyncio
+import json
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+from Benchmarks.Ingest import measure, load_corpus
+from Benchmarks.Workbooks import generate_corpus, LAYOUTS
+from DataProcessor.ExcelReader import read_frames, read_sheet, calamine_available, CALAMINE, OPENPYXL
+from DataProcessor.PassengersDataProcessor import transform_passengers_frame
+
+
+def available_engines() -> list[str]:
+    return [CALAMINE, OPENPYXL] if calamine_available() else [OPENPYXL]
+
+
+def read_passengers(file_path: str, engine: str, chunk_size: int, streaming: bool) -> pd.DataFrame:
+    frames = list(read_frames(file_path, chunk_size, streaming, engine))
+    used = {df.attrs.get('excel_engine') for df in frames}
+    if used != {engine}:
+        raise RuntimeError(f"{file_path} was read with {used}, not {engine}")
+    return pd.concat(frames, ignore_index=True)
+
+
+def read_finances(file_path: str, engine: str) -> pd.DataFrame:
+    df = read_sheet(file_path, engine, header=[0, 1])
+    if df.attrs.get('excel_engine') != engine:
+        raise RuntimeError(f"{file_path} was read with {df.attrs.get('excel_engine')}, not {engine}")
+    return df
+
+
+def finances_records(df: pd.DataFrame) -> list[dict]:
+    from DataProcessor import FinancialDataProcessor
+
+    # Only the transform methods are used, the engine is never connected
+    processor = FinancialDataProcessor("postgresql+asyncpg://localhost/bench")
+    return asyncio.run(processor._transform_data(df))
+
+
+def bench_file(kind: str, file_path: str, engines: list[str], chunk_size: int, streaming: bool) -> list[dict]:
+    """Reads a file with every engine, the transformed records must be the same"""
+    results, outputs = [], {}
+    for engine in engines:
+        with measure({'kind': kind, 'file': Path(file_path).name, 'engine': engine,
+                      'streaming': streaming if kind == 'passengers' else False}) as result:
+            if kind == 'passengers':
+                df = read_passengers(file_path, engine, chunk_size, streaming)
+            else:
+                df = read_finances(file_path, engine)
+            result['rows'] = len(df)
+        results.append(result)
+
+        if kind == 'passengers':
+            outputs[engine] = transform_passengers_frame(df).to_dict('records')
+        else:
+            outputs[engine] = finances_records(df)
+
+    reference = outputs[engines[-1]]
+    for result in results:
+        result['same_records'] = outputs[result['engine']] == reference
+    return results
+
+
+def summary(results: list[dict]) -> dict:
+    """Total seconds per engine and speedup over openpyxl"""
+    totals = {}
+    for result in results:
+        totals[result['engine']] = totals.get(result['engine'], 0.0) + result['seconds']
+    return {
+        'seconds': {engine: round(seconds, 3) for engine, seconds in totals.items()},
+        'speedup': {
+            engine: round(totals[OPENPYXL] / seconds, 2) for engine, seconds in totals.items() if seconds
+        },
+        'same_records': all(result['same_records'] for result in results),
+    }
+
+
+def run(args) -> dict:
+    engines = args.engines or available_engines()
+    with tempfile.TemporaryDirectory(prefix='asg_engines_') as tmp:
+        directory = args.corpus
+        if directory is None:
+            directory = tmp
+            generate_corpus(directory, args.passengers_files, args.passengers_rows, args.finances_files,
+                            args.finances_rows, args.layout, args.seed)
+        corpus = load_corpus(directory)
+
+        results = []
+        for file_path in corpus['passengers']:
+            for streaming in (False, True):
+                results += bench_file('passengers', file_path, engines, args.chunk_size, streaming)
+        for file_path in corpus['finances']:
+            results += bench_file('finances', file_path, engines, args.chunk_size, False)
+
+    return {'engines': engines, 'summary': summary(results) if OPENPYXL in engines else None, 'results': results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare Excel reader engines on a workbook corpus")
+    parser.add_argument("--corpus", help="directory with passengers/ and finances/ workbooks, "
+                                         "synthetic workbooks are generated if omitted")
+    parser.add_argument("--engines", nargs="+", choices=(CALAMINE, OPENPYXL),
+                        help="installed engines by default")
+    parser.add_argument("--passengers-files", type=int, default=2)
+    parser.add_argument("--passengers-rows", type=int, default=20000)
+    parser.add_argument("--finances-files", type=int, default=1)
+    parser.add_argument("--finances-rows", type=int, default=500)
+    parser.add_argument("--layout", default='full', choices=LAYOUTS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    report = json.dumps(run(args), indent=2, default=str)
+    if args.output:
+        Path(args.output).write_text(report)
+    else:
+        print(report)
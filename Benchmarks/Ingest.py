@@ -0,0 +1,298 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+import psutil
+from dotenv import load_dotenv
+from prometheus_client import REGISTRY
+
+from Benchmarks.Workbooks import generate_corpus, BENCH_CARRIER, BENCH_FINANCES_CARRIER_RE, LAYOUTS
+from DataProcessor.ExcelReader import read_frames, read_sheet
+from DataProcessor.PassengersDataProcessor import transform_passengers_frame, check_columns, WRITE_MODES, \
+    PARSE_MODES
+
+load_dotenv()
+
+STAGES = ('parse', 'transform', 'write', 'pipeline')
+# Stages without a DataBase
+LOCAL_STAGES = ('parse', 'transform')
+
+
+class RssSampler:
+    def __init__(self, interval: float = 0.02):
+        """
+        Samples RSS of this process and its children (process parse mode) in a background thread
+
+        :param interval: seconds between samples
+        """
+        self.interval = interval
+        self.peak = 0
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _rss(self) -> int:
+        rss = self._process.memory_info().rss
+        for child in self._process.children(recursive=True):
+            try:
+                rss += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return rss
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self._rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._rss())
+
+
+@contextmanager
+def measure(result: dict):
+    """Adds seconds and peak_rss_mb of the block to result"""
+    with RssSampler() as sampler:
+        started = time.perf_counter()
+        yield result
+        result['seconds'] = round(time.perf_counter() - started, 3)
+    result['peak_rss_mb'] = round(sampler.peak / 1024 / 1024, 1)
+    if result.get('rows') is not None and result['seconds']:
+        result['rows_per_sec'] = round(result['rows'] / result['seconds'], 1)
+
+
+def metric_sums(kind: str) -> dict[str, float]:
+    """Busy seconds per stage and rows written from Utills.Metrics, summed over concurrent files"""
+    names = {
+        'parse_busy_seconds': ('asg_excel_parse_seconds_sum', {'kind': kind}),
+        'transform_busy_seconds': ('asg_transform_seconds_sum', {'kind': kind}),
+        'rows_written': ('asg_rows_written_total', {'kind': kind}),
+        'failed_chunks': ('asg_failed_chunks_total', {'kind': kind}),
+    }
+    values = {name: REGISTRY.get_sample_value(*sample) or 0.0 for name, sample in names.items()}
+    values['write_busy_seconds'] = sum(
+        REGISTRY.get_sample_value('asg_db_write_seconds_sum', {'kind': kind, 'mode': mode}) or 0.0
+        for mode in WRITE_MODES
+    )
+    return values
+
+
+def parse_passengers(files: list[str], chunk_size: int, streaming: bool) -> list[pd.DataFrame]:
+    frames = []
+    for file_path in files:
+        frames.extend(read_frames(file_path, chunk_size, streaming))
+    return frames
+
+
+def parse_finances(files: list[str]) -> list[pd.DataFrame]:
+    return [read_sheet(file_path, header=[0, 1]) for file_path in files]
+
+
+def bench_parse(corpus: dict, chunk_size: int, streaming: bool) -> list[dict]:
+    results = []
+    with measure({'stage': 'parse', 'kind': 'passengers', 'files': len(corpus['passengers']),
+                  'streaming': streaming}) as result:
+        frames = parse_passengers(corpus['passengers'], chunk_size, streaming)
+        result['rows'] = sum(len(df) for df in frames)
+    results.append(result)
+
+    with measure({'stage': 'parse', 'kind': 'finances', 'files': len(corpus['finances'])}) as result:
+        frames = parse_finances(corpus['finances'])
+        result['rows'] = sum(len(df) for df in frames)
+    results.append(result)
+    return results
+
+
+def bench_transform(corpus: dict, chunk_size: int, streaming: bool) -> list[dict]:
+    """Transforms of pre-parsed frames, parse time is not included"""
+    from DataProcessor import FinancialDataProcessor
+
+    results = []
+    frames = parse_passengers(corpus['passengers'], chunk_size, streaming)
+    with measure({'stage': 'transform', 'kind': 'passengers', 'files': len(corpus['passengers'])}) as result:
+        rows = 0
+        for df in frames:
+            check_columns(df)
+            rows += len(transform_passengers_frame(df).to_dict('records'))
+        result['rows'] = rows
+    results.append(result)
+
+    frames = parse_finances(corpus['finances'])
+    # Only the transform methods are used, the engine is never connected
+    processor = FinancialDataProcessor("postgresql+asyncpg://localhost/bench")
+    with measure({'stage': 'transform', 'kind': 'finances', 'files': len(corpus['finances'])}) as result:
+        rows = 0
+        for df in frames:
+            rows += len(asyncio.run(processor._transform_data(df)))
+        result['rows'] = rows
+    results.append(result)
+    return results
+
+
+async def cleanup_bench_rows(db_url: str):
+    """Deletes rows of synthetic workbooks, passengers carrier BENCH and finances carriers bench<N>"""
+    from sqlalchemy import delete
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from DATABASE import ASGPassengersTable, ASGFinancesTable
+    from Benchmarks.WriteModes import bench_db_url
+
+    engine = create_async_engine(bench_db_url(db_url))
+    try:
+        async with engine.begin() as conn:
+            await conn.execute(delete(ASGPassengersTable).where(ASGPassengersTable.air_carrier == BENCH_CARRIER))
+            await conn.execute(delete(ASGFinancesTable).where(
+                ASGFinancesTable.air_carrier.regexp_match(BENCH_FINANCES_CARRIER_RE)
+            ))
+    finally:
+        await engine.dispose()
+
+
+async def bench_write(db_url: str, rows: int, chunk_size: int, modes: list[str]) -> list[dict]:
+    """Write stage alone, see Benchmarks.WriteModes"""
+    from Benchmarks.WriteModes import benchmark
+
+    with measure({}) as result:
+        modes_results = await benchmark(db_url, rows, chunk_size, modes)
+    return [{'stage': 'write', 'kind': 'passengers', **mode_result, 'peak_rss_mb': result['peak_rss_mb']}
+            for mode_result in modes_results]
+
+
+async def bench_pipeline(db_url: str, corpus: dict, chunk_size: int, streaming: bool, write_mode: str,
+                         parse_mode: str, max_workers: int) -> list[dict]:
+    """Full processors against a DataBase, as run_passengers and run_finances run them"""
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from Benchmarks.WriteModes import bench_db_url, create_bench_tables
+    from DataProcessor import DataProcessor, FinancialDataProcessor
+
+    engine = create_async_engine(bench_db_url(db_url))
+    try:
+        await create_bench_tables(engine)
+    finally:
+        await engine.dispose()
+    await cleanup_bench_rows(db_url)
+
+    results = []
+    try:
+        before = metric_sums('passengers')
+        processor = DataProcessor(db_url=db_url, max_workers=max_workers, chunk_size=chunk_size,
+                                  streaming=streaming, write_mode=write_mode, parse_mode=parse_mode)
+        with measure({'stage': 'pipeline', 'kind': 'passengers', 'files': len(corpus['passengers']),
+                      'write_mode': write_mode, 'parse_mode': parse_mode, 'streaming': streaming}) as result:
+            await processor.process_files(corpus['passengers'])
+        after = metric_sums('passengers')
+        result.update({name: round(after[name] - before[name], 3) for name in after})
+        result['rows'] = int(result.pop('rows_written'))
+        result['rows_per_sec'] = round(result['rows'] / result['seconds'], 1) if result['seconds'] else None
+        result['failed_files'] = len(processor.errors['FAILED'])
+        results.append(result)
+
+        before = metric_sums('finances')
+        processor = FinancialDataProcessor(db_url=db_url, max_workers=max_workers)
+        with measure({'stage': 'pipeline', 'kind': 'finances', 'files': len(corpus['finances'])}) as result:
+            await processor.process_files(corpus['finances'])
+        after = metric_sums('finances')
+        result.update({name: round(after[name] - before[name], 3) for name in after})
+        result['rows'] = int(result.pop('rows_written'))
+        result['rows_per_sec'] = round(result['rows'] / result['seconds'], 1) if result['seconds'] else None
+        result['failed_files'] = len(processor.errors['failed_files'])
+        results.append(result)
+    finally:
+        await cleanup_bench_rows(db_url)
+
+    return results
+
+
+def load_corpus(directory: str) -> dict:
+    directory = Path(directory)
+    return {
+        'passengers': sorted(str(path) for path in (directory / 'passengers').glob('*.xlsx')),
+        'finances': sorted(str(path) for path in (directory / 'finances').glob('*.xlsx')),
+    }
+
+
+def run(args) -> dict:
+    with tempfile.TemporaryDirectory(prefix='asg_bench_') as tmp:
+        directory = args.corpus
+        if directory is None:
+            directory = tmp
+            generate_corpus(directory, args.passengers_files, args.passengers_rows, args.finances_files,
+                            args.finances_rows, args.layout, args.seed)
+        corpus = load_corpus(directory)
+        corpus_bytes = sum(os.path.getsize(path) for paths in corpus.values() for path in paths)
+
+        results = []
+        if 'parse' in args.stages:
+            results += bench_parse(corpus, args.chunk_size, args.streaming)
+        if 'transform' in args.stages:
+            results += bench_transform(corpus, args.chunk_size, args.streaming)
+        if 'write' in args.stages:
+            results += asyncio.run(bench_write(args.db_url, args.write_rows, args.chunk_size, args.write_modes))
+        if 'pipeline' in args.stages:
+            results += asyncio.run(bench_pipeline(
+                args.db_url, corpus, args.chunk_size, args.streaming, args.write_mode, args.parse_mode,
+                args.max_workers
+            ))
+
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'cpu_count': os.cpu_count(),
+            'memory_mb': round(psutil.virtual_memory().total / 1024 / 1024),
+        },
+        'corpus': {
+            'directory': args.corpus,
+            'passengers_files': len(corpus['passengers']),
+            'finances_files': len(corpus['finances']),
+            'bytes': corpus_bytes,
+        },
+        'results': results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Excel ingest stages and the full pipeline")
+    parser.add_argument("--stages", nargs="+", default=list(LOCAL_STAGES), choices=STAGES,
+                        help="write and pipeline need --db-url")
+    parser.add_argument("--corpus", help="directory with passengers/ and finances/ workbooks, "
+                                         "synthetic workbooks are generated if omitted")
+    parser.add_argument("--passengers-files", type=int, default=4)
+    parser.add_argument("--passengers-rows", type=int, default=20000)
+    parser.add_argument("--finances-files", type=int, default=2)
+    parser.add_argument("--finances-rows", type=int, default=500)
+    parser.add_argument("--layout", default='full', choices=LAYOUTS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--streaming", action="store_true")
+    parser.add_argument("--write-mode", default='upsert', choices=WRITE_MODES)
+    parser.add_argument("--write-modes", nargs="+", default=list(WRITE_MODES), choices=WRITE_MODES)
+    parser.add_argument("--write-rows", type=int, default=100000)
+    parser.add_argument("--parse-mode", default='thread', choices=PARSE_MODES)
+    parser.add_argument("--max-workers", type=int, default=4)
+    parser.add_argument("--db-url", help="separate DataBase for write and pipeline, benchmark rows are deleted, "
+                                         "DATABASE_URL is refused")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+    if set(args.stages) - set(LOCAL_STAGES) and not args.db_url:
+        parser.error("write and pipeline stages need --db-url")
+
+    report = json.dumps(run(args), indent=2, default=str)
+    if args.output:
+        Path(args.output).write_text(report)
+    else:
+        print(report)
@@ -0,0 +1,193 @@
+import argparse
+import json
+import random
+from pathlib import Path
+
+from openpyxl import Workbook
+
+BENCH_CARRIER = "BENCH"
+# Finances carriers BENCH<N> as written to DataBase, _transform_data lowercases column names
+BENCH_FINANCES_CARRIER_RE = r'^bench[0-9]+$'
+
+
+def synthetic_records(rows: int, seed: int = 0) -> list[dict]:
+    """Transformed PassengersFlow records as DataProcessor._transform_data returns them"""
+    rnd = random.Random(seed)
+    records = []
+    for i in range(rows):
+        seats = rnd.randint(1000, 200000)
+        records.append({
+            'from_city': f"CITY{i % 997}",
+            'to_city': f"CITY{i // 997}",
+            'year': 2015 + i % 10,
+            'air_carrier': BENCH_CARRIER,
+            'aircraft_type': f"TYPE{i % 7}",
+            'passengers_revenue_traffic': rnd.randint(0, seats),
+            'seats_available': seats,
+            'passenger_occupancy_factor': rnd.random(),
+            'from_state': "STATE",
+            'to_state': None,
+            'from_territory': "TERRITORY",
+            'to_territory': None,
+            'nb._of_flights': rnd.randint(1, 3000),
+            'average_seats_available': rnd.randint(50, 400),
+            'average_payload_capacity': rnd.random() * 100,
+        })
+    return records
+
+
+# Workbook header -> transformed record field, header names as they come in PassengersData files
+PASSENGERS_HEADERS = {
+    'Air Carrier': 'air_carrier',
+    'From City': 'from_city',
+    'To City': 'to_city',
+    'Year': 'year',
+    'Aircraft Type': 'aircraft_type',
+    'Passengers Revenue Traffic': 'passengers_revenue_traffic',
+    'Seats Available': 'seats_available',
+    'Passenger Occupancy Factor': 'passenger_occupancy_factor',
+    'From State': 'from_state',
+    'To State': 'to_state',
+    'From Territory': 'from_territory',
+    'To Territory': 'to_territory',
+    'Nb. of Flights': 'nb._of_flights',
+    'Average Seats Available': 'average_seats_available',
+    'Average Payload Capacity': 'average_payload_capacity',
+}
+REQUIRED_HEADERS = ['Air Carrier', 'From City', 'To City', 'Year', 'Aircraft Type', 'Passengers Revenue Traffic',
+                    'Seats Available', 'Passenger Occupancy Factor']
+
+# full: every known column, minimal: columns the transform cannot fill, shuffled: every known column
+# in random order plus unknown columns the transform drops
+LAYOUTS = ('full', 'minimal', 'shuffled')
+
+FINANCES_CATEGORIES = ['Operating Revenue', 'Operating Expenses', 'Non-operating Items', 'Assets', 'Liabilities']
+
+
+def passengers_headers(layout: str, rnd: random.Random, extra_columns: int = 3) -> list[str]:
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout: {layout}. Expected one of {LAYOUTS}")
+    if layout == 'minimal':
+        return list(REQUIRED_HEADERS)
+
+    headers = list(PASSENGERS_HEADERS)
+    if layout == 'shuffled':
+        headers += [f"Remark {i}" for i in range(extra_columns)]
+        rnd.shuffle(headers)
+    return headers
+
+
+def write_passengers_workbook(path: str, rows: int, layout: str = 'full', seed: int = 0,
+                              first_row: int = 0) -> dict:
+    """
+    Writes a PassengersData workbook with synthetic records, air carrier is BENCH.
+
+    :param path: .xlsx path
+    :param rows: data rows
+    :param layout: column layout, see LAYOUTS
+    :param seed: random seed, same arguments give the same workbook
+    :param first_row: index of the first synthetic record, files with different ranges do not share keys
+    :return: workbook description
+    """
+
+    rnd = random.Random(seed)
+    headers = passengers_headers(layout, rnd)
+    records = synthetic_records(first_row + rows, seed)[first_row:]
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Data')
+    sheet.append(headers)
+    for record in records:
+        sheet.append([
+            record.get(PASSENGERS_HEADERS[header]) if header in PASSENGERS_HEADERS else f"note {rnd.randint(0, 99)}"
+            for header in headers
+        ])
+
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    workbook.save(path)
+    return {"kind": "passengers", "path": str(path), "rows": rows, "columns": len(headers), "layout": layout}
+
+
+def write_finances_workbook(path: str, rows: int, carriers: int = 10, years: int = 5, seed: int = 0,
+                            merged_years: bool = True) -> dict:
+    """
+    Writes a FinancesData workbook in the two header row format read with header=[0, 1]:
+    account columns, then one column per (year, carrier) with the year in the first header row
+    and the carrier in the second. Carriers are named BENCH<N>.
+
+    :param path: .xlsx path
+    :param rows: account rows
+    :param carriers: carriers per year
+    :param years: years, counted back from 2024
+    :param seed: random seed, same arguments give the same workbook
+    :param merged_years: merge the year cells over their carrier columns, as the source files do
+    :return: workbook description
+    """
+
+    rnd = random.Random(seed)
+    year_values = [2024 - i for i in range(years)]
+    carrier_names = [f"{BENCH_CARRIER}{i}" for i in range(carriers)]
+
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.title = 'Data'
+    sheet.append(['Financial Category', 'Main Account', 'Sub Account'] +
+                 [year for year in year_values for _ in carrier_names])
+    sheet.append([None, None, None] + carrier_names * years)
+
+    if merged_years:
+        for i in range(years):
+            first = 4 + i * carriers
+            sheet.merge_cells(start_row=1, start_column=first, end_row=1, end_column=first + carriers - 1)
+
+    for i in range(rows):
+        sheet.append(
+            [FINANCES_CATEGORIES[i % len(FINANCES_CATEGORIES)], f"Account {i}", f"Sub {i % 13}"] +
+            # Empty cells are skipped by the transform, like in the source files
+            [round(rnd.uniform(-1e6, 1e7), 2) if rnd.random() > 0.1 else None for _ in range(carriers * years)]
+        )
+
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    workbook.save(path)
+    return {"kind": "finances", "path": str(path), "rows": rows, "columns": 3 + carriers * years,
+            "values": rows * carriers * years}
+
+
+def generate_corpus(directory: str, passengers_files: int = 4, passengers_rows: int = 20000,
+                    finances_files: int = 2, finances_rows: int = 500, layout: str = 'full',
+                    seed: int = 0) -> list[dict]:
+    """
+    Writes a corpus of synthetic workbooks, passengers files get disjoint record ranges
+
+    :return: workbook descriptions
+    """
+
+    directory = Path(directory)
+    workbooks = []
+    for i in range(passengers_files):
+        workbooks.append(write_passengers_workbook(
+            str(directory / 'passengers' / f"passengers_{i:03d}.xlsx"), passengers_rows, layout,
+            seed=seed, first_row=i * passengers_rows
+        ))
+    for i in range(finances_files):
+        workbooks.append(write_finances_workbook(
+            str(directory / 'finances' / f"finances_{i:03d}.xlsx"), finances_rows, seed=seed + i
+        ))
+    return workbooks
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic PassengersData and FinancesData workbooks")
+    parser.add_argument("directory")
+    parser.add_argument("--passengers-files", type=int, default=4)
+    parser.add_argument("--passengers-rows", type=int, default=20000)
+    parser.add_argument("--finances-files", type=int, default=2)
+    parser.add_argument("--finances-rows", type=int, default=500)
+    parser.add_argument("--layout", default='full', choices=LAYOUTS)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(json.dumps(generate_corpus(
+        args.directory, args.passengers_files, args.passengers_rows, args.finances_files, args.finances_rows,
+        args.layout, args.seed
+    ), indent=2))
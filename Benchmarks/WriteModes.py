@@ -0,0 +1,105 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from dotenv import load_dotenv
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+
+from DATABASE import ASGPassengersTable, ASGFinancesTable
+from DATABASE.ICAO.ICAO import Base
+from DataProcessor import DataProcessor
+from DataProcessor.PassengersDataProcessor import WRITE_MODES
+from Benchmarks.Workbooks import synthetic_records, BENCH_CARRIER
+from Utills.Logger import logger
+
+load_dotenv()
+
+
+def bench_db_url(db_url: str | None) -> str:
+    """Benchmarks create and delete rows, they never fall back to the DataBase of the app"""
+    if not db_url:
+        raise ValueError("Benchmark DataBase url is required, pass --db-url")
+    if db_url == os.getenv("DATABASE_URL"):
+        raise ValueError("Benchmarks delete rows, --db-url must not be DATABASE_URL")
+    return db_url
+
+
+async def create_bench_tables(engine):
+    """Creates the loaded tables in the benchmark DataBase"""
+    async with engine.begin() as conn:
+        await conn.run_sync(
+            Base.metadata.create_all, tables=[ASGPassengersTable.__table__, ASGFinancesTable.__table__]
+        )
+
+
+async def _write(processor: DataProcessor, async_session, records: list[dict]) -> float:
+    started = time.perf_counter()
+    for i in range(0, len(records), processor.chunk_size):
+        async with async_session() as session:
+            await processor._write_to_db(session, records[i:i + processor.chunk_size])
+    return time.perf_counter() - started
+
+
+async def benchmark(db_url: str, rows: int, chunk_size: int, modes: list[str]) -> list[dict]:
+    """
+    Writes the same synthetic records with every write mode, first into an empty key range
+    (inserts) and then again (conflict updates).
+
+    Rows are tagged with air_carrier=BENCH and removed before and after every mode.
+    """
+
+    engine = create_async_engine(bench_db_url(db_url))
+    await create_bench_tables(engine)
+    async_session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    records = synthetic_records(rows)
+
+    async def cleanup():
+        async with async_session() as session:
+            await session.execute(delete(ASGPassengersTable).where(ASGPassengersTable.air_carrier == BENCH_CARRIER))
+            await session.commit()
+
+    results = []
+    try:
+        for mode in modes:
+            await cleanup()
+            processor = DataProcessor(db_url=db_url, chunk_size=chunk_size, write_mode=mode)
+
+            insert_seconds = await _write(processor, async_session, records)
+            update_seconds = await _write(processor, async_session, records)
+
+            results.append({
+                "write_mode": mode,
+                "rows": rows,
+                "chunk_size": chunk_size,
+                "insert_seconds": round(insert_seconds, 3),
+                "update_seconds": round(update_seconds, 3),
+                "insert_rows_per_sec": round(rows / insert_seconds, 1),
+                "update_rows_per_sec": round(rows / update_seconds, 1),
+                "failed_records": len(processor.errors["FAILED_DATA"]),
+            })
+            logger.info(f"Write mode {mode}: {results[-1]}")
+    finally:
+        await cleanup()
+        await engine.dispose()
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark PassengersFlow write modes")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--modes", nargs="+", default=list(WRITE_MODES), choices=WRITE_MODES)
+    parser.add_argument("--db-url", required=True,
+                        help="separate DataBase, BENCH rows are deleted before and after every mode")
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(benchmark(
+        db_url=args.db_url,
+        rows=args.rows,
+        chunk_size=args.chunk_size,
+        modes=args.modes
+    )), indent=2))
@@ -1,10 +1,12 @@
 import asyncio
 import os
 from sqlalchemy.ext.asyncio import create_async_engine
-from sqlalchemy import MetaData, Column, Integer, String, Float, DateTime, Boolean
+from sqlalchemy import MetaData, Column, Integer, String, Float, DateTime, Boolean, UniqueConstraint, Index, text
 from sqlalchemy.orm import declarative_base
 from dotenv import load_dotenv
 from Utills.Logger import logger
+from DATABASE.FR.Partitions import is_legacy_table, rename_legacy_table, migrate_legacy_table, \
+    ensure_default_partition, POSITION_HISTORY
 
 load_dotenv()
 
@@ -26,7 +28,8 @@ class FlightSummary(Base):
     reg = Column(String)
     orig_icao = Column(String)
     orig_iata = Column(String)
-    datetime_takeoff = Column(DateTime)
+    # Partition key, part of primary and unique keys
+    datetime_takeoff = Column(DateTime, primary_key=True)
     runway_takeoff = Column(String)
     dest_icao = Column(String)
     dest_iata = Column(String)
@@ -43,6 +46,13 @@ class FlightSummary(Base):
     last_seen = Column(DateTime)
     flight_ended = Column(Boolean)
 
+    __table_args__ = (
+        UniqueConstraint('fr24_id', 'datetime_takeoff', name='uq_flight_summary_fr24_id'),
+        Index('ix_flight_summary_reg_takeoff', 'reg', 'datetime_takeoff'),
+        Index('ix_flight_summary_painted_as_takeoff', 'painted_as', 'datetime_takeoff'),
+        {'postgresql_partition_by': 'RANGE (datetime_takeoff)'},
+    )
+
 
 class LivePositions(Base):
     __tablename__ = 'live_positions'
@@ -69,11 +79,55 @@ class LivePositions(Base):
     painted_as = Column(String)
     eta = Column(DateTime)
 
+    __table_args__ = (
+        Index('ix_live_positions_reg', 'reg'),
+        Index('ix_live_positions_timestamp', 'timestamp'),
+    )
+
+
+class PositionHistory(Base):
+    """Append-only track points, flight details stay in live_positions"""
+    __tablename__ = 'position_history'
+    fr24_id = Column(String, primary_key=True)
+    # Partition key
+    timestamp = Column(DateTime, primary_key=True)
+    lat = Column(Float)
+    lon = Column(Float)
+    track = Column(Integer)
+    alt = Column(Float)
+    gspeed = Column(Float)
+    vspeed = Column(Float)
+    squawk = Column(String)
+    source = Column(String)
+
+    __table_args__ = (
+        {'postgresql_partition_by': 'RANGE (timestamp)'},
+    )
+
+
+LATEST_POSITIONS_VIEW = 'live_positions_latest'
 
 
 async def check_and_create_table():
     async with engine.connect() as conn:
+        legacy = await is_legacy_table(conn)
+        if legacy:
+            await rename_legacy_table(conn)
+
         await conn.run_sync(Base.metadata.create_all)
+        await ensure_default_partition(conn)
+        await ensure_default_partition(conn, POSITION_HISTORY)
+        await conn.execute(text(
+            f"CREATE OR REPLACE VIEW {LATEST_POSITIONS_VIEW} AS "
+            f"SELECT DISTINCT ON (fr24_id) * FROM {POSITION_HISTORY} ORDER BY fr24_id, timestamp DESC"
+        ))
+        # create_all skips indexes of tables that already exist
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                await conn.run_sync(index.create, checkfirst=True)
+
+        if legacy:
+            await migrate_legacy_table(conn)
         await conn.commit()
         await conn.close()
 
@@ -0,0 +1,219 @@
+import re
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from Utills.Logger import logger
+
+FLIGHT_SUMMARY = 'flight_summary'
+POSITION_HISTORY = 'position_history'
+LEGACY_SUFFIX = '_legacy'
+
+MONTH = 'month'
+DAY = 'day'
+
+# Periods with partitions created by this process: (table, period start)
+_ensured: set[tuple[str, datetime]] = set()
+
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+
+def next_month(value: datetime) -> datetime:
+    return datetime(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+
+def day_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, value.day)
+
+
+def next_day(value: datetime) -> datetime:
+    return day_start(value) + timedelta(days=1)
+
+
+PERIODS = {
+    MONTH: (month_start, next_month, "%Y_%m", r"(\d{4})_(\d{2})"),
+    DAY: (day_start, next_day, "%Y_%m_%d", r"(\d{4})_(\d{2})_(\d{2})"),
+}
+
+
+def partition_name(table: str, start: datetime, period: str = MONTH) -> str:
+    return f"{table}_{start.strftime(PERIODS[period][2])}"
+
+
+def _create_partition_sql(table: str, start: datetime, period: str) -> str:
+    end = PERIODS[period][1](start)
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(table, start, period)} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{start.isoformat(sep=' ')}') TO ('{end.isoformat(sep=' ')}')"
+    )
+
+
+async def ensure_default_partition(conn: AsyncConnection, table: str = FLIGHT_SUMMARY):
+    """Catches rows outside of dated partitions, should stay empty"""
+    await conn.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"))
+
+
+async def ensure_partitions(engine: AsyncEngine, start: datetime, end: datetime, table: str = FLIGHT_SUMMARY,
+                            period: str = MONTH) -> list[str]:
+    """
+    Creates partitions covering [start, end]. Must run before rows of these periods are inserted,
+    a partition can not be created while the default partition holds its rows.
+
+    :param engine: FR DataBase engine
+    :param start: first naive UTC datetime
+    :param end: last naive UTC datetime
+    :param table: partitioned table
+    :param period: partition size, month or day
+    :return: names of partitions created or checked
+    """
+
+    first, following, _, _ = PERIODS[period]
+    starts = []
+    current = first(start)
+    while current <= end:
+        starts.append(current)
+        current = following(current)
+
+    pending = [current for current in starts if (table, current) not in _ensured]
+    if not pending:
+        return []
+
+    async with engine.begin() as conn:
+        for current in pending:
+            await conn.execute(text(_create_partition_sql(table, current, period)))
+
+    _ensured.update((table, current) for current in pending)
+    names = [partition_name(table, current, period) for current in pending]
+    logger.info(f"Partitions ready for {table}: {', '.join(names)}")
+    return names
+
+
+async def ensure_month_partitions(engine: AsyncEngine, start: datetime, end: datetime,
+                                  table: str = FLIGHT_SUMMARY) -> list[str]:
+    return await ensure_partitions(engine, start, end, table, MONTH)
+
+
+async def ensure_day_partitions(engine: AsyncEngine, start: datetime, end: datetime,
+                                table: str = POSITION_HISTORY) -> list[str]:
+    return await ensure_partitions(engine, start, end, table, DAY)
+
+
+async def list_partitions(conn: AsyncConnection, table: str = FLIGHT_SUMMARY,
+                          period: str = MONTH) -> dict[str, datetime]:
+    """Attached partitions named by period, name -> period start"""
+    result = await conn.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = :table"
+    ), {"table": table})
+
+    pattern = re.compile(rf"^{table}_{PERIODS[period][3]}$")
+    partitions = {}
+    for (name,) in result.all():
+        match = pattern.match(name)
+        if match:
+            parts = [int(group) for group in match.groups()] + [1]
+            partitions[name] = datetime(*parts[:3])
+    return partitions
+
+
+async def detach_partitions_before(engine: AsyncEngine, before: datetime, table: str = FLIGHT_SUMMARY,
+                                   period: str = MONTH, drop: bool = False) -> list[str]:
+    """
+    Detaches partitions that end before `before`. Detached partitions stay as plain tables
+    to be archived or dropped.
+
+    :param engine: FR DataBase engine
+    :param before: partitions with all rows older than this datetime are detached
+    :param table: partitioned table
+    :param period: partition size of the table, month or day
+    :param drop: drop partitions after detaching
+    :return: detached partition names
+    """
+
+    following = PERIODS[period][1]
+    detached = []
+    async with engine.begin() as conn:
+        partitions = await list_partitions(conn, table, period)
+        for name, start in sorted(partitions.items(), key=lambda item: item[1]):
+            if following(start) > before:
+                continue
+
+            await conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+            if drop:
+                await conn.execute(text(f"DROP TABLE {name}"))
+            _ensured.discard((table, start))
+            detached.append(name)
+
+    if detached:
+        logger.info(f"{'Dropped' if drop else 'Detached'} partitions of {table}: {', '.join(detached)}")
+    return detached
+
+
+async def is_legacy_table(conn: AsyncConnection, table: str = FLIGHT_SUMMARY) -> bool:
+    """Table exists and was created before partitioning"""
+    result = await conn.execute(text(
+        "SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE c.relname = :table AND n.nspname = current_schema()"
+    ), {"table": table})
+    relkind = result.scalar()
+    return relkind == 'r'
+
+
+async def rename_legacy_table(conn: AsyncConnection, table: str = FLIGHT_SUMMARY):
+    """Moves a not partitioned table with its indexes and id sequence out of the way of the new one"""
+    legacy = f"{table}{LEGACY_SUFFIX}"
+    logger.warning(f"{table} is not partitioned, moving it to {legacy}")
+
+    sequence = (await conn.execute(text(f"SELECT pg_get_serial_sequence('{table}', 'id')"))).scalar()
+    indexes = (await conn.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE tablename = :table AND schemaname = current_schema()"
+    ), {"table": table})).scalars().all()
+
+    await conn.execute(text(f"ALTER TABLE {table} RENAME TO {legacy}"))
+    for index in indexes:
+        # Renames constraints backed by the index as well
+        await conn.execute(text(f'ALTER INDEX "{index}" RENAME TO "{index}{LEGACY_SUFFIX}"'))
+    if sequence:
+        await conn.execute(text(f"ALTER SEQUENCE {sequence} RENAME TO {table}_id_seq{LEGACY_SUFFIX}"))
+
+
+async def migrate_legacy_table(conn: AsyncConnection, table: str = FLIGHT_SUMMARY):
+    """
+    Copies rows of the legacy table into the partitioned one. Rows without datetime_takeoff and
+    duplicated fr24_id are left behind. The legacy table is kept to be dropped manually.
+    """
+    legacy = f"{table}{LEGACY_SUFFIX}"
+
+    bounds = (await conn.execute(text(
+        f"SELECT min(datetime_takeoff), max(datetime_takeoff) FROM {legacy}"
+    ))).one()
+
+    if bounds[0] is not None:
+        month = month_start(bounds[0])
+        while month <= bounds[1]:
+            await conn.execute(text(_create_partition_sql(table, month, MONTH)))
+            month = next_month(month)
+
+    columns = (await conn.execute(text(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_name = :table AND table_schema = current_schema() ORDER BY ordinal_position"
+    ), {"table": table})).scalars().all()
+    column_list = ", ".join(columns)
+
+    result = await conn.execute(text(
+        f"INSERT INTO {table} ({column_list}) "
+        f"SELECT {column_list} FROM {legacy} WHERE datetime_takeoff IS NOT NULL "
+        f"ORDER BY id ON CONFLICT DO NOTHING"
+    ))
+    await conn.execute(text(
+        f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+        f"(SELECT coalesce(max(id), 0) + 1 FROM {table}), false)"
+    ))
+
+    logger.info(f"Migrated {result.rowcount} rows from {legacy} to partitioned {table}, "
+                f"{legacy} can be dropped after checking")
@@ -1 +1,2 @@
-from DATABASE.FR.FR import FlightSummary
\ No newline at end of file
+from DATABASE.FR.FR import FlightSummary, LivePositions, PositionHistory
+from DATABASE.FR.Partitions import ensure_month_partitions, ensure_day_partitions, detach_partitions_before
@@ -1,6 +1,7 @@
 import os
 from sqlalchemy.ext.asyncio import create_async_engine
-from sqlalchemy import MetaData, Column, Integer, String, Float, text, Numeric, UniqueConstraint
+from sqlalchemy import MetaData, Column, Integer, String, Float, text, Numeric, UniqueConstraint, BigInteger, \
+    DateTime, Index
 from sqlalchemy.orm import declarative_base
 from dotenv import load_dotenv
 from Utills.Logger import logger
@@ -41,6 +42,15 @@ class ASGPassengersTable(Base):
             'aircraft_type',
             name='unique_passengers_record'
         ),
+        # Filters of /api/passengers, id last for keyset pagination. Every filter has a (column, id) index,
+        # so any combination walks one of them in id order and never sorts the matching rows
+        Index('ix_passengersflow_year_id', 'year', 'id'),
+        Index('ix_passengersflow_year_carrier_id', 'year', 'air_carrier', 'id'),
+        Index('ix_passengersflow_carrier_id', 'air_carrier', 'id'),
+        Index('ix_passengersflow_from_city_id', 'from_city', 'id'),
+        Index('ix_passengersflow_to_city_id', 'to_city', 'id'),
+        Index('ix_passengersflow_city_pair_id', 'from_city', 'to_city', 'id'),
+        Index('ix_passengersflow_aircraft_type_id', 'aircraft_type', 'id'),
     )
 
 
@@ -67,10 +77,91 @@ class ASGFinancesTable(Base):
     )
 
 
+class IngestManifestTable(Base):
+    __tablename__ = 'ingest_manifest'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String(32), nullable=False)
+    path = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    mtime = Column(Float, nullable=False)
+    content_hash = Column(String(64), nullable=False)
+    ingested_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint(
+            'kind',
+            'path',
+            name='unique_manifest_record'
+        ),
+    )
+
+
+class CarrierYearRollup(Base):
+    """passengersflow totals per (year, air_carrier)"""
+    __tablename__ = 'rollup_carrier_year'
+
+    year = Column(Integer, primary_key=True)
+    air_carrier = Column(String, primary_key=True)
+    passengers = Column(BigInteger, nullable=True)
+    flights = Column(BigInteger, nullable=True)
+    seats = Column(BigInteger, nullable=True)
+    load_factor = Column(Float, nullable=True)
+    routes = Column(Integer, nullable=False)
+    records = Column(Integer, nullable=False)
+    refreshed_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('ix_rollup_carrier_year_carrier', 'air_carrier', 'year'),
+    )
+
+
+class RouteYearRollup(Base):
+    """passengersflow totals per (year, city pair)"""
+    __tablename__ = 'rollup_route_year'
+
+    year = Column(Integer, primary_key=True)
+    from_city = Column(String, primary_key=True)
+    to_city = Column(String, primary_key=True)
+    passengers = Column(BigInteger, nullable=True)
+    flights = Column(BigInteger, nullable=True)
+    seats = Column(BigInteger, nullable=True)
+    load_factor = Column(Float, nullable=True)
+    carriers = Column(Integer, nullable=False)
+    records = Column(Integer, nullable=False)
+    refreshed_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('ix_rollup_route_year_city_pair', 'from_city', 'to_city', 'year'),
+    )
+
+
+class AircraftYearRollup(Base):
+    """passengersflow load factor per (year, aircraft_type)"""
+    __tablename__ = 'rollup_aircraft_year'
+
+    year = Column(Integer, primary_key=True)
+    aircraft_type = Column(String, primary_key=True)
+    passengers = Column(BigInteger, nullable=True)
+    flights = Column(BigInteger, nullable=True)
+    seats = Column(BigInteger, nullable=True)
+    load_factor = Column(Float, nullable=True)
+    carriers = Column(Integer, nullable=False)
+    records = Column(Integer, nullable=False)
+    refreshed_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('ix_rollup_aircraft_year_type', 'aircraft_type', 'year'),
+    )
+
 
 async def check_and_create_table():
     async with engine.connect() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        # create_all skips indexes of tables that already exist
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                await conn.run_sync(index.create, checkfirst=True)
         await conn.commit()
         await conn.close()
 
@@ -2,7 +2,7 @@ import asyncio
 import os
 
 from dotenv import load_dotenv
-from sqlalchemy import MetaData, Column, Integer, String, Float, UniqueConstraint, Boolean
+from sqlalchemy import MetaData, Column, Integer, String, Float, UniqueConstraint, Boolean, DateTime
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.orm import declarative_base
 
@@ -625,6 +625,26 @@ class CAAHR(Base):
     )
 
 
+class CrawlState(Base):
+    __tablename__ = "crawl_state"
+
+    id = Column(Integer, primary_key=True)
+    crawl_id = Column(String, nullable=False, index=True)
+    endpoint = Column(String, nullable=False)
+    params = Column(String, nullable=False)
+    status = Column(String(16), nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(String)
+    updated_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint(
+            'crawl_id', 'endpoint', 'params',
+            name="uq_crawl_state_unique"
+        ),
+    )
+
+
 async def check_and_create_table_api():
     async with engine.connect() as conn:
         await conn.run_sync(Base.metadata.create_all)
@@ -0,0 +1,198 @@
+import asyncio
+import os
+import re
+import time
+import zipfile
+
+import psutil
+
+from Utills import Metrics as metrics
+from Utills.Logger import logger
+
+# Peak memory of a whole-sheet read, transform and records over the uncompressed sheet XML, measured ~2.4
+WHOLE_FACTOR = 3.0
+# Same for a streaming read, batches are released after they are written
+STREAMING_FACTOR = 1.0
+# Share of the memory limit used for files
+BUDGET_SHARE = 0.75
+
+DIMENSION_RE = re.compile(rb'<dimension ref="[A-Z]+\d+:[A-Z]+(\d+)"')
+
+
+def memory_limit() -> int:
+    """Container memory limit (cgroup v2 or v1), physical memory if there is none"""
+    limit = psutil.virtual_memory().total
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit():
+            limit = min(limit, int(value))
+    return limit
+
+
+def process_rss() -> int:
+    """RSS of this process and its children, the process parse pool included"""
+    process = psutil.Process()
+    rss = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            rss += child.memory_info().rss
+        except psutil.Error:
+            pass
+    return rss
+
+
+def sheet_rows(archive: zipfile.ZipFile, name: str) -> int | None:
+    """Row count from the <dimension> element at the start of the sheet, None if not written"""
+    with archive.open(name) as sheet:
+        head = sheet.read(4096)
+    match = DIMENSION_RE.search(head)
+    return int(match.group(1)) if match else None
+
+
+def estimate_footprint(file_path: str, chunk_size: int | None = None, batches_in_flight: int = 2) -> int:
+    """
+    Estimates peak memory of loading a workbook from its zip metadata, nothing is decompressed
+    except the first bytes of the first sheet.
+
+    :param file_path: .xlsx path
+    :param chunk_size: rows per batch for streaming reads, whole sheet if None
+    :param batches_in_flight: batches of the file held at once in streaming mode
+    :return: bytes
+    """
+
+    try:
+        with zipfile.ZipFile(file_path) as archive:
+            sheets = sorted(
+                info for info in archive.infolist() if info.filename.startswith('xl/worksheets/sheet')
+            )
+            if not sheets:
+                return os.path.getsize(file_path)
+            xml_size = sheets[0].file_size
+            shared_strings = sum(
+                info.file_size for info in archive.infolist() if info.filename == 'xl/sharedStrings.xml'
+            )
+            rows = sheet_rows(archive, sheets[0].filename) if chunk_size else None
+    except (zipfile.BadZipFile, OSError, KeyError):
+        # Not an xlsx archive, the read fails early anyway
+        return os.path.getsize(file_path)
+
+    # Shared strings are loaded whole in both modes
+    if not chunk_size:
+        return int((xml_size + shared_strings) * WHOLE_FACTOR)
+
+    streaming = xml_size * STREAMING_FACTOR
+    if rows:
+        per_row = xml_size / rows
+        streaming = min(streaming, per_row * chunk_size * batches_in_flight * WHOLE_FACTOR)
+    return int(streaming + shared_strings * WHOLE_FACTOR)
+
+
+class AdmissionController:
+    def __init__(self, budget: int | None = None, max_concurrency: int = 8, min_concurrency: int = 1,
+                 high_watermark: float = 0.9, low_watermark: float = 0.6, interval: float = 0.5):
+        """
+        Admits files for loading against an RSS budget.
+
+        A file is admitted when the running files stay under the concurrency limit and its estimated
+        footprint fits next to the reservations of running files and the observed RSS, whichever is larger.
+        A file larger than the whole budget is admitted alone. The limit is halved when RSS goes over
+        the high watermark and raised by one while files wait and RSS is under the low watermark.
+
+        :param budget: bytes of RSS for this process and its children, BUDGET_SHARE of memory_limit() by default
+        :param max_concurrency: files loaded at once
+        :param min_concurrency: lowest concurrency limit
+        :param high_watermark: share of the budget that lowers the limit
+        :param low_watermark: share of the budget under which the limit is raised
+        :param interval: seconds between RSS samples
+        """
+        self.budget = budget or int(memory_limit() * BUDGET_SHARE)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min(min_concurrency, max_concurrency)
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.interval = interval
+
+        self.limit = max_concurrency
+        self.reservations: dict[str, int] = {}
+        self.waiting = 0
+        self.baseline = process_rss()
+        self.rss = self.baseline
+        self._sampled = time.monotonic()
+        self._condition: asyncio.Condition | None = None
+
+    @property
+    def reserved(self) -> int:
+        return sum(self.reservations.values())
+
+    def _sample(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._sampled < self.interval:
+            return
+        self._sampled = now
+        self.rss = process_rss()
+
+        if self.rss > self.budget * self.high_watermark and self.limit > self.min_concurrency:
+            self.limit = max(self.min_concurrency, self.limit // 2)
+            logger.warning(f"RSS {self.rss >> 20} MB over {self.high_watermark:.0%} of budget, "
+                           f"concurrency limit {self.limit}")
+        elif self.waiting and self.rss < self.budget * self.low_watermark and self.limit < self.max_concurrency:
+            self.limit += 1
+
+        metrics.ADMISSION_LIMIT.set(self.limit)
+        metrics.ADMISSION_RSS.set(self.rss)
+
+    def _fits(self, nbytes: int) -> bool:
+        if not self.reservations:
+            return True
+        if len(self.reservations) >= self.limit:
+            return False
+        used = max(self.baseline + self.reserved, self.rss)
+        return used + nbytes <= self.budget
+
+    async def acquire(self, key: str, nbytes: int):
+        """Waits until the file can be loaded, the reservation is held until release(key)"""
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+
+        async with self._condition:
+            self.waiting += 1
+            metrics.ADMISSION_WAITING.set(self.waiting)
+            try:
+                self._sample(force=True)
+                while not self._fits(nbytes):
+                    try:
+                        # Waiters are woken by releases, or re-check RSS every interval
+                        await asyncio.wait_for(self._condition.wait(), self.interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    self._sample()
+            finally:
+                self.waiting -= 1
+                metrics.ADMISSION_WAITING.set(self.waiting)
+
+            self.reservations[key] = nbytes
+            metrics.ADMISSION_RESERVED.set(self.reserved)
+            if nbytes > self.budget:
+                logger.warning(f"{key} estimated at {nbytes >> 20} MB, over the {self.budget >> 20} MB budget, "
+                               f"loading it alone")
+
+    async def release(self, key: str):
+        if self.reservations.pop(key, None) is None:
+            return
+        metrics.ADMISSION_RESERVED.set(self.reserved)
+        async with self._condition:
+            self._condition.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            "budget": self.budget,
+            "rss": self.rss,
+            "reserved": self.reserved,
+            "running": len(self.reservations),
+            "waiting": self.waiting,
+            "limit": self.limit,
+        }
@@ -0,0 +1,202 @@
+import itertools
+import warnings
+from collections import defaultdict
+from typing import Iterable, Iterator
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from Utills.Logger import logger
+
+CALAMINE = 'calamine'
+OPENPYXL = 'openpyxl'
+# auto: calamine when python-calamine is installed, openpyxl otherwise or when calamine fails on a file
+ENGINES = ('auto', CALAMINE, OPENPYXL)
+
+
+def calamine_available() -> bool:
+    try:
+        import python_calamine  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def resolve_engine(engine: str) -> str:
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown Excel engine: {engine}. Expected one of {ENGINES}")
+    if engine == 'auto':
+        return CALAMINE if calamine_available() else OPENPYXL
+    return engine
+
+
+def _calamine_value(value):
+    # Empty cells are "" and every number is a float, openpyxl returns None and ints
+    if value == "":
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _openpyxl_rows(file_path: str) -> Iterator[tuple]:
+    """Rows of the first sheet in openpyxl read-only mode, only the current row is kept in memory"""
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        # Dimensions stored in the file are not always correct, compute them while reading
+        sheet.reset_dimensions()
+        yield from sheet.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def _calamine_rows(file_path: str) -> Iterator[tuple]:
+    """Rows of the first sheet with python-calamine, the sheet is held as a compact native range"""
+    from python_calamine import CalamineWorkbook
+
+    workbook = CalamineWorkbook.from_path(file_path)
+    try:
+        for row in workbook.get_sheet_by_index(0).iter_rows():
+            yield tuple(_calamine_value(value) for value in row)
+    finally:
+        workbook.close()
+
+
+ROW_READERS = {CALAMINE: _calamine_rows, OPENPYXL: _openpyxl_rows}
+
+
+def _frames(rows: Iterable[tuple], chunk_size: int, engine: str) -> Iterator[pd.DataFrame]:
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return
+
+    columns = _dedup_columns([
+        str(value) if value is not None else f"Unnamed: {i}"
+        for i, value in enumerate(header)
+    ])
+    width = len(columns)
+
+    batch = []
+    yielded = False
+    # Empty rows are kept between data rows and dropped at the end, like pd.read_excel does
+    blank_rows = 0
+    empty_row = (None,) * width
+    for row in rows:
+        if all(value is None for value in row):
+            blank_rows += 1
+            continue
+
+        row = row[:width]
+        if len(row) < width:
+            row = row + (None,) * (width - len(row))
+        pending = itertools.chain(itertools.repeat(empty_row, blank_rows), (row,))
+        blank_rows = 0
+
+        for pending_row in pending:
+            batch.append(pending_row)
+            if len(batch) >= chunk_size:
+                yield _frame(batch, columns, engine)
+                yielded = True
+                batch = []
+
+    if batch or not yielded:
+        yield _frame(batch, columns, engine)
+
+
+def _dedup_columns(columns: list[str]) -> list[str]:
+    """Renames repeated headers as pd.read_excel does: x, x.1, x.2, skipping names already in the header"""
+    columns = list(columns)
+    counts = defaultdict(int)
+    for i, column in enumerate(columns):
+        name = column
+        count = counts[column]
+        while count > 0:
+            counts[column] = count + 1
+            name = f"{column}.{count}"
+            count = count + 1 if name in columns else counts[name]
+        columns[i] = name
+        counts[name] = count + 1
+    return columns
+
+
+def _frame(batch: list[tuple], columns: list[str], engine: str) -> pd.DataFrame:
+    df = pd.DataFrame(batch, columns=columns)
+    df.attrs['excel_engine'] = engine
+    return df
+
+
+def iter_excel_batches(file_path: str, chunk_size: int, engine: str = 'auto') -> Iterator[pd.DataFrame]:
+    """
+    Streams the first sheet of an .xlsx file as DataFrames of at most chunk_size rows.
+
+    Only the current batch is kept as Python objects. The first row is used as the header,
+    like pd.read_excel does. The engine used is in df.attrs['excel_engine'].
+
+    :param file_path: path to .xlsx file
+    :param chunk_size: max rows per yielded DataFrame
+    :param engine: one of ENGINES, auto falls back to openpyxl if calamine fails before the first batch
+    :return: iterator of DataFrames
+    """
+
+    engine = resolve_engine(engine)
+    frames = _frames(ROW_READERS[engine](file_path), chunk_size, engine)
+    try:
+        first = next(frames, None)
+    except Exception as e:
+        if engine != CALAMINE:
+            raise
+        logger.warning(f"calamine failed on {file_path}, reading with openpyxl: {e}")
+        frames = _frames(_openpyxl_rows(file_path), chunk_size, OPENPYXL)
+        first = next(frames, None)
+
+    if first is None:
+        return
+    yield first
+    yield from frames
+
+
+def read_sheet(file_path: str, engine: str = 'auto', **kwargs) -> pd.DataFrame:
+    """
+    Reads the first sheet with pd.read_excel, the engine used is in df.attrs['excel_engine']
+
+    :param file_path: path to .xlsx file
+    :param engine: one of ENGINES, auto falls back to openpyxl if calamine fails
+    :param kwargs: extra pd.read_excel arguments
+    """
+
+    engine = resolve_engine(engine)
+    if engine == CALAMINE:
+        try:
+            df = pd.read_excel(file_path, engine=CALAMINE, **kwargs)
+            df.attrs['excel_engine'] = CALAMINE
+            return df
+        except Exception as e:
+            logger.warning(f"calamine failed on {file_path}, reading with openpyxl: {e}")
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=UserWarning)
+        df = pd.read_excel(file_path, engine=OPENPYXL, **kwargs)
+    df.attrs['excel_engine'] = OPENPYXL
+    return df
+
+
+def read_frames(file_path: str, chunk_size: int, streaming: bool, engine: str = 'auto',
+                **kwargs) -> Iterator[pd.DataFrame]:
+    """
+    Reads the first sheet of an .xlsx file as one DataFrame, or as chunk_size DataFrames in streaming mode.
+
+    :param file_path: path to .xlsx file
+    :param chunk_size: max rows per DataFrame in streaming mode
+    :param streaming: read row by row in chunk_size batches
+    :param engine: one of ENGINES
+    :param kwargs: extra pd.read_excel arguments, whole-sheet mode only
+    :return: iterator of DataFrames
+    """
+
+    if streaming:
+        yield from iter_excel_batches(file_path, chunk_size, engine)
+        return
+
+    yield read_sheet(file_path, engine, **kwargs)
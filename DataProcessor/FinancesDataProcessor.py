@@ -1,5 +1,8 @@
 import asyncio
-from typing import List, Dict
+import itertools
+import os
+import time
+from typing import List, Dict, AsyncIterator
 import re
 
 import pandas as pd
@@ -9,55 +12,188 @@ from tqdm import tqdm
 import logging
 
 from DATABASE import ASGFinancesTable
+from DataProcessor.Admission import AdmissionController, estimate_footprint
+from DataProcessor.ExcelReader import read_sheet, resolve_engine
+from DataProcessor.ParsedCache import ParsedCache
+from DataProcessor.Pipeline import Pipeline, Stage, FileTask
+from FindPath.Manifest import file_hash
+from Utills import Metrics as metrics
+from Utills.Jobs import Job
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Records per upsert, 6 fields per record within 30000 query parameters
+CHUNK_SIZE = 30000 // 6
+# Record field -> type of cached values, bump CACHE_VERSION when _transform_data output changes
+CACHE_TYPES = {
+    'financial_category': str,
+    'main_account': str,
+    'sub_account': str,
+    'year': int,
+    'air_carrier': str,
+    'value': float,
+}
+CACHE_VERSION = 1
+
 
 class FinancialDataProcessor:
-    def __init__(self, db_url: str, max_workers: int = 4):
+    def __init__(self, db_url: str, max_workers: int = 4, job: Job | None = None, read_workers: int | None = None,
+                 queue_size: int = 2, admission: AdmissionController | None = None, excel_engine: str = 'auto',
+                 parsed_cache: ParsedCache | None = None):
+        """
+        Excel -> finances loader, files go through parse -> transform -> write stages
+        connected by bounded queues.
+
+        :param db_url: DataBase url
+        :param max_workers: concurrent chunk writes
+        :param job: job to report progress to
+        :param read_workers: files parsed at the same time, max_workers by default
+        :param queue_size: parsed files waiting for a transform, transformed chunks waiting for
+            a write are bounded by queue_size * max_workers
+        :param admission: memory admission shared with other processors, own one with read_workers files by default
+        :param excel_engine: Excel reader, see ExcelReader.ENGINES
+        :param parsed_cache: transformed workbooks are read from and stored to this cache, disabled if None
+        """
         self.engine = create_async_engine(db_url)
+        metrics.track_pool('finances', self.engine)
         self.async_session = async_sessionmaker(
             self.engine,
             class_=AsyncSession,
             expire_on_commit=False
         )
-        self.semaphore = asyncio.Semaphore(max_workers)
+        self.max_workers = max_workers
+        self.read_workers = read_workers or max_workers
+        self.queue_size = queue_size
+        self.excel_engine = excel_engine
+        resolve_engine(excel_engine)
+        self.parsed_cache = parsed_cache
+        # File -> Excel engine it was read with
+        self.read_engines: Dict[str, str] = {}
+        # File -> sha256 taken before it was read, recorded in the manifest
+        self.content_hashes: Dict[str, str] = {}
+        self.admission = admission or AdmissionController(max_concurrency=self.read_workers)
+        self.progress = None
+        self.job = job
         self.errors = {
             'failed_files': [],
             'failed_records': []
         }
 
     async def process_files(self, file_paths: List[str]):
-        with tqdm(total=len(file_paths), desc="[Financial]Processing files") as pbar:
-            tasks = [self._process_file_wrapper(fp, pbar) for fp in file_paths]
-            await asyncio.gather(*tasks)
-
-        await self.engine.dispose()
+        if self.job is not None:
+            self.job.files_total += len(file_paths)
+        try:
+            with tqdm(total=len(file_paths), desc="[Financial]Processing files") as self.progress:
+                await self._pipeline().run(file_paths)
+        finally:
+            await self.engine.dispose()
         logger.info("Processing completed. Errors: %s", self.errors)
 
-    async def _process_file_wrapper(self, file_path: str, pbar: tqdm):
-        async with self.semaphore:
-            await self._process_file(file_path)
-            pbar.update(1)
+    def _pipeline(self) -> Pipeline:
+        return Pipeline(
+            stages=[
+                Stage('parse', self._parse_stage, workers=self.read_workers, queue_size=self.read_workers),
+                Stage('transform', self._transform_stage, queue_size=self.queue_size),
+                Stage('write', self._write_stage, workers=self.max_workers,
+                      queue_size=self.queue_size * self.max_workers),
+            ],
+            on_error=self._file_error,
+            on_done=self._file_finished
+        )
 
-    async def _process_file(self, file_path: str):
+    async def _parse_stage(self, task: FileTask, file_path: str) -> AsyncIterator:
+        """Yields the sheet DataFrame, or columnar batches of records from the parsed cache"""
+        loop = asyncio.get_running_loop()
+        content_hash = await loop.run_in_executor(None, file_hash, file_path)
+        self.content_hashes[file_path] = content_hash
+
+        if self.parsed_cache is not None:
+            key = ParsedCache.key(content_hash, CACHE_VERSION)
+            if self.parsed_cache.has('finances', key):
+                await self.admission.acquire(file_path, 0)
+                metrics.PARSED_CACHE_RESULTS.labels('finances', 'hit').inc()
+                self.read_engines[file_path] = 'cache'
+                batches = self.parsed_cache.read('finances', key)
+                try:
+                    while (columns := await loop.run_in_executor(None, next, batches, None)) is not None:
+                        yield columns
+                finally:
+                    batches.close()
+                return
+            metrics.PARSED_CACHE_RESULTS.labels('finances', 'miss').inc()
+            task.state['cache_key'] = key
+
+        await self.admission.acquire(file_path, estimate_footprint(file_path))
+        with metrics.observe(metrics.EXCEL_PARSE_SECONDS, 'finances'):
+            df = await self._read_excel(file_path)
+        engine = df.attrs.get('excel_engine', self.excel_engine)
+        self.read_engines[file_path] = engine
+        metrics.EXCEL_FILES_READ.labels('finances', engine).inc()
+        logger.info(f"Read {os.path.basename(file_path)} with {engine}")
+        yield df
+
+    async def _transform_stage(self, task: FileTask, batch) -> AsyncIterator[List[Dict]]:
+        if isinstance(batch, dict):
+            names = list(batch)
+            records = [dict(zip(names, values)) for values in zip(*batch.values())]
+        else:
+            with metrics.observe(metrics.TRANSFORM_SECONDS, 'finances'):
+                records = await self._transform_data(batch)
+            if 'cache_key' in task.state:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self._store_parsed, task.state.pop('cache_key'), records
+                )
+        del batch
+        for i in range(0, len(records), CHUNK_SIZE):
+            yield records[i:i + CHUNK_SIZE]
+
+    async def _write_stage(self, task: FileTask, chunk: List[Dict]):
         async with self.async_session() as session:
-            try:
-                df = await self._read_excel(file_path)
-                records = await self._transform_data(df)
-                await self._bulk_upsert(session, records)
+            await self._bulk_upsert(session, chunk)
+        if self.job is not None:
+            self.job.add_rows(len(chunk))
+
+    def _store_parsed(self, key: str, records: List[Dict]):
+        """The sheet is transformed at once, its records are stored as soon as they are built"""
+        writer = self.parsed_cache.writer('finances', key, CACHE_TYPES)
+        try:
+            for i in range(0, len(records), self.parsed_cache.batch_size):
+                chunk = records[i:i + self.parsed_cache.batch_size]
+                writer.write({name: [record[name] for record in chunk] for name in CACHE_TYPES})
+        except Exception as e:
+            # The cache is an optimization, the file is still written to DataBase
+            writer.discard()
+            logger.warning(f"Parsed cache: could not store {key}: {e}")
+            return
+        writer.commit()
 
-            except Exception as e:
-                await session.rollback()
-                logger.error(f"Error processing {file_path}: {str(e)}")
-                self.errors['failed_files'].append(file_path)
+    def _file_error(self, task: FileTask, stage: str, error: Exception):
+        logger.error(f"Error processing {task.path} ({stage}): {str(error)}")
+        self.errors['failed_files'].append(task.path)
+
+    async def _file_finished(self, task: FileTask):
+        await self.admission.release(task.path)
+        self.progress.update(1)
+        self._file_done(task.path, failed=task.failed)
+
+    def _file_done(self, file_path: str, failed: bool = False):
+        size = os.path.getsize(file_path)
+        metrics.FILES_PROCESSED.labels('finances', 'failed' if failed else 'ok').inc()
+        metrics.BYTES_READ.labels('finances').inc(size)
+        if self.job is not None:
+            self.job.file_done(size=size, failed=failed, path=file_path)
+
+    def ingested_files(self, file_paths: List[str]) -> List[str]:
+        """Files fully written to DataBase"""
+        failed = set(self.errors['failed_files'])
+        return [file_path for file_path in file_paths if file_path not in failed]
 
     async def _read_excel(self, file_path: str) -> pd.DataFrame:
         loop = asyncio.get_running_loop()
         return await loop.run_in_executor(
             None,
-            lambda: pd.read_excel(file_path, header=[0, 1], engine='openpyxl')
+            lambda: read_sheet(file_path, self.excel_engine, header=[0, 1])
         )
 
     async def _transform_data(self, df: pd.DataFrame) -> List[Dict]:
@@ -103,44 +239,59 @@ class FinancialDataProcessor:
         return re.sub(r'[^\w]', '', col.lower().replace(' ', '_'))
 
     def _process_rows(self, df: pd.DataFrame, column_map: dict) -> List[Dict]:
-        """String processing with improved parsing"""
-        records = []
+        """Vectorized transform: one record per (row, carrier/year column) with a numeric value"""
         financial_col = column_map['financial_category']
         main_account_col = column_map['main_account']
         sub_account_col = column_map['sub_account']
 
-        for _, row in df.iterrows():
-            try:
-                base_record = {
-                    'financial_category': str(row[financial_col]).strip(),
-                    'main_account': str(row[main_account_col]).strip(),
-                    'sub_account': str(row.get(sub_account_col, 'Not Specified')).strip()
-                }
-
-                # Processing Numeric Columns
-                for col in df.columns:
-                    if col in column_map.values():
-                        continue
-
-                    year, airline = self._parse_column_name(col)
-                    if not year or not airline:
-                        continue
-
-                    value = pd.to_numeric(row[col], errors='coerce')
-                    if pd.isna(value):
-                        continue
-
-                    records.append({
-                        **base_record,
-                        'year': int(year),
-                        'air_carrier': airline.strip(),
-                        'value': float(value)
-                    })
-
-            except Exception as e:
-                self.errors['failed_records'].append((dict(row), str(e)))
-
-        return records
+        # Column headers are parsed once instead of once per cell
+        positions, years, airlines = [], {}, {}
+        for position, col in enumerate(df.columns):
+            if col in column_map.values():
+                continue
+
+            year, airline = self._parse_column_name(col)
+            if not year or not airline:
+                continue
+            years[len(positions)] = int(year)
+            airlines[len(positions)] = airline.strip()
+            positions.append(position)
+
+        if not positions:
+            return []
+
+        base = pd.DataFrame({
+            'financial_category': df[financial_col].astype(str).str.strip(),
+            'main_account': df[main_account_col].astype(str).str.strip(),
+            'sub_account': df[sub_account_col].astype(str).str.strip(),
+        })
+        values = df.iloc[:, positions]
+        values.columns = range(len(positions))
+
+        # Index is the row position, failed cells are reported per source row
+        long_df = pd.concat([base, values], axis=1).reset_index(drop=True).melt(
+            id_vars=list(base.columns),
+            var_name='column',
+            value_name='value',
+            ignore_index=False
+        )
+        raw = long_df['value']
+        long_df['value'] = pd.to_numeric(raw, errors='coerce')
+        # Blank cells are skipped, non-empty cells that are not numbers are reported
+        failed = long_df['value'].isna() & raw.notna() & (raw.astype(str).str.strip() != '')
+        failed_cells = zip(long_df.index[failed], long_df['column'][failed], raw[failed])
+        for row, cells in itertools.groupby(sorted(failed_cells, key=lambda cell: cell[0]), key=lambda cell: cell[0]):
+            bad = ', '.join(f"{df.columns[positions[column]]}={value!r}" for _, column, value in cells)
+            self.errors['failed_records'].append((df.iloc[row].to_dict(), f"Non-numeric values: {bad}"))
+        long_df = long_df.dropna(subset=['value'])
+
+        long_df['year'] = long_df['column'].map(years)
+        long_df['air_carrier'] = long_df['column'].map(airlines)
+        long_df['value'] = long_df['value'].astype(float)
+
+        return long_df[
+            ['financial_category', 'main_account', 'sub_account', 'year', 'air_carrier', 'value']
+        ].to_dict('records')
 
     def _parse_column_name(self, col: str) -> tuple:
         """Improved parsing of column names"""
@@ -161,12 +312,8 @@ class FinancialDataProcessor:
             return
 
         try:
-            max_params_per_chunk = 30000
-            fields_per_record = 6
-            safe_chunk_size = max_params_per_chunk // fields_per_record
-
-            for i in range(0, len(records), safe_chunk_size):
-                chunk = records[i:i + safe_chunk_size]
+            for i in range(0, len(records), CHUNK_SIZE):
+                chunk = records[i:i + CHUNK_SIZE]
 
                 stmt = insert(ASGFinancesTable).values(chunk)
                 stmt = stmt.on_conflict_do_update(
@@ -174,9 +321,16 @@ class FinancialDataProcessor:
                     set_={"value": stmt.excluded.value}
                 )
 
-                await session.execute(stmt)
-                await session.commit()
+                start = time.perf_counter()
+                try:
+                    await session.execute(stmt)
+                    await session.commit()
+                finally:
+                    metrics.DB_WRITE_SECONDS.labels('finances', 'upsert').observe(time.perf_counter() - start)
+                metrics.ROWS_WRITTEN.labels('finances').inc(len(chunk))
 
         except Exception as e:
             await session.rollback()
+            metrics.FAILED_CHUNKS.labels('finances').inc()
             logger.error(f"Bulk upsert error: {str(e)}")
+            raise
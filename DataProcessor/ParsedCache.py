@@ -0,0 +1,124 @@
+import os
+import uuid
+from pathlib import Path
+from typing import Iterator
+
+import pandas as pd
+
+from Utills import Metrics as metrics
+from Utills.Logger import logger
+
+ARROW_TYPES = {str: 'string', int: 'int64', float: 'float64'}
+
+
+def _coerce(value, python_type: type):
+    if value is None or pd.isna(value):
+        return None
+    return python_type(value)
+
+
+class CacheWriter:
+    def __init__(self, cache: "ParsedCache", kind: str, key: str, types: dict[str, type]):
+        """Writes a parquet file next to its final path, it is renamed into place by commit()"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        self.cache = cache
+        self.kind = kind
+        self.types = types
+        self.path = cache.path(kind, key)
+        self.schema = pa.schema([pa.field(name, ARROW_TYPES[python_type]) for name, python_type in types.items()])
+        self.rows = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._tmp = self.path.with_name(f".{self.path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        self._writer = pq.ParquetWriter(self._tmp, self.schema, compression=cache.compression)
+
+    def write(self, columns: dict[str, list]):
+        """Writes a columnar batch, values are converted to the column types"""
+        batch = self._pa.RecordBatch.from_pydict(
+            {name: [_coerce(value, python_type) for value in columns[name]]
+             for name, python_type in self.types.items()},
+            schema=self.schema
+        )
+        self._writer.write_batch(batch)
+        self.rows += batch.num_rows
+
+    def commit(self) -> Path:
+        self._writer.close()
+        os.replace(self._tmp, self.path)
+        metrics.PARSED_CACHE_RESULTS.labels(self.kind, 'stored').inc()
+        self.cache.prune()
+        return self.path
+
+    def discard(self):
+        try:
+            self._writer.close()
+        except Exception as e:
+            # A writer that failed mid-batch may not close cleanly, the file is deleted anyway
+            logger.debug(f"Parsed cache: closing discarded {self._tmp.name}: {e}")
+        finally:
+            self._tmp.unlink(missing_ok=True)
+
+
+class ParsedCache:
+    def __init__(self, directory: str = 'Cache/Parsed', max_bytes: int | None = None, batch_size: int = 50000,
+                 compression: str = 'zstd'):
+        """
+        Parquet files of transformed workbooks, <directory>/<kind>/<key>.parquet.
+
+        Keys are content hashes with a transform version, so a changed file or transform is a miss.
+        Files are written under a temporary name and renamed when complete. Needs pyarrow.
+
+        :param directory: cache root
+        :param max_bytes: least recently used files are deleted over this size, unlimited if None
+        :param batch_size: rows per batch read back
+        :param compression: parquet codec
+        """
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.compression = compression
+
+    @staticmethod
+    def key(content_hash: str, version: int) -> str:
+        return f"{content_hash}-v{version}"
+
+    def path(self, kind: str, key: str) -> Path:
+        return self.directory / kind / f"{key}.parquet"
+
+    def has(self, kind: str, key: str) -> bool:
+        return self.path(kind, key).exists()
+
+    def read(self, kind: str, key: str) -> Iterator[dict[str, list]]:
+        """Columnar batches of a cached file"""
+        import pyarrow.parquet as pq
+
+        path = self.path(kind, key)
+        # Reads refresh mtime, prune() deletes by mtime
+        os.utime(path)
+        parquet_file = pq.ParquetFile(path)
+        try:
+            for batch in parquet_file.iter_batches(batch_size=self.batch_size):
+                yield batch.to_pydict()
+        finally:
+            parquet_file.close()
+
+    def writer(self, kind: str, key: str, types: dict[str, type]) -> CacheWriter:
+        """
+        :param types: column -> str, int or float
+        """
+        return CacheWriter(self, kind, key, types)
+
+    def prune(self):
+        if self.max_bytes is None:
+            return
+        files = sorted(self.directory.glob('*/*.parquet'), key=lambda path: path.stat().st_mtime)
+        total = sum(path.stat().st_size for path in files)
+        for path in files:
+            if total <= self.max_bytes:
+                break
+            total -= path.stat().st_size
+            path.unlink(missing_ok=True)
+            logger.info(f"Parsed cache: removed {path.name}")
@@ -1,18 +1,33 @@
 import asyncio
+import multiprocessing
+import os
+import queue
+import time
 import warnings
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import aclosing, contextmanager
+from functools import partial
 from pathlib import Path
+from typing import AsyncIterator
 
 import numpy as np
 import pandas as pd
-import psutil
 from openpyxl.styles.stylesheet import Stylesheet
-from sqlalchemy import func
+from sqlalchemy import func, select, table, column, text
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from tqdm import tqdm
 
 from DATABASE import ASGPassengersTable
+from DataProcessor.Admission import AdmissionController, estimate_footprint
+from DataProcessor.ExcelReader import read_frames, resolve_engine
+from DataProcessor.ParsedCache import ParsedCache
+from DataProcessor.Pipeline import Pipeline, Stage, FileTask
+from DataProcessor.Rollups import RollupKeys
+from FindPath.Manifest import file_hash
 from Utills import StateManager as state
+from Utills.Jobs import Job
+from Utills import Metrics as metrics
 from Utills.Logger import logger
 
 warnings.filterwarnings(
@@ -22,14 +37,198 @@ warnings.filterwarnings(
 )
 
 
+# PassengersFlow column -> transformed record field
+PASSENGERS_FIELDS = {
+    'from_city': 'from_city',
+    'to_city': 'to_city',
+    'year': 'year',
+    'air_carrier': 'air_carrier',
+    'aircraft_type': 'aircraft_type',
+    'prt': 'passengers_revenue_traffic',
+    'seats_available': 'seats_available',
+    'passenger_occupancy_factor': 'passenger_occupancy_factor',
+    'from_state': 'from_state',
+    'to_state': 'to_state',
+    'from_territory': 'from_territory',
+    'to_territory': 'to_territory',
+    'number_of_flights': 'nb._of_flights',
+    'average_seats_available': 'average_seats_available',
+    'average_payload_capacity': 'average_payload_capacity'
+}
+UNIQUE_FIELDS = ['from_city', 'to_city', 'year', 'air_carrier', 'aircraft_type']
+COPY_TYPES = {name: ASGPassengersTable.__table__.c[name].type.python_type for name in PASSENGERS_FIELDS}
+STAGING_TABLE = 'passengersflow_staging'
+WRITE_MODES = ('upsert', 'copy')
+PARSE_MODES = ('thread', 'process')
+# Transformed field -> type of cached values, bump CACHE_VERSION when transform_passengers_frame output changes
+CACHE_TYPES = {field: COPY_TYPES[column] for column, field in PASSENGERS_FIELDS.items()}
+CACHE_VERSION = 1
+
+
+class MissingColumnsError(Exception):
+    """Workbook has no 'air carrier' column"""
+
+
+def check_columns(df: pd.DataFrame):
+    missing_columns = [col for col in ['air carrier'] if col not in df.columns.str.strip().str.lower()]
+    if missing_columns:
+        raise MissingColumnsError(missing_columns)
+
+
+def transform_passengers_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Data transformation from Excel to PassengersFlow table format"""
+
+    df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_', regex=False)
+
+    expected_columns = {
+        'air_carrier', 'from_city', 'to_city', 'year', 'aircraft_type',
+        'passengers_revenue_traffic', 'seats_available', 'passenger_occupancy_factor', 'from_state', 'to_state',
+        'from_territory', 'to_territory', 'nb._of_flights',
+        'average_seats_available', 'average_payload_capacity'
+    }
+
+    for col in expected_columns:
+        if col not in df.columns:
+            df[col] = np.nan
+
+    df = df.replace([np.nan, pd.NA, '', ' '], None)
+    int_columns = ['year', 'passengers_revenue_traffic', 'seats_available', 'nb._of_flights',
+                   'average_seats_available']
+    for col in int_columns:
+        df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int64')
+
+    float_columns = ['passenger_occupancy_factor', 'average_payload_capacity']
+    for col in float_columns:
+        df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+        df[col] = df[col].replace(np.nan, None)
+
+    ordered_columns = [
+        'from_city', 'to_city', 'year', 'air_carrier', 'aircraft_type',
+        'passengers_revenue_traffic', 'seats_available', 'passenger_occupancy_factor', 'from_state', 'to_state',
+        'from_territory', 'to_territory', 'nb._of_flights',
+        'average_seats_available', 'average_payload_capacity'
+    ]
+
+    return df[ordered_columns]
+
+
+def frame_to_columns(df: pd.DataFrame) -> dict[str, list]:
+    """Transformed DataFrame -> {column: values} with native Python values and None for missing"""
+    return {col: df[col].astype(object).where(df[col].notna(), None).tolist() for col in df.columns}
+
+
+def columns_to_records(columns: dict[str, list]) -> list[dict]:
+    names = list(columns)
+    return [dict(zip(names, values)) for values in zip(*columns.values())]
+
+
+def parse_and_transform(file_path: str, chunk_size: int, streaming: bool, engine: str = 'auto',
+                        batches=None, stop=None) -> tuple[list[dict[str, list]], float, float, str]:
+    """
+    Process pool worker: reads and transforms a PassengersData workbook.
+
+    With a batches queue every batch is put as soon as it is transformed, a bounded queue keeps
+    the worker at most maxsize batches ahead of the parent. None is put when the worker ends.
+
+    :param batches: Manager queue for the batches, returned as a list if None
+    :param stop: Manager event, set by the parent to stop reading the file
+    :return: columnar batches of transformed records (empty with a queue), read seconds, transform seconds,
+        Excel engine used
+    """
+
+    result = []
+    header_checked = False
+    parse_seconds = transform_seconds = 0.0
+    used_engine = resolve_engine(engine)
+    frames = read_frames(file_path, chunk_size, streaming, engine)
+    try:
+        while stop is None or not stop.is_set():
+            start = time.perf_counter()
+            df = next(frames, None)
+            parse_seconds += time.perf_counter() - start
+            if df is None:
+                break
+            if not header_checked:
+                check_columns(df)
+                header_checked = True
+                used_engine = df.attrs.get('excel_engine', used_engine)
+
+            start = time.perf_counter()
+            columns = frame_to_columns(transform_passengers_frame(df))
+            transform_seconds += time.perf_counter() - start
+            del df
+            if batches is None:
+                result.append(columns)
+            else:
+                batches.put(columns)
+            del columns
+    finally:
+        frames.close()
+        if batches is not None:
+            batches.put(None)
+    return result, parse_seconds, transform_seconds, used_engine
+
+
 class DataProcessor:
-    def __init__(self, db_url: str, max_workers: int = 4, chunk_size: int = 500):
+    def __init__(self, db_url: str, max_workers: int = 4, chunk_size: int = 500, streaming: bool = False,
+                 write_mode: str = 'upsert', parse_mode: str = 'thread', parse_workers: int | None = None,
+                 job: Job | None = None, read_workers: int | None = None, transform_workers: int = 1,
+                 queue_size: int = 2, admission: AdmissionController | None = None, excel_engine: str = 'auto',
+                 parsed_cache: ParsedCache | None = None):
+        """
+        Excel -> PassengersFlow loader, files go through parse -> transform -> write stages
+        connected by bounded queues.
+
+        :param db_url: DataBase url
+        :param max_workers: concurrent chunk writes
+        :param chunk_size: records per write, rows per batch in streaming mode
+        :param streaming: read workbooks in chunk_size batches
+        :param write_mode: one of WRITE_MODES
+        :param parse_mode: one of PARSE_MODES
+        :param parse_workers: process pool size in process parse mode
+        :param job: job to report progress to
+        :param read_workers: files parsed at the same time, max_workers by default
+        :param transform_workers: concurrent batch transforms
+        :param queue_size: parsed batches waiting for a transform, transformed chunks waiting for
+            a write are bounded by queue_size * max_workers
+        :param admission: memory admission shared with other processors, own one with read_workers files by default
+        :param excel_engine: Excel reader, see ExcelReader.ENGINES
+        :param parsed_cache: transformed workbooks are read from and stored to this cache, disabled if None
+        """
+        if write_mode not in WRITE_MODES:
+            raise ValueError(f"Unknown write mode: {write_mode}. Expected one of {WRITE_MODES}")
+        if parse_mode not in PARSE_MODES:
+            raise ValueError(f"Unknown parse mode: {parse_mode}. Expected one of {PARSE_MODES}")
+
         self.db_url = db_url
         self.max_workers = max_workers
-        self.semaphore = asyncio.Semaphore(max_workers)
+        self.read_workers = read_workers or max_workers
+        self.transform_workers = transform_workers
+        self.queue_size = queue_size
+        self.admission = admission or AdmissionController(max_concurrency=self.read_workers)
         self.progress = None
         self.chunk_size = chunk_size
+        self.streaming = streaming
+        self.write_mode = write_mode
+        self.parse_mode = parse_mode
+        self.parse_workers = parse_workers or os.cpu_count()
+        self.excel_engine = excel_engine
+        resolve_engine(excel_engine)
+        self.parsed_cache = parsed_cache
+        # File -> Excel engine it was read with
+        self.read_engines: dict[str, str] = {}
+        # File -> sha256 taken before it was read, recorded in the manifest
+        self.content_hashes: dict[str, str] = {}
+        self._executor: ProcessPoolExecutor | None = None
+        # Queues of batches sent by the process pool
+        self._manager = None
+        # Progress counters of the job running this processor
+        self.job = job
         self.errors: dict = {'AC_PASSED': [], "FAILED": [], "FAILED_DATA": []}
+        # Files with chunks in FAILED_DATA -> those chunks, written again by retry_failed_insertions
+        self.partial_files: dict[str, list[list[dict]]] = {}
+        # Rollup keys of every written record, refreshed after the run
+        self.rollup_keys = RollupKeys()
         self.additional_fields = {
             'from_state', 'to_state', 'from_territory', 'to_territory',
             'nb._of_flights', 'average_seats_available', 'average_payload_capacity'
@@ -50,98 +249,307 @@ class DataProcessor:
             class_=AsyncSession
         )
 
-        with tqdm(total=len(file_paths), desc="[PassengersFlow]File processing") as self.progress:
-            tasks = [self._process_file(async_session, file_path) for file_path in file_paths]
-            await asyncio.gather(*tasks)
-        await engine.dispose()
-
-    async def _process_file(self, async_session, file_path: str):
-        """Processing a single file"""
-        async with self.semaphore:
-            try:
-                # 1. Reading a file with memory control
-                if psutil.virtual_memory().percent > 80:
-                    await asyncio.sleep(1)  # Artificial slowdown
-
-                # 2. Asynchronous Excel Reading with Thread Pool
-                loop = asyncio.get_running_loop()
-
-                with warnings.catch_warnings():
-                    warnings.simplefilter("ignore", category=UserWarning)
-                    df = await loop.run_in_executor(
-                        None,
-                        lambda: pd.read_excel(
-                            file_path,
-                            engine='openpyxl',
-                        )
-                    )
-
-                missing_columns = [col for col in ['air carrier'] if col not in df.columns.str.strip().str.lower()]
-
-                if missing_columns:
-                    self.errors['AC_PASSED'].append(file_path)
-                    self.progress.update(1)
-                    return
-
-                # 3. Data Conversion
-                processed_df = await self._transform_data(df)
-                records = processed_df.to_dict('records')
-
-                # 4. Asynchronous writing to the DataBase
-                for i in range(0, len(records), self.chunk_size):
-                    chunk = records[i:i + self.chunk_size]
-                    async with async_session() as session:
-                        await self._insert_to_db(session, chunk)
-                        await session.commit()
-
-                self.progress.update(1)
-                self.progress.set_postfix_str(f"Processed: {Path(file_path).name}")
+        metrics.track_pool('passengers', engine)
+        if self.job is not None:
+            self.job.files_total += len(file_paths)
 
-            except Exception as e:
-                logger.warning(f"File error {file_path}: {str(e)}", exc_info=True)
-                self.errors['FAILED'].append(file_path)
-                self.progress.update(1)
+        try:
+            with tqdm(total=len(file_paths), desc="[PassengersFlow]File processing") as self.progress, \
+                    self._parse_pool():
+                await self._pipeline(async_session).run(file_paths)
+        finally:
+            await engine.dispose()
 
-    async def _transform_data(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Data transformation from Excel to PassengersFlow table format"""
+    @contextmanager
+    def _parse_pool(self):
+        """Process pool and batch queues of process parse mode, for one pipeline run"""
+        if self.parse_mode != 'process':
+            yield
+            return
 
-        df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_', regex=False)
+        self._executor = ProcessPoolExecutor(max_workers=self.parse_workers)
+        self._manager = multiprocessing.Manager()
+        try:
+            yield
+        finally:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+            self._manager.shutdown()
+            self._manager = None
+
+    def _pipeline(self, async_session) -> Pipeline:
+        return Pipeline(
+            stages=[
+                Stage('parse', self._parse_stage, workers=self.read_workers, queue_size=self.read_workers),
+                Stage('transform', self._transform_stage, workers=self.transform_workers,
+                      queue_size=self.queue_size),
+                Stage('write', partial(self._write_stage, async_session), workers=self.max_workers,
+                      queue_size=self.queue_size * self.max_workers),
+            ],
+            on_error=self._file_error,
+            on_done=self._file_finished
+        )
 
-        expected_columns = {
-            'air_carrier', 'from_city', 'to_city', 'year', 'aircraft_type',
-            'passengers_revenue_traffic', 'seats_available', 'passenger_occupancy_factor', 'from_state', 'to_state',
-            'from_territory', 'to_territory', 'nb._of_flights',
-            'average_seats_available', 'average_payload_capacity'
-        }
+    async def _parse_stage(self, task: FileTask, file_path: str) -> AsyncIterator:
+        """
+        Yields DataFrames of the file, or columnar batches already transformed in the process pool
+        or read from the parsed cache
+        """
+        loop = asyncio.get_running_loop()
+        content_hash = await loop.run_in_executor(None, file_hash, file_path)
+        self.content_hashes[file_path] = content_hash
+
+        key = None
+        if self.parsed_cache is not None:
+            key = ParsedCache.key(content_hash, CACHE_VERSION)
+            if self.parsed_cache.has('passengers', key):
+                # Cached batches are read one at a time, the file is not loaded
+                await self.admission.acquire(file_path, 0)
+                async for columns in self._cached_batches(file_path, key):
+                    yield columns
+                return
+
+        # Memory control, streaming keeps a few batches instead of the whole file
+        await self.admission.acquire(
+            file_path, estimate_footprint(file_path, self.chunk_size if self.streaming else None, self.queue_size)
+        )
+        if key is not None:
+            metrics.PARSED_CACHE_RESULTS.labels('passengers', 'miss').inc()
+            task.state.update(cache=self.parsed_cache.writer('passengers', key, CACHE_TYPES), batches=0, cached=0,
+                              cache_lock=asyncio.Lock())
+        async with aclosing(self._parsed_batches(file_path)) as batches:
+            async for batch in batches:
+                if key is not None:
+                    task.state['batches'] += 1
+                yield batch
+        task.state['parsed'] = True
+
+    async def _cached_batches(self, file_path: str, key: str) -> AsyncIterator[dict[str, list]]:
+        metrics.PARSED_CACHE_RESULTS.labels('passengers', 'hit').inc()
+        self._engine_used(file_path, 'cache')
+        loop = asyncio.get_running_loop()
+        batches = self.parsed_cache.read('passengers', key)
+        try:
+            while True:
+                columns = await loop.run_in_executor(None, next, batches, None)
+                if columns is None:
+                    break
+                yield columns
+        finally:
+            batches.close()
 
-        for col in expected_columns:
-            if col not in df.columns:
-                df[col] = np.nan
+    async def _parsed_batches(self, file_path: str) -> AsyncIterator:
+        if self._executor is not None:
+            async with aclosing(self._worker_batches(file_path)) as batches:
+                async for columns in batches:
+                    yield columns
+            return
 
-        df = df.replace([np.nan, pd.NA, '', ' '], None)
-        int_columns = ['year', 'passengers_revenue_traffic', 'seats_available', 'nb._of_flights',
-                       'average_seats_available']
-        for col in int_columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int64')
+        async with aclosing(self._read_batches(file_path)) as frames:
+            async for df in frames:
+                yield df
+
+    async def _worker_batches(self, file_path: str) -> AsyncIterator[dict[str, list]]:
+        """Batches of a file parsed and transformed in the process pool, received one at a time"""
+        loop = asyncio.get_running_loop()
+        batches = self._manager.Queue(maxsize=self.queue_size)
+        stop = self._manager.Event()
+        worker = loop.run_in_executor(
+            self._executor, parse_and_transform, file_path, self.chunk_size, self.streaming, self.excel_engine,
+            batches, stop
+        )
+        finished = False
+        try:
+            while True:
+                try:
+                    columns = await loop.run_in_executor(None, batches.get, True, 0.5)
+                except queue.Empty:
+                    # A worker killed with the pool never puts None
+                    if worker.done():
+                        break
+                    continue
+                if columns is None:
+                    break
+                yield columns
+            finished = True
+        finally:
+            if not finished:
+                # Closed early, the worker stops at the next batch and is not left blocked on a full queue
+                stop.set()
+                while not worker.done():
+                    try:
+                        await loop.run_in_executor(None, batches.get, True, 0.1)
+                    except queue.Empty:
+                        pass
+                    await asyncio.sleep(0)
+                if not worker.cancelled():
+                    worker.exception()
+
+        _, parse_seconds, transform_seconds, engine = await worker
+        self._engine_used(file_path, engine)
+        metrics.EXCEL_PARSE_SECONDS.labels('passengers').observe(parse_seconds)
+        metrics.TRANSFORM_SECONDS.labels('passengers').observe(transform_seconds)
+
+    async def _transform_stage(self, task: FileTask, batch) -> AsyncIterator[list[dict]]:
+        """Yields chunk_size lists of transformed records"""
+        if isinstance(batch, dict):
+            columns = batch
+        else:
+            check_columns(batch)
+            with metrics.observe(metrics.TRANSFORM_SECONDS, 'passengers'):
+                processed_df = await self._transform_data(batch)
+            columns = frame_to_columns(processed_df)
+            del batch, processed_df
+
+        if task.state.get('cache') is not None:
+            # Arrow conversion and Parquet encoding run off the event loop, one batch of the file at a time
+            async with task.state['cache_lock']:
+                writer = task.state.get('cache')
+                if writer is not None:
+                    loop = asyncio.get_running_loop()
+                    try:
+                        await loop.run_in_executor(None, writer.write, columns)
+                        task.state['cached'] += 1
+                    except Exception as e:
+                        # The cache is an optimization, the file is still written to DataBase
+                        del task.state['cache']
+                        await loop.run_in_executor(None, writer.discard)
+                        logger.warning(f"Parsed cache: could not store {task.path}: {e}")
+        records = columns_to_records(columns)
+        del columns
+
+        for i in range(0, len(records), self.chunk_size):
+            yield records[i:i + self.chunk_size]
+
+    async def _write_stage(self, async_session, task: FileTask, chunk: list[dict]):
+        async with async_session() as session:
+            if not await self._write_to_db(session, chunk):
+                self.partial_files.setdefault(task.path, []).append(chunk)
+            elif self.job is not None:
+                self.job.add_rows(len(chunk))
+            await session.commit()
+
+    def _file_error(self, task: FileTask, stage: str, error: Exception):
+        if isinstance(error, MissingColumnsError):
+            self.errors['AC_PASSED'].append(task.path)
+            task.state['result'] = 'skipped'
+            return
 
-        float_columns = ['passenger_occupancy_factor', 'average_payload_capacity']
-        for col in float_columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
-            df[col] = df[col].replace(np.nan, None)
+        logger.warning(f"File error {task.path} ({stage}): {str(error)}", exc_info=error)
+        self.errors['FAILED'].append(task.path)
 
-        ordered_columns = [
-            'from_city', 'to_city', 'year', 'air_carrier', 'aircraft_type',
-            'passengers_revenue_traffic', 'seats_available', 'passenger_occupancy_factor', 'from_state', 'to_state',
-            'from_territory', 'to_territory', 'nb._of_flights',
-            'average_seats_available', 'average_payload_capacity'
-        ]
+    async def _file_finished(self, task: FileTask):
+        await self.admission.release(task.path)
+        writer = task.state.pop('cache', None)
+        if writer is not None:
+            # Stored if every parsed batch was transformed, even if writing it to DataBase failed
+            try:
+                complete = task.state.get('parsed') and task.state['cached'] == task.state['batches']
+                await asyncio.get_running_loop().run_in_executor(
+                    None, writer.commit if complete else writer.discard
+                )
+            except OSError as e:
+                logger.warning(f"Parsed cache: could not store {task.path}: {e}")
+        if self.progress is not None:
+            self.progress.update(1)
+            self.progress.set_postfix_str(f"Processed: {Path(task.path).name}")
+        result = task.state.get('result')
+        self._file_done(task.path, failed=task.failed and result is None, result=result)
+
+    def _file_done(self, file_path: str, failed: bool = False, result: str | None = None):
+        size = os.path.getsize(file_path)
+        if result is None:
+            result = 'failed' if failed else ('partial' if file_path in self.partial_files else 'ok')
+        metrics.FILES_PROCESSED.labels('passengers', result).inc()
+        metrics.BYTES_READ.labels('passengers').inc(size)
+        if self.job is not None:
+            self.job.file_done(size=size, failed=failed, path=file_path)
+
+    def _engine_used(self, file_path: str, engine: str):
+        self.read_engines[file_path] = engine
+        metrics.EXCEL_FILES_READ.labels('passengers', engine).inc()
+        logger.info(f"Read {Path(file_path).name} with {engine}")
+
+    async def _read_batches(self, file_path: str) -> AsyncIterator[pd.DataFrame]:
+        """Reads the file as one DataFrame, or as chunk_size DataFrames in streaming mode"""
+        loop = asyncio.get_running_loop()
+        frames = read_frames(file_path, self.chunk_size, self.streaming, self.excel_engine)
+        parse_seconds = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                df = await loop.run_in_executor(None, next, frames, None)
+                parse_seconds += time.perf_counter() - start
+                if df is None:
+                    break
+                if file_path not in self.read_engines:
+                    self._engine_used(file_path, df.attrs.get('excel_engine', self.excel_engine))
+                yield df
+        finally:
+            frames.close()
+            metrics.EXCEL_PARSE_SECONDS.labels('passengers').observe(parse_seconds)
 
-        return df[ordered_columns]
+    async def _transform_data(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Data transformation from Excel to PassengersFlow table format"""
+        return transform_passengers_frame(df)
+
+    @staticmethod
+    def _db_record(record: dict) -> dict:
+        """Maps a transformed record to PassengersFlow table columns"""
+        return {column: record.get(field) for column, field in PASSENGERS_FIELDS.items()}
+
+    @staticmethod
+    def _upsert_set(stmt) -> dict:
+        """ON CONFLICT update clause for unique_passengers_record"""
+        return {
+            # Если новое значение равно NULL, оставляем старое
+            'prt': func.coalesce(stmt.excluded.prt, ASGPassengersTable.prt),
+            'seats_available': func.coalesce(stmt.excluded.seats_available,
+                                             ASGPassengersTable.seats_available),
+            'passenger_occupancy_factor': func.coalesce(stmt.excluded.passenger_occupancy_factor,
+                                                        ASGPassengersTable.passenger_occupancy_factor),
+            'number_of_flights': func.coalesce(stmt.excluded.number_of_flights,
+                                               ASGPassengersTable.number_of_flights),
+            'average_seats_available': func.coalesce(stmt.excluded.average_seats_available,
+                                                     ASGPassengersTable.average_seats_available),
+            'average_payload_capacity': func.coalesce(stmt.excluded.average_payload_capacity,
+                                                      ASGPassengersTable.average_payload_capacity),
+            'from_state': func.coalesce(stmt.excluded.from_state, ASGPassengersTable.from_state),
+            'to_state': func.coalesce(stmt.excluded.to_state, ASGPassengersTable.to_state),
+            'from_territory': func.coalesce(stmt.excluded.from_territory,
+                                            ASGPassengersTable.from_territory),
+            'to_territory': func.coalesce(stmt.excluded.to_territory, ASGPassengersTable.to_territory),
+            'from_city': stmt.excluded.from_city,
+            'to_city': stmt.excluded.to_city,
+            'year': stmt.excluded.year,
+            'air_carrier': stmt.excluded.air_carrier,
+            'aircraft_type': stmt.excluded.aircraft_type
+        }
 
-    async def _insert_to_db(self, session, records: list[dict]):
+    async def _write_to_db(self, session, records: list[dict]) -> bool:
+        """
+        Writes records with the configured write mode, returns False if some chunks failed.
+        Rollup keys are recorded for committed chunks only
+        """
+        failed_rows = len(self.errors['FAILED_DATA'])
+        with metrics.observe(metrics.DB_WRITE_SECONDS, 'passengers', self.write_mode):
+            if self.write_mode == 'copy':
+                written = await self._copy_to_db(session, records)
+            else:
+                written = await self._insert_to_db(session, records)
+
+        failed_rows = len(self.errors['FAILED_DATA']) - failed_rows
+        metrics.ROWS_WRITTEN.labels('passengers').inc(len(records) - failed_rows)
+        if not written:
+            metrics.FAILED_CHUNKS.labels('passengers').inc()
+            metrics.FAILED_ROWS.labels('passengers').inc(failed_rows)
+        return written
+
+    async def _insert_to_db(self, session, records: list[dict]) -> bool:
         """Batch insert/update into DataBase"""
         if not records:
-            return
+            return True
+        failed = False
         try:
             max_params_per_chunk = 30000
             fields_per_record = 15
@@ -150,63 +558,77 @@ class DataProcessor:
             for i in range(0, len(records), safe_chunk_size):
                 chunk = records[i:i + safe_chunk_size]
 
-                filtered_chunk = []
-                for record in chunk:
-                    filtered_record = {
-                        'from_city': record.get('from_city'),
-                        'to_city': record.get('to_city'),
-                        'year': record.get('year'),
-                        'air_carrier': record.get('air_carrier'),
-                        'aircraft_type': record.get('aircraft_type'),
-                        'prt': record.get('passengers_revenue_traffic'),
-                        'seats_available': record.get('seats_available'),
-                        'passenger_occupancy_factor': record.get('passenger_occupancy_factor'),
-                        'from_state': record.get('from_state'),
-                        'to_state': record.get('to_state'),
-                        'from_territory': record.get('from_territory'),
-                        'to_territory': record.get('to_territory'),
-                        'number_of_flights': record.get('nb._of_flights'),
-                        'average_seats_available': record.get('average_seats_available'),
-                        'average_payload_capacity': record.get('average_payload_capacity')
-                    }
-                    filtered_chunk.append(filtered_record)
+                filtered_chunk = [self._db_record(record) for record in chunk]
 
                 stmt = insert(ASGPassengersTable).values(filtered_chunk)
                 stmt = stmt.on_conflict_do_update(
                     constraint='unique_passengers_record',
-                    set_={
-                        # Если новое значение равно NULL, оставляем старое
-                        'prt': func.coalesce(stmt.excluded.prt, ASGPassengersTable.prt),
-                        'seats_available': func.coalesce(stmt.excluded.seats_available,
-                                                         ASGPassengersTable.seats_available),
-                        'passenger_occupancy_factor': func.coalesce(stmt.excluded.passenger_occupancy_factor,
-                                                                    ASGPassengersTable.passenger_occupancy_factor),
-                        'number_of_flights': func.coalesce(stmt.excluded.number_of_flights,
-                                                           ASGPassengersTable.number_of_flights),
-                        'average_seats_available': func.coalesce(stmt.excluded.average_seats_available,
-                                                                 ASGPassengersTable.average_seats_available),
-                        'average_payload_capacity': func.coalesce(stmt.excluded.average_payload_capacity,
-                                                                  ASGPassengersTable.average_payload_capacity),
-                        'from_state': func.coalesce(stmt.excluded.from_state, ASGPassengersTable.from_state),
-                        'to_state': func.coalesce(stmt.excluded.to_state, ASGPassengersTable.to_state),
-                        'from_territory': func.coalesce(stmt.excluded.from_territory,
-                                                        ASGPassengersTable.from_territory),
-                        'to_territory': func.coalesce(stmt.excluded.to_territory, ASGPassengersTable.to_territory),
-                        'from_city': stmt.excluded.from_city,
-                        'to_city': stmt.excluded.to_city,
-                        'year': stmt.excluded.year,
-                        'air_carrier': stmt.excluded.air_carrier,
-                        'aircraft_type': stmt.excluded.aircraft_type
-                    }
+                    set_=self._upsert_set(stmt)
                 )
 
                 try:
                     await session.execute(stmt)
                     await session.commit()
+                    self.rollup_keys.add(chunk)
                 except Exception as e:
                     await session.rollback()
                     logger.error(f"Error inserting chunk {i}-{i + len(chunk)}: {str(e)}")
                     self.errors["FAILED_DATA"].extend(chunk)
+                    failed = True
+
+            return not failed
+
+        except Exception as e:
+            logger.critical(f"Critical DB error: {str(e)}", exc_info=True)
+            state.update_error(f"Critical DB error: {str(e)}")
+            raise
+
+        finally:
+            await session.close()
+
+    async def _copy_to_db(self, session, records: list[dict]) -> bool:
+        """COPY records into a staging table and merge them into DataBase with one statement"""
+        if not records:
+            return True
+        try:
+            columns = list(PASSENGERS_FIELDS)
+            rows = [self._copy_record(record) for record in records]
+
+            staging = table(STAGING_TABLE, *[column(name) for name in columns])
+            stmt = insert(ASGPassengersTable).from_select(
+                columns,
+                select(*staging.c)
+                .distinct(*[staging.c[name] for name in UNIQUE_FIELDS])
+                .order_by(*[staging.c[name] for name in UNIQUE_FIELDS])
+            )
+            stmt = stmt.on_conflict_do_update(
+                constraint='unique_passengers_record',
+                set_=self._upsert_set(stmt)
+            )
+
+            try:
+                # Temporary tables are never WAL-logged and are private to the connection,
+                # so concurrent files do not share the staging data
+                await session.execute(text(
+                    f"CREATE TEMP TABLE {STAGING_TABLE} ON COMMIT DROP AS "
+                    f"SELECT {', '.join(columns)} FROM {ASGPassengersTable.__tablename__} WITH NO DATA"
+                ))
+                connection = await session.connection()
+                raw_connection = await connection.get_raw_connection()
+                await raw_connection.driver_connection.copy_records_to_table(
+                    STAGING_TABLE,
+                    records=rows,
+                    columns=columns
+                )
+                await session.execute(stmt)
+                await session.commit()
+                self.rollup_keys.add(records)
+                return True
+            except Exception as e:
+                await session.rollback()
+                logger.error(f"Error copying chunk of {len(records)} records: {str(e)}")
+                self.errors["FAILED_DATA"].extend(records)
+                return False
 
         except Exception as e:
             logger.critical(f"Critical DB error: {str(e)}", exc_info=True)
@@ -216,10 +638,30 @@ class DataProcessor:
         finally:
             await session.close()
 
+    @staticmethod
+    def _copy_record(record: dict) -> tuple:
+        """Converts a transformed record to a COPY row with exact column types"""
+        row = []
+        for column, field in PASSENGERS_FIELDS.items():
+            value = record.get(field)
+            if value is None or pd.isna(value):
+                row.append(None)
+            else:
+                row.append(COPY_TYPES[column](value))
+        return tuple(row)
+
+    def ingested_files(self, file_paths: list[str]) -> list[str]:
+        """
+        Files fully written to DataBase. Files skipped for a missing air carrier column are left out,
+        they are read again once fixed even if their content hash and mtime are kept
+        """
+        failed = set(self.errors['FAILED']) | set(self.partial_files) | set(self.errors['AC_PASSED'])
+        return [file_path for file_path in file_paths if file_path not in failed]
+
     async def retry_failed_insertions(self):
         """Reprocessing files and data not inserted into the database"""
 
-        if not self.errors["FAILED"] and not self.errors["FAILED_DATA"]:
+        if not self.errors["FAILED"] and not self.partial_files:
             logger.info("No failed records to reprocess.")
             return
 
@@ -233,25 +675,32 @@ class DataProcessor:
             class_=AsyncSession
         )
 
-        for file_path in failed_files:
-            try:
-                await self._process_file(async_session, file_path)
-            except Exception as e:
-                logger.warning(f"Repeated error while processing file {file_path}: {e}")
-                self.errors["FAILED"].append(file_path)
-
-        failed_data = self.errors["FAILED_DATA"][:]
+        # FAILED_DATA holds the failed records of the chunks in partial_files, chunks failing again put them back
         self.errors["FAILED_DATA"].clear()
-        async with async_session() as session:
-            for entry in failed_data:
-                try:
-                    data = entry["data"]
-                    await self._insert_to_db(session, [data])
-                except Exception as e:
-                    logger.warning(f"Error while re-inserting data: {e}. Data: {entry["data"]}")
-                    self.errors["FAILED_DATA"].append(data)
-                finally:
-                    await session.close()
+        partial_files = self.partial_files
+        self.partial_files = {}
+
+        if failed_files:
+            # Files are written whole again, failing ones are put back to FAILED by the pipeline
+            for file_path in failed_files:
+                partial_files.pop(file_path, None)
+            with self._parse_pool():
+                await self._pipeline(async_session).run(failed_files)
+
+        # Chunks are upserted again whole, a file leaves partial_files once all of its chunks are written
+        for file_path, chunks in partial_files.items():
+            for chunk in chunks:
+                async with async_session() as session:
+                    try:
+                        written = await self._write_to_db(session, chunk)
+                    except Exception as e:
+                        logger.warning(f"Error while re-inserting {len(chunk)} records of {file_path}: {e}")
+                        self.errors["FAILED_DATA"].extend(chunk)
+                        written = False
+                if not written:
+                    self.partial_files.setdefault(file_path, []).append(chunk)
+                elif self.job is not None:
+                    self.job.add_rows(len(chunk))
 
         await engine.dispose()
 
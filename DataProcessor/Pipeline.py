@@ -0,0 +1,123 @@
+import asyncio
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable
+
+from Utills.Logger import logger
+
+
+@dataclass
+class FileTask:
+    """A file going through the pipeline, finished when none of its items is queued or being handled"""
+    path: str
+    # Set by the error handler, remaining items of the file are dropped
+    failed: bool = False
+    pending: int = 0
+    # Free-form per file state of the stages
+    state: dict = field(default_factory=dict)
+
+
+@dataclass
+class Stage:
+    """
+    :param name: stage name for logs
+    :param handler: async generator taking (task, item) and yielding items for the next stage,
+        or a coroutine function for the last stage
+    :param workers: concurrent handlers
+    :param queue_size: bound of the stage input queue, a full queue blocks the previous stage
+    """
+    name: str
+    handler: Callable[[FileTask, Any], AsyncIterator[Any]]
+    workers: int = 1
+    queue_size: int = 2
+
+
+_DONE = object()
+
+
+class Pipeline:
+    def __init__(self, stages: list[Stage], on_error: Callable[[FileTask, str, Exception], None],
+                 on_done: Callable[[FileTask], Awaitable[None] | None]):
+        """
+        Runs files through stages connected by bounded queues.
+
+        Every stage has its own worker pool. Items of a file flow independently, so a slow last stage
+        fills the queues and blocks the earlier stages instead of buffering parsed data in memory.
+
+        :param stages: stages in order, the first one gets file paths as items
+        :param on_error: called when a handler raises for an item of a file
+        :param on_done: called once per file after its last item was handled
+        """
+        if not stages:
+            raise ValueError("Pipeline needs at least one stage")
+        self.stages = stages
+        self.on_error = on_error
+        self.on_done = on_done
+
+    async def run(self, file_paths: Iterable[str]) -> list[FileTask]:
+        """Discovers file_paths into the first stage and returns after every file finished"""
+        queues = [asyncio.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        tasks: list[FileTask] = []
+
+        async def discover():
+            for file_path in file_paths:
+                task = FileTask(file_path, pending=1)
+                tasks.append(task)
+                await queues[0].put((task, file_path))
+            for _ in range(self.stages[0].workers):
+                await queues[0].put(_DONE)
+
+        async def finish(task: FileTask):
+            task.pending -= 1
+            if task.pending == 0:
+                result = self.on_done(task)
+                if asyncio.iscoroutine(result):
+                    await result
+
+        async def worker(index: int):
+            stage = self.stages[index]
+            inbox = queues[index]
+            outbox = queues[index + 1] if index + 1 < len(queues) else None
+            while True:
+                entry = await inbox.get()
+                if entry is _DONE:
+                    return
+                task, item = entry
+                try:
+                    if task.failed:
+                        continue
+                    outputs = stage.handler(task, item)
+                    if asyncio.iscoroutine(outputs):
+                        await outputs
+                    else:
+                        async with aclosing(outputs) as outputs:
+                            async for output in outputs:
+                                if task.failed:
+                                    break
+                                if outbox is not None:
+                                    task.pending += 1
+                                    await outbox.put((task, output))
+                except Exception as e:
+                    if not task.failed:
+                        task.failed = True
+                        self.on_error(task, stage.name, e)
+                finally:
+                    await finish(task)
+
+        async def run_stage(index: int):
+            stage = self.stages[index]
+            await asyncio.gather(*[worker(index) for _ in range(stage.workers)])
+            # Workers of the next stage stop once everything before them is handled
+            if index + 1 < len(self.stages):
+                for _ in range(self.stages[index + 1].workers):
+                    await queues[index + 1].put(_DONE)
+
+        runners = [asyncio.create_task(discover())] + \
+                  [asyncio.create_task(run_stage(index)) for index in range(len(self.stages))]
+        try:
+            await asyncio.gather(*runners)
+        finally:
+            for runner in runners:
+                runner.cancel()
+            await asyncio.gather(*runners, return_exceptions=True)
+        return tasks
@@ -0,0 +1,120 @@
+from datetime import datetime
+
+from sqlalchemy import select, func, distinct, cast, literal, tuple_, delete, Float, DateTime
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+
+from DATABASE import ASGPassengersTable, CarrierYearRollup, RouteYearRollup, AircraftYearRollup
+from Utills.Logger import logger
+
+# Rollup table -> passengersflow columns it is grouped by
+ROLLUP_KEYS = {
+    CarrierYearRollup: ('year', 'air_carrier'),
+    RouteYearRollup: ('year', 'from_city', 'to_city'),
+    AircraftYearRollup: ('year', 'aircraft_type'),
+}
+
+# Rollup table -> aggregates besides the common ones
+ROLLUP_EXTRA = {
+    CarrierYearRollup: {
+        'routes': func.count(distinct(func.concat(ASGPassengersTable.from_city, '|', ASGPassengersTable.to_city)))
+    },
+    RouteYearRollup: {'carriers': func.count(distinct(ASGPassengersTable.air_carrier))},
+    AircraftYearRollup: {'carriers': func.count(distinct(ASGPassengersTable.air_carrier))},
+}
+
+# Touched keys are refreshed by chunks of IN lists
+KEYS_PER_STATEMENT = 1000
+# Key column -> its python type, keys of cached (str) and read (int for numeric cells) records are the same
+KEY_TYPES = {
+    field: ASGPassengersTable.__table__.c[field].type.python_type
+    for fields in ROLLUP_KEYS.values() for field in fields
+}
+
+
+def rollup_aggregates(model) -> dict:
+    passengers = func.sum(ASGPassengersTable.prt)
+    seats = func.sum(ASGPassengersTable.seats_available)
+    return {
+        'passengers': passengers,
+        'flights': func.sum(ASGPassengersTable.number_of_flights),
+        'seats': seats,
+        'load_factor': cast(passengers, Float) / cast(func.nullif(seats, 0), Float),
+        **ROLLUP_EXTRA[model],
+        'records': func.count(),
+    }
+
+
+class RollupKeys:
+    """Rollup keys touched by written passengersflow records, values are coerced to the column types"""
+
+    def __init__(self):
+        self.keys: dict = {model: set() for model in ROLLUP_KEYS}
+
+    def add(self, records: list[dict]):
+        for model, fields in ROLLUP_KEYS.items():
+            keys = self.keys[model]
+            for record in records:
+                key = tuple(record.get(field) for field in fields)
+                if None not in key:
+                    keys.add(tuple(KEY_TYPES[field](value) for field, value in zip(fields, key)))
+
+    def __len__(self):
+        return sum(len(keys) for keys in self.keys.values())
+
+
+def rollup_statement(model, now: datetime, keys: list[tuple] | None = None):
+    """INSERT ... SELECT ... GROUP BY upsert of a rollup, limited to `keys` if given"""
+    fields = ROLLUP_KEYS[model]
+    aggregates = rollup_aggregates(model)
+    key_columns = [ASGPassengersTable.__table__.c[field] for field in fields]
+
+    query = select(
+        *key_columns,
+        *[aggregate.label(name) for name, aggregate in aggregates.items()],
+        literal(now, DateTime).label('refreshed_at')
+    ).group_by(*key_columns)
+    if keys is not None:
+        query = query.where(tuple_(*key_columns).in_(keys))
+
+    stmt = insert(model).from_select([*fields, *aggregates, 'refreshed_at'], query)
+    return stmt.on_conflict_do_update(
+        index_elements=list(fields),
+        set_={name: stmt.excluded[name] for name in [*aggregates, 'refreshed_at']}
+    )
+
+
+async def refresh_rollups(db_url: str, keys: RollupKeys | None = None) -> dict[str, int]:
+    """
+    Refreshes rollup tables from passengersflow.
+
+    :param db_url: DataBase url
+    :param keys: refresh only these keys, full rebuild if None
+    :return: refreshed keys per rollup table
+    """
+
+    now = datetime.now()
+    refreshed = {}
+    engine = create_async_engine(db_url)
+    async_session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    try:
+        async with async_session() as session:
+            for model in ROLLUP_KEYS:
+                if keys is None:
+                    # Keys deleted from passengersflow disappear only on a full rebuild
+                    await session.execute(delete(model))
+                    result = await session.execute(rollup_statement(model, now))
+                    refreshed[model.__tablename__] = result.rowcount
+                    continue
+
+                model_keys = list(keys.keys[model])
+                for i in range(0, len(model_keys), KEYS_PER_STATEMENT):
+                    await session.execute(rollup_statement(model, now, model_keys[i:i + KEYS_PER_STATEMENT]))
+                refreshed[model.__tablename__] = len(model_keys)
+
+            await session.commit()
+    finally:
+        await engine.dispose()
+
+    logger.info(f"Rollups refreshed{' (full)' if keys is None else ''}: {refreshed}")
+    return refreshed
@@ -1,2 +1,3 @@
 from DataProcessor.PassengersDataProcessor import DataProcessor
-from DataProcessor.FinancesDataProcessor import FinancialDataProcessor
\ No newline at end of file
+from DataProcessor.FinancesDataProcessor import FinancialDataProcessor
+from DataProcessor.Rollups import refresh_rollups, RollupKeys
@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import os
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+
+from DATABASE import IngestManifestTable
+from Utills.Logger import logger
+
+
+def file_hash(file_path: str, block_size: int = 1024 * 1024) -> str:
+    """
+    sha256 of the file content, read by blocks
+
+    :param file_path: path to file
+    :param block_size: read block size in bytes
+    :return: hex digest
+    """
+
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Manifest:
+    def __init__(self, db_url: str, kind: str):
+        self.db_url = db_url
+        self.kind = kind
+        # path -> (size, mtime, content_hash | None)
+        self.entries: dict[str, tuple[int, float, str | None]] = {}
+
+    async def changed(self, file_paths: list[str], force: bool = False) -> list[str]:
+        """
+        Filters out files already ingested with the same content.
+
+        Files with the same size and mtime as in the manifest are skipped without reading them.
+        Files with a new size or mtime are hashed, and skipped if the content hash did not change.
+
+        :param file_paths: found files
+        :param force: return all files
+        :return: new or modified files
+        """
+
+        loop = asyncio.get_running_loop()
+        known = await self._load()
+
+        changed = []
+        touched = []
+        for file_path in file_paths:
+            stat = os.stat(file_path)
+            self.entries[file_path] = (stat.st_size, stat.st_mtime, None)
+            row = known.get(file_path)
+
+            if force or row is None:
+                changed.append(file_path)
+                continue
+
+            if row.size == stat.st_size and row.mtime == stat.st_mtime:
+                continue
+
+            content_hash = await loop.run_in_executor(None, file_hash, file_path)
+            self.entries[file_path] = (stat.st_size, stat.st_mtime, content_hash)
+            if content_hash == row.content_hash:
+                touched.append(file_path)
+            else:
+                changed.append(file_path)
+
+        if touched:
+            # Only mtime changed, remember new stats to skip hashing next time
+            await self.commit(touched)
+
+        logger.info(
+            f"[{self.kind}] Manifest: {len(changed)} new or modified files, "
+            f"{len(file_paths) - len(changed)} unchanged{' (force)' if force else ''}"
+        )
+        return changed
+
+    async def commit(self, file_paths: list[str], content_hashes: dict[str, str] | None = None):
+        """
+        Records files as ingested
+
+        :param file_paths: ingested files
+        :param content_hashes: path -> hash taken before the file was read, a file replaced
+            during the run is then loaded again next time. Files without one are hashed now
+        """
+        if not file_paths:
+            return
+
+        loop = asyncio.get_running_loop()
+        now = datetime.now()
+        rows = []
+        for file_path in file_paths:
+            size, mtime, content_hash = self.entries.get(file_path) or (None, None, None)
+            content_hash = (content_hashes or {}).get(file_path, content_hash)
+            if size is None:
+                stat = os.stat(file_path)
+                size, mtime = stat.st_size, stat.st_mtime
+            if content_hash is None:
+                content_hash = await loop.run_in_executor(None, file_hash, file_path)
+
+            rows.append({
+                'kind': self.kind,
+                'path': file_path,
+                'size': size,
+                'mtime': mtime,
+                'content_hash': content_hash,
+                'ingested_at': now,
+            })
+
+        engine = create_async_engine(self.db_url)
+        async_session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+        try:
+            async with async_session() as session:
+                max_params_per_chunk = 30000
+                safe_chunk_size = max_params_per_chunk // len(rows[0])
+
+                for i in range(0, len(rows), safe_chunk_size):
+                    stmt = insert(IngestManifestTable).values(rows[i:i + safe_chunk_size])
+                    stmt = stmt.on_conflict_do_update(
+                        constraint='unique_manifest_record',
+                        set_={
+                            'size': stmt.excluded.size,
+                            'mtime': stmt.excluded.mtime,
+                            'content_hash': stmt.excluded.content_hash,
+                            'ingested_at': stmt.excluded.ingested_at,
+                        }
+                    )
+                    await session.execute(stmt)
+                await session.commit()
+        finally:
+            await engine.dispose()
+
+        logger.info(f"[{self.kind}] Manifest: recorded {len(rows)} ingested files")
+
+    async def _load(self) -> dict:
+        engine = create_async_engine(self.db_url)
+        async_session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+        try:
+            async with async_session() as session:
+                result = await session.execute(
+                    select(
+                        IngestManifestTable.path,
+                        IngestManifestTable.size,
+                        IngestManifestTable.mtime,
+                        IngestManifestTable.content_hash
+                    ).where(IngestManifestTable.kind == self.kind)
+                )
+                return {row.path: row for row in result.all()}
+        finally:
+            await engine.dispose()
@@ -1,2 +1,3 @@
 from FindPath.SyncOrAsync import sync_async_method
-from FindPath.FindPath import Finder
\ No newline at end of file
+from FindPath.FindPath import Finder
+from FindPath.Manifest import Manifest, file_hash
\ No newline at end of file
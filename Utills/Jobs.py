@@ -0,0 +1,193 @@
+import asyncio
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from enum import Enum
+from typing import Awaitable, Callable
+
+from Utills.Logger import logger
+
+
+class JobStatus(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+FINISHED_STATUSES = (JobStatus.COMPLETED, JobStatus.FAILED, JobStatus.CANCELLED)
+
+
+@dataclass
+class Job:
+    kind: str
+    params: dict = field(default_factory=dict)
+    id: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
+    status: JobStatus = JobStatus.PENDING
+    created_at: datetime = field(default_factory=datetime.now)
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+    error: str | None = None
+
+    # Progress
+    files_total: int = 0
+    files_done: int = 0
+    files_failed: int = 0
+    rows_upserted: int = 0
+    bytes_read: int = 0
+
+    task: asyncio.Task | None = field(default=None, repr=False)
+    # Path -> failed, files processed again (retries) only move between done and failed
+    _files: dict[str, bool] = field(default_factory=dict, repr=False)
+    _started: float | None = field(default=None, repr=False)
+    _finished: float | None = field(default=None, repr=False)
+
+    def add_rows(self, rows: int):
+        self.rows_upserted += rows
+
+    def file_done(self, size: int = 0, failed: bool = False, path: str | None = None):
+        """
+        :param path: file path, a file reported again only updates files_failed if its result changed
+        """
+        if path is not None and path in self._files:
+            self.files_failed += int(failed) - int(self._files[path])
+            self._files[path] = failed
+            return
+        if path is not None:
+            self._files[path] = failed
+
+        self.files_done += 1
+        self.bytes_read += size
+        if failed:
+            self.files_failed += 1
+
+    @property
+    def elapsed(self) -> float:
+        if self._started is None:
+            return 0.0
+        return (self._finished or time.monotonic()) - self._started
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows_upserted / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "params": self.params,
+            "status": self.status.value,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "progress": {
+                "files_total": self.files_total,
+                "files_done": self.files_done,
+                "files_failed": self.files_failed,
+                "rows_upserted": self.rows_upserted,
+                "bytes_read": self.bytes_read,
+                "elapsed_sec": round(self.elapsed, 3),
+                "rows_per_sec": round(self.rows_per_sec, 1),
+            },
+        }
+
+
+class JobRegistry:
+    def __init__(self, max_concurrent: int = 2, per_kind: dict[str, int] | None = None, default_per_kind: int = 1,
+                 history: int = 100):
+        """
+        Runs background jobs under a concurrency policy and keeps their state.
+
+        Jobs over the limits wait as pending in submit order.
+
+        :param max_concurrent: running jobs over all kinds
+        :param per_kind: running jobs of a kind, e.g. {"passengers": 1}
+        :param default_per_kind: limit for kinds missing in per_kind
+        :param history: finished jobs kept for /jobs
+        """
+        self.max_concurrent = max_concurrent
+        self.per_kind = per_kind or {}
+        self.default_per_kind = default_per_kind
+        self.history = history
+
+        self.jobs: dict[str, Job] = {}
+        self._global = asyncio.Semaphore(max_concurrent)
+        self._kinds: dict[str, asyncio.Semaphore] = {}
+
+    def _kind_semaphore(self, kind: str) -> asyncio.Semaphore:
+        if kind not in self._kinds:
+            self._kinds[kind] = asyncio.Semaphore(self.per_kind.get(kind, self.default_per_kind))
+        return self._kinds[kind]
+
+    def submit(self, kind: str, runner: Callable[[Job], Awaitable], params: dict | None = None) -> Job:
+        """
+        Schedules a job
+
+        :param kind: job kind, the per kind limit applies
+        :param runner: coroutine function taking the Job to report progress to
+        :param params: job parameters, informational
+        """
+        job = Job(kind=kind, params=params or {})
+        self.jobs[job.id] = job
+        job.task = asyncio.create_task(self._run(job, runner), name=f"job-{kind}-{job.id}")
+        self._trim()
+        logger.info(f"Job {job.id} ({kind}) submitted")
+        return job
+
+    async def _run(self, job: Job, runner: Callable[[Job], Awaitable]):
+        try:
+            async with self._kind_semaphore(job.kind), self._global:
+                job.status = JobStatus.RUNNING
+                job.started_at = datetime.now()
+                job._started = time.monotonic()
+                logger.info(f"Job {job.id} ({job.kind}) started")
+
+                await runner(job)
+                job.status = JobStatus.COMPLETED
+
+        except asyncio.CancelledError:
+            job.status = JobStatus.CANCELLED
+            logger.warning(f"Job {job.id} ({job.kind}) cancelled")
+
+        except Exception as e:
+            job.status = JobStatus.FAILED
+            job.error = str(e)
+            logger.error(f"Job {job.id} ({job.kind}) failed: {e}")
+
+        finally:
+            job.finished_at = datetime.now()
+            if job._started is not None:
+                job._finished = time.monotonic()
+            if job.status == JobStatus.COMPLETED:
+                logger.info(
+                    f"Job {job.id} ({job.kind}) completed: {job.files_done} files, "
+                    f"{job.rows_upserted} rows in {job.elapsed:.1f}s"
+                )
+
+    def _trim(self):
+        finished = [job for job in self.jobs.values() if job.status in FINISHED_STATUSES]
+        for job in finished[:max(0, len(finished) - self.history)]:
+            del self.jobs[job.id]
+
+    def get(self, job_id: str) -> Job | None:
+        return self.jobs.get(job_id)
+
+    def list_jobs(self, kind: str | None = None, status: JobStatus | None = None) -> list[Job]:
+        return [
+            job for job in self.jobs.values()
+            if (kind is None or job.kind == kind) and (status is None or job.status == status)
+        ]
+
+    def active(self, kind: str | None = None) -> list[Job]:
+        return [job for job in self.list_jobs(kind) if job.status not in FINISHED_STATUSES]
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancels a pending or running job, False if it already finished"""
+        job = self.jobs.get(job_id)
+        if job is None or job.status in FINISHED_STATUSES or job.task is None:
+            return False
+        job.task.cancel()
+        return True
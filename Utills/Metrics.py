@@ -0,0 +1,88 @@
+import time
+import weakref
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+# Seconds, from a small chunk upsert to a large workbook parse
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+EXCEL_PARSE_SECONDS = Histogram(
+    'asg_excel_parse_seconds', 'Excel read time per file', ['kind'], buckets=DURATION_BUCKETS
+)
+TRANSFORM_SECONDS = Histogram(
+    'asg_transform_seconds', 'Transform time per file or batch', ['kind'], buckets=DURATION_BUCKETS
+)
+DB_WRITE_SECONDS = Histogram(
+    'asg_db_write_seconds', 'DataBase write latency per chunk', ['kind', 'mode'], buckets=DURATION_BUCKETS
+)
+ROWS_WRITTEN = Counter('asg_rows_written_total', 'Rows written to DataBase, rate() gives rows/sec', ['kind'])
+FAILED_CHUNKS = Counter('asg_failed_chunks_total', 'Chunks that failed to write', ['kind'])
+FAILED_ROWS = Counter('asg_failed_rows_total', 'Rows of failed chunks, FAILED_DATA', ['kind'])
+FILES_PROCESSED = Counter('asg_files_processed_total', 'Processed files by result', ['kind', 'result'])
+EXCEL_FILES_READ = Counter('asg_excel_files_read_total', 'Files read by Excel engine', ['kind', 'engine'])
+PARSED_CACHE_RESULTS = Counter('asg_parsed_cache_results_total', 'Parsed workbook cache results', ['kind', 'result'])
+BYTES_READ = Counter('asg_bytes_read_total', 'Size of processed files', ['kind'])
+
+HTTP_FETCH_SECONDS = Histogram(
+    'asg_http_fetch_seconds', 'External API request latency', ['api', 'endpoint', 'status'],
+    buckets=DURATION_BUCKETS
+)
+API_CACHE_RESULTS = Counter('asg_api_cache_results_total', 'ICAO response cache results', ['endpoint', 'result'])
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'asg_http_request_seconds', 'Latency of requests served by the app', ['method', 'route', 'status'],
+    buckets=DURATION_BUCKETS
+)
+
+ADMISSION_LIMIT = Gauge('asg_admission_concurrency_limit', 'Files loaded at once, adapted to RSS')
+ADMISSION_RESERVED = Gauge('asg_admission_reserved_bytes', 'Estimated footprint of admitted files')
+ADMISSION_WAITING = Gauge('asg_admission_waiting_files', 'Files waiting for admission')
+ADMISSION_RSS = Gauge('asg_admission_rss_bytes', 'Last sampled RSS, children included')
+
+DB_POOL_SIZE = Gauge('asg_db_pool_size', 'Connection pool size', ['pool'])
+DB_POOL_CHECKED_OUT = Gauge('asg_db_pool_checked_out', 'Connections in use', ['pool'])
+DB_POOL_OVERFLOW = Gauge('asg_db_pool_overflow', 'Connections over pool size', ['pool'])
+
+# Pool name -> engine, sampled on every scrape
+_pools: "weakref.WeakValueDictionary" = weakref.WeakValueDictionary()
+# Pool labels set on the gauges, labels of collected engines are removed
+_pool_labels: set[str] = set()
+
+
+def track_pool(name: str, engine):
+    """Reports pool saturation of an AsyncEngine while it is alive"""
+    _pools[name] = engine.sync_engine
+
+
+def _sample_pools():
+    for name in _pool_labels - set(_pools.keys()):
+        DB_POOL_SIZE.remove(name)
+        DB_POOL_CHECKED_OUT.remove(name)
+        DB_POOL_OVERFLOW.remove(name)
+        _pool_labels.discard(name)
+
+    for name, sync_engine in list(_pools.items()):
+        pool = sync_engine.pool
+        if not hasattr(pool, 'checkedout'):
+            continue
+        DB_POOL_SIZE.labels(name).set(pool.size())
+        DB_POOL_CHECKED_OUT.labels(name).set(pool.checkedout())
+        DB_POOL_OVERFLOW.labels(name).set(max(0, pool.overflow()))
+        _pool_labels.add(name)
+
+
+@contextmanager
+def observe(histogram, *labels):
+    """Observes the duration of the block"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(*labels).observe(time.perf_counter() - start)
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """Prometheus exposition of all metrics and its content type"""
+    _sample_pools()
+    return generate_latest(), CONTENT_TYPE_LATEST
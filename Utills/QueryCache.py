@@ -0,0 +1,106 @@
+import hashlib
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+
+@dataclass
+class CacheEntry:
+    body: bytes
+    etag: str
+    media_type: str
+    created: float
+    generation: int
+
+    @property
+    def size(self) -> int:
+        return len(self.body)
+
+
+class QueryCache:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: float = 300.0, max_entry_bytes: int | None = None):
+        """
+        In-process LRU response cache for read endpoints.
+
+        Entries expire after `ttl` seconds and are dropped by invalidate(), which is called when
+        an ingest run finishes. ETags are content hashes, so unchanged data stays 304 after an invalidation.
+
+        :param max_bytes: total size of cached bodies, least recently used entries are evicted first
+        :param ttl: max entry age in seconds
+        :param max_entry_bytes: larger responses are not cached, max_bytes / 8 by default
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_entry_bytes = max_entry_bytes or max_bytes // 8
+
+        self.generation = 0
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+
+    @staticmethod
+    def key(path: str, params) -> str:
+        """Path with sorted query params, so parameter order does not split entries"""
+        items = sorted((str(name), str(value)) for name, value in params)
+        return path + "?" + "&".join(f"{name}={value}" for name, value in items)
+
+    @staticmethod
+    def etag(body: bytes) -> str:
+        return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+    def get(self, key: str) -> CacheEntry | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if entry.generation != self.generation or time.monotonic() - entry.created > self.ttl:
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, body: bytes, media_type: str, generation: int | None = None) -> CacheEntry:
+        """
+        Caches a response body
+
+        :param generation: generation the response was built in, responses built before an invalidation
+            are returned but not cached
+        """
+        generation = self.generation if generation is None else generation
+        entry = CacheEntry(body, self.etag(body), media_type, time.monotonic(), generation)
+        if entry.size > self.max_entry_bytes or generation != self.generation:
+            return entry
+
+        self._remove(key)
+        self._entries[key] = entry
+        self.size += entry.size
+        while self.size > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+        return entry
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def invalidate(self):
+        """Drops all entries, data changed"""
+        self.generation += 1
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "generation": self.generation,
+        }
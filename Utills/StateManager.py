@@ -1,10 +1,7 @@
-from datetime import datetime
-
-
 class StateManager:
+    """Process-wide last error, ingest job state is kept by Utills.Jobs.JobRegistry"""
+
     last_error = None
-    start_time = None
-    processing = False
 
     # Errors
     @classmethod
@@ -14,24 +11,3 @@ class StateManager:
     @classmethod
     def get_last_error(cls) -> str | None:
         return cls.last_error
-
-    # Time
-    @classmethod
-    def update_start_time(cls, start_time: datetime | None):
-        cls.start_time = start_time
-
-    @classmethod
-    def get_start_time(cls) -> str | None:
-        try:
-            return cls.start_time.strftime("%Y-%m-%d %H:%M:%S")
-        except:
-            return None
-
-    # Processing
-    @classmethod
-    def update_processing(cls, processing: bool):
-        cls.processing = processing
-
-    @classmethod
-    def get_processing(cls) -> bool:
-        return cls.processing
@@ -1 +1,4 @@
-from Utills.StateManager import StateManager
\ No newline at end of file
+from Utills.StateManager import StateManager
+from Utills.RateLimiter import TokenBucket
+from Utills.QueryCache import QueryCache
+from Utills.Jobs import JobRegistry, Job, JobStatus
@@ -1,24 +1,54 @@
-import asyncio
+import csv
+import io
+import json
 import os
-from datetime import datetime
+import time
 
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine, AsyncSession
 from sqlalchemy.orm import Session
 
-from DATABASE import check_and_create_table, ASGPassengersTable
-from DataProcessor import DataProcessor, FinancialDataProcessor
-from FindPath import Finder
+from DATABASE import check_and_create_table, ASGPassengersTable, CarrierYearRollup, RouteYearRollup, \
+    AircraftYearRollup
+from DataProcessor import DataProcessor, FinancialDataProcessor, refresh_rollups
+from DataProcessor.Admission import AdmissionController
+from DataProcessor.ParsedCache import ParsedCache
+from FindPath import Finder, Manifest
 from dotenv import load_dotenv
 from Utills.Logger import logger
-from Utills import StateManager as state
-from fastapi import FastAPI, HTTPException, Query, Depends
+from Utills import StateManager as state, QueryCache, JobRegistry, Job, JobStatus
+from Utills import Metrics as metrics
+from fastapi import FastAPI, HTTPException, Query, Depends, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse, JSONResponse
 import asyncpg
 
 load_dotenv()
 
 app = FastAPI()
 
+# Read endpoint responses, dropped when an ingest run finishes
+query_cache = QueryCache(
+    max_bytes=int(os.getenv("QUERY_CACHE_BYTES", 64 * 1024 * 1024)),
+    ttl=float(os.getenv("QUERY_CACHE_TTL", 300))
+)
+
+
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    """Request latency by route template, so path parameters do not create new series"""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        metrics.HTTP_REQUEST_SECONDS.labels(
+            request.method, route.path if route is not None else "unmatched", str(status)
+        ).observe(time.perf_counter() - start)
+
 
 async def check_db_connection():
     try:
@@ -35,66 +65,128 @@ async def check_db_connection():
         return True
 
 
-@app.post("/start/{processing_type}")
-async def start(processing_type: str):
-    if not state.get_processing():
-        state.update_error(None)
-        state.update_start_time(datetime.now())
+# Passengers and finances may run at the same time, one job of each kind
+jobs = JobRegistry(
+    max_concurrent=int(os.getenv("JOBS_MAX_CONCURRENT", 2)),
+    default_per_kind=int(os.getenv("JOBS_PER_KIND", 1))
+)
+JOB_KINDS = ('passengers', 'finances')
 
-        if processing_type == 'passengers':
-            state.update_processing(True)
-            asyncio.create_task(run_passengers())
+# Memory budget shared by concurrent ingest jobs, 75% of the container limit by default
+admission = AdmissionController(
+    budget=int(os.getenv("INGEST_MEMORY_BUDGET", 0)) or None,
+    max_concurrency=os.cpu_count()
+)
+# auto, calamine or openpyxl, see DataProcessor.ExcelReader
+EXCEL_ENGINE = os.getenv("EXCEL_ENGINE", "auto")
+# Transformed workbooks by content hash, re-loads and retries of unchanged files skip parsing. Empty disables it
+PARSED_CACHE_DIR = os.getenv("PARSED_CACHE_DIR", "Cache/Parsed")
+parsed_cache = ParsedCache(
+    PARSED_CACHE_DIR,
+    max_bytes=int(os.getenv("PARSED_CACHE_BYTES", 0)) or None
+) if PARSED_CACHE_DIR else None
+
+
+def submit_job(kind: str, write_mode: str, force: bool) -> Job:
+    if kind == 'passengers':
+        return jobs.submit(
+            kind,
+            lambda job: run_passengers(job=job, write_mode=write_mode, force=force),
+            params={'write_mode': write_mode, 'force': force}
+        )
+    if kind == 'finances':
+        return jobs.submit(kind, lambda job: run_finances(job=job, force=force), params={'force': force})
+    raise HTTPException(status_code=404, detail=f"Unknown processing type: {kind}. Expected one of {JOB_KINDS}")
+
+
+def processing_details() -> dict:
+    active = jobs.active()
+    started = [job.started_at for job in active if job.started_at]
+    return {
+        "start_time": min(started).strftime("%Y-%m-%d %H:%M:%S") if started else None,
+        "processing": "running" if active else "idle",
+        "jobs": [job.id for job in active],
+        "memory": admission.stats(),
+    }
 
-        if processing_type == 'finances':
-            state.update_processing(True)
-            asyncio.create_task(run_finances())
 
+@app.post("/start/{processing_type}")
+async def start(processing_type: str, write_mode: str = Query('upsert', pattern='^(upsert|copy)$'),
+                force: bool = False):
+    """Starts an ingest job unless one of this type is already active, see /jobs for queueing"""
+    active = jobs.active(processing_type)
+    if active:
         db_status = await check_db_connection()
-
-        status = {
+        return {
             "status": "ok",
             "details": {
-                "start_time": state.get_start_time(),
+                "message": "Processing already running",
+                "job_id": active[0].id,
                 "database": "active" if db_status else "inactive",
-                "processing": "running" if state.get_processing() else "idle"
+                **processing_details()
             }
         }
 
-        if not db_status or state.get_last_error():
-            status["status"] = "error"
-            status["details"]["error"] = state.get_last_error()
-            raise HTTPException(status_code=500, detail=status)
+    state.update_error(None)
+    job = submit_job(processing_type, write_mode, force)
+    db_status = await check_db_connection()
 
-        if not state.get_processing():
-            status["status"] = "warning"
-            status["details"]["message"] = "Processing not running"
+    status = {
+        "status": "ok",
+        "details": {
+            "job_id": job.id,
+            "database": "active" if db_status else "inactive",
+            **processing_details()
+        }
+    }
 
-        return status
+    if not db_status or state.get_last_error():
+        status["status"] = "error"
+        status["details"]["error"] = state.get_last_error()
+        raise HTTPException(status_code=500, detail=status)
 
-    else:
-        db_status = await check_db_connection()
+    return status
+
+
+@app.get("/jobs")
+async def list_jobs(kind: str | None = None, status: JobStatus | None = None):
+    return [job.to_dict() for job in jobs.list_jobs(kind, status)]
+
+
+@app.post("/jobs/{kind}")
+async def create_job(kind: str, write_mode: str = Query('upsert', pattern='^(upsert|copy)$'), force: bool = False):
+    """Schedules an ingest job, it waits as pending while the concurrency policy is full"""
+    return submit_job(kind, write_mode, force).to_dict()
 
-        status = {
-            "status": "ok",
-            "details": {
-                "message": "Processing already running",
-                "start_time": state.get_start_time(),
-                "database": "active" if db_status else "inactive",
-                "processing": "running" if state.get_processing() else "idle"
-            }
-        }
 
-        return status
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job.to_dict()
+
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    if not jobs.cancel(job_id):
+        raise HTTPException(status_code=409, detail=f"Job {job_id} already {job.status.value}")
+    return {"status": "ok", "details": {"job_id": job_id, "message": "Cancellation requested"}}
+
 
 @app.get("/health")
 async def health_check():
     db_status = await check_db_connection()
+    details = processing_details()
     health_status = {
         "status": "ok",
         "details": {
-            "start_time": state.get_start_time() if state.get_start_time() else "Not started",
+            **details,
+            "start_time": details["start_time"] or "Not started",
             "database": "active" if db_status else "inactive",
-            "processing": "running" if state.get_processing else "idle"
         }
     }
 
@@ -103,14 +195,14 @@ async def health_check():
         health_status["details"]["error"] = state.get_last_error()
         raise HTTPException(status_code=500, detail=health_status)
 
-    if not state.get_processing():
+    if not jobs.active():
         health_status["status"] = "warning"
         health_status["details"]["message"] = "Processing not running"
 
     return health_status
 
 
-async def run_passengers():
+async def run_passengers(job: Job | None = None, write_mode: str = 'upsert', force: bool = False):
     try:
         logger.info("Starting database initialization")
         await check_and_create_table()
@@ -122,16 +214,29 @@ async def run_passengers():
             return
         logger.info(f"Found {len(files_list)} files")
 
+        manifest = Manifest(db_url=os.getenv("DATABASE_URL"), kind='passengers')
+        files_list = await manifest.changed(files_list, force=force)
+        if not files_list:
+            logger.info("No new or modified files")
+            return
+
         logger.info("Starting data processor initialization")
         processor = DataProcessor(
             db_url=os.getenv("DATABASE_URL"),
-            max_workers=os.cpu_count() * 2,
-            chunk_size=5000
+            max_workers=os.cpu_count(),
+            chunk_size=5000,
+            streaming=True,
+            write_mode=write_mode,
+            parse_mode='process',
+            parse_workers=os.cpu_count(),
+            job=job,
+            admission=admission,
+            excel_engine=EXCEL_ENGINE,
+            parsed_cache=parsed_cache
         )
         logger.info("Data processor initialized")
 
         logger.info("Starting data processor loop")
-        state.update_processing(True)
         await processor.process_files(file_paths=files_list)
         logger.info("Data processor loop completed")
 
@@ -148,17 +253,20 @@ async def run_passengers():
                 f"and {len(processor.errors['FAILED_DATA'])} records"
             )
             await processor.retry_failed_insertions()
-            state.update_processing(True)
+
+        if len(processor.rollup_keys):
+            await refresh_rollups(db_url=os.getenv("DATABASE_URL"), keys=processor.rollup_keys)
+
+        await manifest.commit(processor.ingested_files(files_list), processor.content_hashes)
 
     except Exception as e:
         logger.error(f"Application failed: {str(e)}")
         raise
     finally:
-        state.update_processing(False)
-        state.update_start_time(None)
+        query_cache.invalidate()
 
 
-async def run_finances():
+async def run_finances(job: Job | None = None, force: bool = False):
     try:
         logger.info("Starting finances scope")
 
@@ -172,27 +280,38 @@ async def run_finances():
             return
         logger.info(f"Found {len(files_list)} files")
 
+        manifest = Manifest(db_url=os.getenv("DATABASE_URL"), kind='finances')
+        files_list = await manifest.changed(files_list, force=force)
+        if not files_list:
+            logger.info("No new or modified files")
+            return
+
         logger.info("Starting data processor initialization")
         processor = FinancialDataProcessor(
             db_url=os.getenv("DATABASE_URL"),
             max_workers=os.cpu_count() * 2,
+            job=job,
+            admission=admission,
+            excel_engine=EXCEL_ENGINE,
+            parsed_cache=parsed_cache
         )
         logger.info("Data processor initialized")
 
         logger.info("Starting data processor loop")
-        state.update_processing(True)
         await processor.process_files(file_paths=files_list)
         logger.info("Data processor loop completed")
 
+        await manifest.commit(processor.ingested_files(files_list), processor.content_hashes)
+
     except Exception as e:
         logger.error(f"Application failed: {str(e)}")
         raise
     finally:
-        state.update_processing(False)
-        state.update_start_time(None)
+        query_cache.invalidate()
 
 
 engine = create_async_engine(os.getenv("DATABASE_URL"), echo=False)
+metrics.track_pool("api", engine)
 
 
 async_session = async_sessionmaker(
@@ -210,33 +329,198 @@ async def get_db():
         await db.close()
 
 
+async def cached_json(request: Request, build) -> Response:
+    """
+    Serves a JSON response from query_cache, builds and caches it on a miss.
+    Answers 304 when the client already has the current ETag.
+
+    :param request: request, its path and query params are the cache key
+    :param build: coroutine function returning the response data
+    """
+    key = query_cache.key(request.url.path, request.query_params.multi_items())
+    entry = query_cache.get(key)
+    if entry is None:
+        generation = query_cache.generation
+        body = JSONResponse(content=jsonable_encoder(await build())).body
+        entry = query_cache.put(key, body, 'application/json', generation)
+
+    headers = {'ETag': entry.etag, 'Cache-Control': 'no-cache'}
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match and entry.etag in [tag.strip() for tag in if_none_match.split(',')]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type=entry.media_type, headers=headers)
+
+
 @app.get("/api/1")
-async def api_1(limit: int = Query(10, gt=0), db: AsyncSession = Depends(get_db)):
-    stmt = select(ASGPassengersTable).limit(limit)
+async def api_1(request: Request, limit: int = Query(10, gt=0), db: AsyncSession = Depends(get_db)):
+    async def build():
+        stmt = select(*ASGPassengersTable.__table__.columns).limit(limit)
+        result = await db.execute(stmt)
+        return [dict(row) for row in result.mappings().all()]
+
+    return await cached_json(request, build)
+
+
+PASSENGERS_COLUMNS = {column.name: column for column in ASGPassengersTable.__table__.columns}
+PAGE_LIMIT = 1000
+MAX_PAGE_LIMIT = 10000
+STREAM_BATCH_SIZE = 5000
+STREAM_MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def passengers_query(fields: list[str], after_id: int | None, limit: int | None, filters: dict):
+    """
+    Keyset page over passengersflow ordered by id, every filter column has a (column, id) index,
+    year + air_carrier and from_city + to_city have composite ones
+    """
+    stmt = select(*[PASSENGERS_COLUMNS[name] for name in fields])
+    if after_id is not None:
+        stmt = stmt.where(ASGPassengersTable.id > after_id)
+    for name, value in filters.items():
+        if value is not None:
+            stmt = stmt.where(PASSENGERS_COLUMNS[name] == value)
+    stmt = stmt.order_by(ASGPassengersTable.id)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+
+async def stream_passengers(stmt, fields: list[str], output_format: str):
+    """Streams rows from a server-side cursor, one chunk per fetched batch"""
+    async with async_session() as db:
+        result = await db.stream(stmt.execution_options(yield_per=STREAM_BATCH_SIZE))
+
+        if output_format == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(fields)
+            yield buffer.getvalue()
+
+        async for rows in result.partitions():
+            buffer = io.StringIO()
+            if output_format == 'csv':
+                csv.writer(buffer).writerows(rows)
+            else:
+                for row in rows:
+                    buffer.write(json.dumps(dict(zip(fields, row)), default=str))
+                    buffer.write("\n")
+            yield buffer.getvalue()
+
+
+@app.get("/api/passengers")
+async def api_passengers(
+        request: Request,
+        after_id: int | None = Query(None, ge=0, description="Return rows with id greater than this"),
+        limit: int | None = Query(None, gt=0, description=f"Rows per page, json defaults to {PAGE_LIMIT}"),
+        output_format: str = Query('json', alias='format', pattern='^(json|ndjson|csv)$'),
+        fields: str | None = Query(None, description="Comma separated columns, id is always returned"),
+        year: int | None = None,
+        air_carrier: str | None = None,
+        from_city: str | None = None,
+        to_city: str | None = None,
+        aircraft_type: str | None = None,
+):
+    selected = ['id']
+    if fields:
+        requested = [name.strip() for name in fields.split(',') if name.strip()]
+        unknown = [name for name in requested if name not in PASSENGERS_COLUMNS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+        selected += [name for name in requested if name != 'id']
+    else:
+        selected = list(PASSENGERS_COLUMNS)
+
+    filters = {
+        'year': year,
+        'air_carrier': air_carrier,
+        'from_city': from_city,
+        'to_city': to_city,
+        'aircraft_type': aircraft_type,
+    }
+
+    if output_format != 'json':
+        # Streams are not limited by default, rows are never held in memory all at once
+        stmt = passengers_query(selected, after_id, limit, filters)
+        return StreamingResponse(
+            stream_passengers(stmt, selected, output_format),
+            media_type=STREAM_MEDIA_TYPES[output_format]
+        )
+
+    limit = min(limit or PAGE_LIMIT, MAX_PAGE_LIMIT)
+
+    async def build():
+        async with async_session() as db:
+            result = await db.execute(passengers_query(selected, after_id, limit, filters))
+            data = [dict(row) for row in result.mappings().all()]
+
+        return {
+            "data": data,
+            "next_after_id": data[-1]["id"] if len(data) == limit else None,
+        }
+
+    return await cached_json(request, build)
+
+
+async def query_rollup(db: AsyncSession, model, limit: int, filters: dict) -> list[dict]:
+    """Rollup rows matching filters, ordered by the rollup key"""
+    stmt = select(*model.__table__.columns)
+    for name, value in filters.items():
+        if value is not None:
+            stmt = stmt.where(model.__table__.c[name] == value)
+    stmt = stmt.order_by(*model.__table__.primary_key.columns).limit(limit)
+
     result = await db.execute(stmt)
-    data = result.scalars().all()
-    return [
-        {
-            "id": record.id,
-            "from_city": record.from_city,
-            "to_city": record.to_city,
-            "year": record.year,
-            "air_carrier": record.air_carrier,
-            "aircraft_type": record.aircraft_type,
-            "from_state": record.from_state,
-            "to_state": record.to_state,
-            "from_territory": record.from_territory,
-            "to_territory": record.to_territory,
-            "prt": record.prt,
-            "number_of_flights": record.number_of_flights,
-            "seats_available": record.seats_available,
-            "average_seats_available": record.average_seats_available,
-            "passenger_occupancy_factor": record.passenger_occupancy_factor,
-            "average_payload_capacity": record.average_payload_capacity,
-         }
-        for record in data
-    ]
+    return [dict(row) for row in result.mappings().all()]
+
+
+@app.get("/api/rollups/carriers")
+async def rollup_carriers(request: Request, year: int | None = None, air_carrier: str | None = None,
+                          limit: int = Query(PAGE_LIMIT, gt=0, le=MAX_PAGE_LIMIT),
+                          db: AsyncSession = Depends(get_db)):
+    return await cached_json(request, lambda: query_rollup(
+        db, CarrierYearRollup, limit, {'year': year, 'air_carrier': air_carrier}
+    ))
+
+
+@app.get("/api/rollups/routes")
+async def rollup_routes(request: Request, year: int | None = None, from_city: str | None = None,
+                        to_city: str | None = None, limit: int = Query(PAGE_LIMIT, gt=0, le=MAX_PAGE_LIMIT),
+                        db: AsyncSession = Depends(get_db)):
+    return await cached_json(request, lambda: query_rollup(
+        db, RouteYearRollup, limit, {'year': year, 'from_city': from_city, 'to_city': to_city}
+    ))
+
+
+@app.get("/api/rollups/aircraft")
+async def rollup_aircraft(request: Request, year: int | None = None, aircraft_type: str | None = None,
+                          limit: int = Query(PAGE_LIMIT, gt=0, le=MAX_PAGE_LIMIT),
+                          db: AsyncSession = Depends(get_db)):
+    return await cached_json(request, lambda: query_rollup(
+        db, AircraftYearRollup, limit, {'year': year, 'aircraft_type': aircraft_type}
+    ))
+
+
+@app.post("/api/rollups/refresh")
+async def rollup_refresh():
+    """Full rebuild of all rollup tables"""
+    try:
+        return await refresh_rollups(db_url=os.getenv("DATABASE_URL"))
+    finally:
+        query_cache.invalidate()
+
+
+@app.get("/api/cache")
+async def cache_stats():
+    return query_cache.stats()
+
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    body, content_type = metrics.render_metrics()
+    return Response(content=body, media_type=content_type)
 
 
 if __name__ == "__main__":
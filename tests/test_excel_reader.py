@@ -0,0 +1,65 @@
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+from DataProcessor.ExcelReader import CALAMINE, OPENPYXL, _dedup_columns, read_frames
+
+HEADER = ['Air Carrier', 'From City', 'Year', 'Seats', 'Seats', 'Seats.1', None, 'Load Factor']
+ROWS = [
+    ['AA', 'Dallas', 2023, 180, 181, 182, 'x', 0.8],
+    ['BB', None, 2024, None, 5, 6, None, 0.75],
+    [None, None, None, None, None, None, None, None],
+    ['CC', 'Paris', 2024, 300, 301, 302, 'y', 1],
+    ['DD', 'Rome', 2022, 150, 151, 152, None, 0.5],
+]
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    path = tmp_path / 'passengers.xlsx'
+    wb = Workbook()
+    sheet = wb.active
+    sheet.append(HEADER)
+    for row in ROWS:
+        sheet.append(row)
+    wb.save(path)
+    return str(path)
+
+
+def _values(df: pd.DataFrame) -> pd.DataFrame:
+    # Batches hold cell values, dtypes inferred over the whole sheet may differ
+    return df.astype(object).where(df.notna(), None)
+
+
+def test_dedup_columns():
+    assert _dedup_columns(['x', 'y', 'x', 'x']) == ['x', 'y', 'x.1', 'x.2']
+    # Names already in the header are skipped
+    assert _dedup_columns(['x', 'x', 'x.1']) == ['x', 'x.2', 'x.1']
+
+
+@pytest.mark.parametrize('engine', [OPENPYXL, CALAMINE])
+@pytest.mark.parametrize('chunk_size', [1, 2, 100])
+def test_streaming_matches_read_excel(workbook, engine, chunk_size):
+    whole = list(read_frames(workbook, chunk_size, streaming=False, engine=engine))
+    batches = list(read_frames(workbook, chunk_size, streaming=True, engine=engine))
+
+    assert len(whole) == 1
+    assert all(len(batch) <= chunk_size for batch in batches)
+    assert all(batch.attrs['excel_engine'] == engine for batch in batches)
+
+    streamed = pd.concat([_values(batch) for batch in batches], ignore_index=True)
+    expected = whole[0]
+    assert list(streamed.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(streamed, _values(expected), check_dtype=False)
+
+
+def test_streaming_header_only(tmp_path):
+    path = tmp_path / 'empty.xlsx'
+    wb = Workbook()
+    wb.active.append(['Air Carrier', 'Year'])
+    wb.save(path)
+
+    batches = list(read_frames(str(path), 10, streaming=True, engine=OPENPYXL))
+    assert len(batches) == 1
+    assert list(batches[0].columns) == ['Air Carrier', 'Year']
+    assert batches[0].empty
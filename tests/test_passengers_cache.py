@@ -0,0 +1,85 @@
+import pandas as pd
+
+from DataProcessor.ParsedCache import ParsedCache
+from DataProcessor.PassengersDataProcessor import (
+    CACHE_TYPES, CACHE_VERSION, columns_to_records, frame_to_columns, transform_passengers_frame
+)
+from DataProcessor.Rollups import RollupKeys
+from DATABASE import AircraftYearRollup, CarrierYearRollup, RouteYearRollup
+
+
+def _workbook_frame() -> pd.DataFrame:
+    return pd.DataFrame({
+        'Air Carrier': ['AA', 'BB', ' '],
+        'From City': ['Dallas', '', 'Rome'],
+        'To City': ['Paris', 'Oslo', None],
+        'Year': [2023, '2024', None],
+        'Aircraft Type': ['A320', 320, 'B737'],
+        'Passengers Revenue Traffic': [100, 'n/a', 300],
+        'Seats Available': [180.0, 150.0, None],
+        'Passenger Occupancy Factor': [0.55, None, '0.7'],
+        'Nb. of Flights': [2, 3, 4],
+    })
+
+
+def test_transform_columns_and_types():
+    df = transform_passengers_frame(_workbook_frame())
+    assert list(df.columns) == list(CACHE_TYPES)
+
+    columns = frame_to_columns(df)
+    assert columns['year'] == [2023, 2024, None]
+    assert columns['passengers_revenue_traffic'] == [100, None, 300]
+    assert columns['from_city'] == ['Dallas', None, 'Rome']
+    assert columns['air_carrier'] == ['AA', 'BB', None]
+    assert columns['from_state'] == [None, None, None]
+    assert columns['passenger_occupancy_factor'] == [0.55, None, 0.7]
+
+
+def test_parsed_cache_round_trip(tmp_path):
+    columns = frame_to_columns(transform_passengers_frame(_workbook_frame()))
+    cache = ParsedCache(str(tmp_path), batch_size=2)
+    key = ParsedCache.key('0' * 64, CACHE_VERSION)
+    assert not cache.has('passengers', key)
+
+    writer = cache.writer('passengers', key, CACHE_TYPES)
+    writer.write(columns)
+    assert not cache.has('passengers', key)
+    writer.commit()
+    assert cache.has('passengers', key)
+
+    batches = list(cache.read('passengers', key))
+    assert [len(batch['year']) for batch in batches] == [2, 1]
+
+    cached = {name: sum((batch[name] for batch in batches), []) for name in CACHE_TYPES}
+    # Cached values have the column types, mixed workbook cells are coerced
+    expected = {
+        name: [None if value is None else CACHE_TYPES[name](value) for value in values]
+        for name, values in columns.items()
+    }
+    assert cached == expected
+    assert cached['aircraft_type'] == ['A320', '320', 'B737']
+    assert columns_to_records(cached)[0]['year'] == 2023
+
+
+def test_discarded_writer_leaves_no_file(tmp_path):
+    cache = ParsedCache(str(tmp_path))
+    writer = cache.writer('passengers', 'key-v1', CACHE_TYPES)
+    writer.discard()
+
+    assert not cache.has('passengers', 'key-v1')
+    assert list(tmp_path.rglob('*')) == [tmp_path / 'passengers']
+
+
+def test_rollup_keys_coerce_mixed_types():
+    keys = RollupKeys()
+    keys.add([
+        {'year': 2024, 'air_carrier': 'AA', 'from_city': 'A', 'to_city': 'B', 'aircraft_type': 320},
+        {'year': '2024', 'air_carrier': 'AA', 'from_city': 'A', 'to_city': 'B', 'aircraft_type': '320'},
+        {'year': 2024, 'air_carrier': 'AA', 'from_city': 'A', 'to_city': None, 'aircraft_type': 'A320'},
+    ])
+
+    assert keys.keys[CarrierYearRollup] == {(2024, 'AA')}
+    # A missing key column leaves the record out of that rollup only
+    assert keys.keys[RouteYearRollup] == {(2024, 'A', 'B')}
+    assert keys.keys[AircraftYearRollup] == {(2024, '320'), (2024, 'A320')}
+    assert len(keys) == 4
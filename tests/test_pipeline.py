@@ -0,0 +1,75 @@
+import asyncio
+
+from DataProcessor.Pipeline import Pipeline, Stage
+
+
+def _run_pipeline(files: dict[str, list[int]], fail_on: int, workers: int = 2):
+    written, errors, done = [], [], []
+
+    async def parse(task, path):
+        for item in files[path]:
+            yield item
+
+    async def transform(task, item):
+        await asyncio.sleep(0)
+        if item == fail_on:
+            raise ValueError(f"bad item {item}")
+        yield item * 10
+
+    async def write(task, item):
+        written.append((task.path, item))
+
+    pipeline = Pipeline(
+        [
+            Stage('parse', parse),
+            Stage('transform', transform, workers=workers),
+            Stage('write', write, workers=workers, queue_size=1),
+        ],
+        on_error=lambda task, stage, e: errors.append((task.path, stage, str(e))),
+        on_done=lambda task: done.append((task.path, task.failed)),
+    )
+    tasks = asyncio.run(asyncio.wait_for(pipeline.run(list(files)), timeout=10))
+    return tasks, written, errors, done
+
+
+def test_all_items_reach_the_last_stage():
+    tasks, written, errors, done = _run_pipeline({'a': [1, 2, 3], 'b': [4, 5]}, fail_on=-1)
+
+    assert sorted(written) == [('a', 10), ('a', 20), ('a', 30), ('b', 40), ('b', 50)]
+    assert errors == []
+    assert sorted(done) == [('a', False), ('b', False)]
+    assert all(task.pending == 0 for task in tasks)
+
+
+def test_failure_is_reported_once_and_drops_the_file():
+    tasks, written, errors, done = _run_pipeline({'a': list(range(1, 50)), 'b': [100, 200]}, fail_on=3)
+
+    assert errors == [('a', 'transform', 'bad item 3')]
+    assert sorted(done) == [('a', True), ('b', False)]
+    assert ('a', 30) not in written
+    # Items parsed after the failure are dropped
+    assert len([path for path, _ in written if path == 'a']) < 48
+    assert sorted(item for path, item in written if path == 'b') == [1000, 2000]
+    assert {task.path: task.failed for task in tasks} == {'a': True, 'b': False}
+
+
+def test_failure_in_the_first_stage():
+    async def parse(task, path):
+        if path == 'broken':
+            raise OSError("unreadable")
+        yield path
+
+    errors, done = [], []
+
+    async def write(task, item):
+        pass
+
+    pipeline = Pipeline(
+        [Stage('parse', parse), Stage('write', write)],
+        on_error=lambda task, stage, e: errors.append((task.path, stage)),
+        on_done=lambda task: done.append(task.path),
+    )
+    asyncio.run(asyncio.wait_for(pipeline.run(['ok', 'broken']), timeout=10))
+
+    assert errors == [('broken', 'parse')]
+    assert sorted(done) == ['broken', 'ok']
@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+import pytest
+
+from Utills import TokenBucket
+from Utils import MAX_BACKOFF_SECONDS, MAX_RATE_LIMIT_RETRIES, SECONDS_BETWEEN_REQUESTS, RateLimitedError, \
+    rate_limit_backoff
+
+
+def test_token_bucket_bursts_then_waits():
+    async def acquire_all():
+        bucket = TokenBucket(rate=50, capacity=5)
+        start = time.monotonic()
+        for _ in range(5):
+            await bucket.acquire()
+        burst = time.monotonic() - start
+        for _ in range(5):
+            await bucket.acquire()
+        return burst, time.monotonic() - start
+
+    burst, total = asyncio.run(acquire_all())
+    assert burst < 0.05
+    # 5 tokens over capacity at 50 per second
+    assert total >= 0.09
+
+
+def test_token_bucket_shared_by_tasks():
+    async def acquire_concurrently():
+        bucket = TokenBucket.per_minute(60 * 100, capacity=1)
+        start = time.monotonic()
+        await asyncio.gather(*[bucket.acquire() for _ in range(11)])
+        return time.monotonic() - start
+
+    assert asyncio.run(acquire_concurrently()) >= 0.09
+
+
+def test_backoff_doubles_up_to_the_limit():
+    delays = [rate_limit_backoff({}, attempt) for attempt in range(1, MAX_RATE_LIMIT_RETRIES + 1)]
+
+    assert delays[0] == SECONDS_BETWEEN_REQUESTS * 10
+    assert all(delay == min(prev * 2, MAX_BACKOFF_SECONDS) for prev, delay in zip(delays, delays[1:]))
+    assert max(delays) <= MAX_BACKOFF_SECONDS
+
+
+def test_backoff_uses_retry_after():
+    assert rate_limit_backoff({'Retry-After': '7'}, 3) == 7
+    assert rate_limit_backoff({'Retry-After': '100000'}, 1) == MAX_BACKOFF_SECONDS
+    # HTTP-date values are not parsed, the doubled default is used
+    assert rate_limit_backoff({'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}, 2) == SECONDS_BETWEEN_REQUESTS * 20
+
+
+def test_backoff_gives_up():
+    with pytest.raises(RateLimitedError):
+        rate_limit_backoff({}, MAX_RATE_LIMIT_RETRIES + 1)
@@ -0,0 +1,81 @@
+import csv
+import gzip
+from datetime import datetime
+
+import pyarrow.parquet as pq
+import pytest
+
+from DATABASE import FlightSummary
+from Sinks import FLIGHT_SUMMARY_FIELDS, CsvSink, ParquetSink
+
+
+def _flight(i: int, day: int = 1, operator: str | None = 'AAL') -> dict:
+    return {
+        'fr24_id': f'id{i}',
+        'flight': f'AA{i}',
+        'painted_as': operator,
+        'datetime_takeoff': datetime(2025, 3, day, 12, 0),
+        'flight_time': 3600 + i,
+        'flight_ended': True,
+    }
+
+
+def _read_csv(path) -> list[dict]:
+    opener = gzip.open if path.suffix == '.gz' else open
+    with opener(path, 'rt', newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_csv_rotates_by_size(tmp_path, compress):
+    with CsvSink(str(tmp_path / 'flights.csv'), FLIGHT_SUMMARY_FIELDS, compress=compress, flush_rows=10,
+                 max_bytes=200) as sink:
+        for start in range(0, 50, 5):
+            sink.write([_flight(i) for i in range(start, start + 5)])
+
+    assert sink.rows_written == 50
+    assert len(sink.files) > 1
+    assert [path.name for path in sink.files][:2] == \
+        [f'flights_{part:04d}.csv{".gz" if compress else ""}' for part in (1, 2)]
+
+    rows = [row for path in sink.files for row in _read_csv(path)]
+    assert [row['fr24_id'] for row in rows] == [f'id{i}' for i in range(50)]
+    assert rows[0]['flight_time'] == '3600'
+
+
+def test_csv_without_rotation_appends(tmp_path):
+    path = tmp_path / 'flights.csv'
+    for run in range(2):
+        with CsvSink(str(path), FLIGHT_SUMMARY_FIELDS) as sink:
+            sink.write([_flight(run)])
+
+    assert sink.files == [path]
+    assert [row['fr24_id'] for row in _read_csv(path)] == ['id0', 'id1']
+
+
+def test_parquet_parts_per_flush(tmp_path):
+    sink = ParquetSink(str(tmp_path), FlightSummary, FLIGHT_SUMMARY_FIELDS, date_field='datetime_takeoff',
+                       flush_rows=4)
+    sink.write([_flight(i, day=1) for i in range(3)])
+    assert sink.files == []
+
+    sink.write([_flight(3, day=2), _flight(4, day=2, operator=None)])
+    # Every flush leaves complete parts, readable before the sink is closed
+    assert len(sink.files) == 3
+    assert pq.read_table(sink.files[0]).num_rows == 3
+
+    sink.write([_flight(i, day=1) for i in range(5, 9)])
+    sink.close()
+
+    partitions = sorted(path.relative_to(tmp_path).parent.as_posix() for path in sink.files)
+    assert partitions == [
+        'date=2025-03-01/operator=AAL',
+        'date=2025-03-01/operator=AAL',
+        'date=2025-03-02/operator=AAL',
+        'date=2025-03-02/operator=unknown',
+    ]
+    assert not list(tmp_path.rglob('.*.tmp'))
+
+    table = pq.read_table(tmp_path / 'date=2025-03-01' / 'operator=AAL', schema=sink.schema)
+    assert sorted(table.column('fr24_id').to_pylist()) == sorted(f'id{i}' for i in [0, 1, 2, 5, 6, 7, 8])
+    assert sink.rows_written == 9